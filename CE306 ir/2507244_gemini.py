@@ -1,11 +1,12 @@
 import argparse
 import json
-import os
 import re
+import time
 from typing import Any, Dict, List, Tuple
 
-# Gemini SDK: pip install google-genai
-from google import genai
+# Model calls, retries and the response cache; the Gemini SDK (pip install google-genai)
+# is only imported when the real API is used
+from ne_pipeline import DEFAULT_WORKERS, ResponseCache, make_backend, run_prompts
 
 
 def load_gold(path: str) -> Dict[str, Any]:
@@ -91,34 +92,49 @@ def collect_supporting_text(query_obj: Dict[str, Any], max_chars: int = 6000) ->
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--gold", required=True, help="Path to your *_queries.json (gold standard)")
-    ap.add_argument("--pick", nargs="+", type=int, required=True, help="Pick 5 query numbers, e.g. --pick 3 7 10 14 19")
+    which = ap.add_mutually_exclusive_group(required=True)
+    which.add_argument("--pick", nargs="+", type=int, help="Pick 5 query numbers, e.g. --pick 3 7 10 14 19")
+    which.add_argument("--all", action="store_true", help="Check every query in the gold standard")
     ap.add_argument("--model", default="models/gemini-2.5-flash", help="Gemini model name")
+    ap.add_argument("--backend", default="gemini",
+                    help="'gemini', or the URL of a stub server (python ne_pipeline.py serve)")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Prompts in flight at once")
+    ap.add_argument("--rpm", type=float, default=0, help="Max requests per minute (0 = no limit)")
+    ap.add_argument("--cache", default="gemini_cache", help="Response cache directory ('' = no cache)")
+    ap.add_argument("--offline", action="store_true", help="Only use cached responses, never call the model")
+    ap.add_argument("--out", help="Also write the per-query results to this JSON file")
     args = ap.parse_args()
 
-    api_key = os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        raise RuntimeError(
-            "Missing API key. Set environment variable GEMINI_API_KEY (recommended) "
-            "or GOOGLE_API_KEY before running."
-        )
-
-    client = genai.Client(api_key=api_key)
-
     gold = load_gold(args.gold)
-    picked = pick_queries(gold, args.pick)
+    picked = gold.get("queries", []) if args.all else pick_queries(gold, args.pick)
 
     print("=== Gemini NE Check ===")
     print(f"Gold: {args.gold}")
     print(f"Model: {args.model}")
-    print(f"Picked queries: {args.pick}")
+    print(f"Picked queries: {'all ' + str(len(picked)) if args.all else args.pick}")
     print()
 
+    # Build every prompt first, then send them all together (in parallel, cached, with retries)
+    jobs = []
     for q in picked:
+        supporting_text = collect_supporting_text(q)
+        answer_type = normalize_answer_type(q.get("answer_type", ""))
+        prompt = build_prompt(answer_type, q.get("exact_answers", []), supporting_text) if supporting_text else None
+        jobs.append((q, answer_type, supporting_text, prompt))
+
+    backend = None if args.offline else make_backend(args.backend)
+    cache = ResponseCache(args.cache) if args.cache else None
+    start = time.perf_counter()
+    answers = iter(run_prompts([p for _, _, _, p in jobs if p], backend, args.model, cache,
+                               workers=args.workers, rpm=args.rpm, offline=args.offline))
+    elapsed = time.perf_counter() - start
+
+    report = []
+    counts = {"checked": 0, "cached": 0, "failed": 0, "correct": 0}
+    for q, answer_type, supporting_text, prompt in jobs:
         qnum = q.get("number")
         original = q.get("original_query", "")
-        answer_type = normalize_answer_type(q.get("answer_type", ""))
         exact_answers = q.get("exact_answers", [])
-        supporting_text = collect_supporting_text(q)
 
         print("------------------------------------------------------------")
         print(f"Q{qnum}: {original}")
@@ -126,18 +142,19 @@ def main():
         print(f"exact_answers: {exact_answers}")
         print(f"supporting_text_chars: {len(supporting_text)}")
 
-        if not supporting_text:
+        if prompt is None:
             print("No supporting sentences found in gold standard for this query (matches[] empty). Skipping.")
             continue
 
-        prompt = build_prompt(answer_type, exact_answers, supporting_text)
-
-        resp = client.models.generate_content(
-            model=args.model,
-            contents=prompt,
-        )
+        answer = next(answers)
+        if answer["error"]:
+            counts["failed"] += 1
+            print("Gemini call failed:", answer["error"])
+            continue
+        counts["checked"] += 1
+        counts["cached"] += answer["cached"]
 
-        text = resp.text or ""
+        text = answer["text"] or ""
         try:
             data = safe_parse_json(text)
         except Exception as e:
@@ -157,10 +174,30 @@ def main():
 
         # simple automatic judgement: do we see at least one exact answer matched?
         auto_correct = len(matched_answers) > 0
+        counts["correct"] += auto_correct
         print("Auto-judgement (has matched answer):", auto_correct)
 
+        report.append({
+            "number": qnum,
+            "answer_type": answer_type,
+            "exact_answers": exact_answers,
+            "entities": entities,
+            "matched_answers": matched_answers,
+            "matches_exact_answers": matches_exact,
+            "auto_correct": auto_correct,
+            "cached": answer["cached"],
+        })
+
+    print("------------------------------------------------------------")
+    print(f"Checked {counts['checked']} queries ({counts['cached']} from cache, {counts['failed']} failed) "
+          f"in {elapsed:.1f}s; auto-judged correct: {counts['correct']}/{counts['checked']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Wrote: {args.out}")
+
     print("\nDone.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
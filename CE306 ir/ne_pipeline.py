@@ -0,0 +1,290 @@
+"""
+Concurrent, cached and replayable pipeline for the named-entity checks in 2507244_gemini.py.
+
+- Bounded parallelism: at most `workers` prompts in flight, optionally at most `rpm` per minute.
+- Retries with exponential backoff (and jitter) on transient errors: 429, 5xx, timeouts.
+- Content-addressed response cache: key = sha256(model + prompt), one small JSON file per
+  response under <cache>/<first 2 hex>/<key>.json. An unchanged prompt is never paid for twice,
+  and the cache directory can be copied around and replayed offline.
+- Pluggable backends:
+    GeminiBackend   the real API (google-genai, imported only when used)
+    HttpBackend     any server that answers POST {"model", "prompt"} with {"text"}
+    (offline mode)  cache only; a miss is reported instead of calling anything
+- A local stub server (`python ne_pipeline.py serve`) answers from a cache directory of
+  recorded responses and otherwise makes up a plausible answer from the prompt, so tests and
+  benchmarks run without an API key.
+
+Usage from Python:
+    backend = make_backend("gemini")
+    results = run_prompts(prompts, backend, "models/gemini-2.5-flash", cache=ResponseCache("gemini_cache"))
+
+Stub server:
+    python ne_pipeline.py serve --port 8765 --cache gemini_cache --latency 0.2
+    python 2507244_gemini.py --gold 2507244_queries.json --all --backend http://localhost:8765
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_WORKERS = 4
+DEFAULT_ATTEMPTS = 5
+DEFAULT_BACKOFF = 1.0        # seconds before the first retry, doubled each time
+MAX_BACKOFF = 30.0
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+def prompt_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed store of model responses. Safe to share between threads and processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                return json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key: str, model: str, text: str) -> None:
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so a reader never sees half a file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "text": text, "created": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def __len__(self) -> int:
+        return sum(1 for _, _, files in os.walk(self.path) for name in files if name.endswith(".json"))
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class GeminiBackend:
+    """The Gemini API. Needs google-genai and GEMINI_API_KEY (or GOOGLE_API_KEY)."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        api_key = api_key or os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError(
+                "Missing API key. Set environment variable GEMINI_API_KEY (recommended) "
+                "or GOOGLE_API_KEY before running."
+            )
+        # Gemini SDK: pip install google-genai
+        from google import genai
+        self.client = genai.Client(api_key=api_key)
+
+    def generate(self, model: str, prompt: str) -> str:
+        resp = self.client.models.generate_content(model=model, contents=prompt)
+        return resp.text or ""
+
+
+class HttpBackend:
+    """POST {"model": ..., "prompt": ...} to url, expects {"text": ...} back (see serve_stub)."""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url.rstrip("/") + "/generate"
+        self.timeout = timeout
+
+    def generate(self, model: str, prompt: str) -> str:
+        body = json.dumps({"model": model, "prompt": prompt}).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))["text"]
+
+
+def make_backend(name: str) -> Any:
+    """"gemini" -> GeminiBackend, "http://host:port" -> HttpBackend."""
+    if name == "gemini":
+        return GeminiBackend()
+    if name.startswith(("http://", "https://")):
+        return HttpBackend(name)
+    raise ValueError(f"Unknown backend {name!r} (use 'gemini' or a stub server URL)")
+
+
+# ---------------------------------------------------------------------------
+# Retries and rate limit
+# ---------------------------------------------------------------------------
+
+def is_transient(exc: BaseException) -> bool:
+    """Worth retrying: rate limits, server errors, timeouts and dropped connections."""
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code in TRANSIENT_STATUS
+    return isinstance(exc, (TimeoutError, ConnectionError, urllib.error.URLError))
+
+
+def call_with_backoff(fn: Callable[[], str], attempts: int = DEFAULT_ATTEMPTS,
+                      backoff: float = DEFAULT_BACKOFF) -> str:
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not is_transient(e):
+                raise
+            # full jitter, so workers that failed together do not retry together
+            time.sleep(random.uniform(0, min(MAX_BACKOFF, backoff * 2 ** attempt)))
+    raise RuntimeError("unreachable")
+
+
+class RateLimiter:
+    """At most `per_minute` calls per minute across all threads (0 = no limit)."""
+
+    def __init__(self, per_minute: float = 0):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def run_prompts(prompts: List[str], backend: Any, model: str, cache: Optional[ResponseCache] = None,
+                workers: int = DEFAULT_WORKERS, rpm: float = 0, offline: bool = False,
+                attempts: int = DEFAULT_ATTEMPTS) -> List[Dict[str, Any]]:
+    """
+    Send every prompt (in parallel, cached, with retries). Returns one dict per prompt, in order:
+        {"text": str or None, "cached": bool, "seconds": float, "error": str or None}
+    Identical prompts are only sent once. With offline=True nothing is sent: a cache miss
+    comes back with error "not in cache".
+    """
+    limiter = RateLimiter(rpm)
+    keys = [prompt_key(model, p) for p in prompts]
+    unique: Dict[str, str] = dict(zip(keys, prompts))
+    answers: Dict[str, Dict[str, Any]] = {}
+
+    def one(key: str) -> Tuple[str, Dict[str, Any]]:
+        text = cache.get(key) if cache is not None else None
+        if text is not None:
+            return key, {"text": text, "cached": True, "seconds": 0.0, "error": None}
+        if offline or backend is None:
+            return key, {"text": None, "cached": False, "seconds": 0.0, "error": "not in cache"}
+        start = time.perf_counter()
+        try:
+            def send() -> str:
+                limiter.wait()
+                return backend.generate(model, unique[key])
+            text = call_with_backoff(send, attempts)
+        except Exception as e:
+            return key, {"text": None, "cached": False, "seconds": time.perf_counter() - start,
+                         "error": f"{type(e).__name__}: {e}"}
+        if cache is not None:
+            cache.put(key, model, text)
+        return key, {"text": text, "cached": False, "seconds": time.perf_counter() - start, "error": None}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for key, answer in pool.map(one, list(unique)):
+            answers[key] = answer
+    return [answers[k] for k in keys]
+
+
+# ---------------------------------------------------------------------------
+# Stub server
+# ---------------------------------------------------------------------------
+
+def fake_answer(prompt: str) -> str:
+    """
+    Made-up but well-formed answer for the build_prompt() format: the exact answers that
+    appear in the TEXT section count as the extracted entities.
+    """
+    m = re.search(r"^exact_answers: (.*)$", prompt, flags=re.M)
+    answers = json.loads(m.group(1)) if m else []
+    text = prompt.split("\nTEXT:\n", 1)[-1].lower()
+    matched = [a for a in answers if a and a.lower() in text]
+    return json.dumps({"entities": matched, "matches_exact_answers": bool(matched), "matched_answers": matched})
+
+
+def serve_stub(port: int = 8765, cache_dir: Optional[str] = None, latency: float = 0.0,
+               error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Start the stub server in a background thread and return it (call .shutdown() to stop).
+    Answers from cache_dir (recorded responses) if the prompt is there, else fake_answer().
+    latency adds a delay per request; error_rate answers that fraction with 503 to exercise retries.
+    """
+    cache = ResponseCache(cache_dir) if cache_dir else None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            n = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(n).decode("utf-8"))
+            if latency:
+                time.sleep(latency)
+            if error_rate and random.random() < error_rate:
+                self.send_error(503, "stub overloaded")
+                return
+            text = cache.get(prompt_key(req["model"], req["prompt"])) if cache is not None else None
+            if text is None:
+                text = fake_answer(req["prompt"])
+            out = json.dumps({"text": text}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Local stub of the model API for tests and benchmarks.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="run the stub server")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--cache", default=None, help="Directory of recorded responses (a ResponseCache)")
+    p.add_argument("--latency", type=float, default=0.0, help="Seconds to wait per request")
+    p.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = ap.parse_args()
+
+    server = serve_stub(args.port, args.cache, args.latency, args.error_rate)
+    print(f"Stub model server on http://127.0.0.1:{args.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+一个命令行入口，所有功能都是子命令。在仓库根目录用 python -m ir ...，在 ir/ 目录里用 python . ...：
+
+    python -m ir index result_v3_utf8_2500_docs.json student_index [--build] [--resume] [--delta] ...
+    python -m ir search "akio morita" [--index student_index] [--size 10] [--json]
+    python -m ir eval [gold_standard_v5.json] [--async] [--cache results_cache.sqlite] [--depth 1000]
+    python -m ir eval big_gold.json --stream [--batch-size 200] [--workers 4] [--csv per_query.csv]
+    python -m ir make-results [--queries 2507244_queries.json] [--out 2507244_results.json]
+    python -m ir fix-results [results.json queries.json store_dir] [--export out.json]
+    python -m ir sweep ...          （同 sweep.py）
+    python -m ir significance ...   （同 significance.py）
+    python -m ir answers ...        （同 answer_matcher.py）
+    python -m ir profile ...        （同 query_profile.py）
+    python -m ir bench ...          （同 bench.py：合成数据 + ES 替身上的基准测试）
+    python -m ir compress ...       （同 compressed_input.py：压缩集合文件、看压缩比、测读取速度）
+    python -m ir deep ...           （同 deep_search.py：只要 DocID 和分数，PIT + search_after 深度翻页）
+    python -m ir shadow ...         （同 shadow.py：查询同时发给两个索引 / 集群，比较排名和延迟）
+    python -m ir dense ...          （同 dense_index.py：LSA 稠密向量 + IVF，和词法结果 RRF 融合）
+    python -m ir rerank train|eval  （同 reranker.py：前 40 个结果的第二阶段重排，用 gold 的 matches 训练）
+
+全局选项（写在子命令前面）：
+    --es-url URL    Elasticsearch 地址（默认 IR_ES_URL 或 http://localhost:9200）
+    --timing        最后在 stderr 打印启动（import）和执行各用了多少毫秒
+
+每个子命令只 import 自己要用的模块，elasticsearch 包和客户端也是第一次真正发请求时才
+加载 / 创建（es_client.py），所以 --help、fix-results、本地索引（IR_LOCAL_INDEX）的
+search / eval 都不用付 import elasticsearch 的时间。整个进程只有一个客户端。
+"""
+
+import time
+
+_START = time.perf_counter()
+
+import argparse
+import os
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 模块都是 ir/ 下面的平铺脚本，互相直接 import
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def cmd_index(argv: List[str]) -> None:
+    from idc_index_doc_collection_v7 import idc_main
+    idc_main(argv)
+
+
+def cmd_search(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(prog="ir search", description="Search the index (idc_search).")
+    ap.add_argument("query")
+    ap.add_argument("--index", default="student_index")
+    ap.add_argument("--size", type=int, default=10, help="Hits to print")
+    ap.add_argument("--json", action="store_true", help="Print the raw response")
+    args = ap.parse_args(argv)
+
+    import json
+    from idc_index_doc_collection_v7 import idc_search
+
+    result = idc_search(args.query, args.index)
+    body = result.body if hasattr(result, "body") else result
+    if args.json:
+        print(json.dumps(body, ensure_ascii=False, indent=2))
+        return
+    hits = body["hits"]["hits"]
+    print(f"{body['hits']['total']['value']} hits")
+    for rank, hit in enumerate(hits[:args.size], 1):
+        title = (hit.get("_source") or {}).get("title", "")
+        print(f"{rank}\t{hit['_id']}\t{hit['_score']:.3f}\t{title}")
+
+
+def cmd_eval(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(prog="ir eval", description="Evaluate a gold standard file (eqs_eval).")
+    ap.add_argument("gold", nargs="?", default="gold_standard_v5.json")
+    ap.add_argument("--cache", default=None, help="Result cache file (result_cache.py)")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="Send the queries concurrently (eqs_eval_async, needs aiohttp)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=50.0)
+    ap.add_argument("--depth", type=int, default=40,
+                    help="Hits per query; deeper than 40 adds P/R@100 and P/R@depth (e.g. 1000 for R@1000)")
+    ap.add_argument("--stream", action="store_true",
+                    help="Parse, search and score in a pipeline with flat memory (eqs_eval_stream)")
+    ap.add_argument("--batch-size", type=int, default=200, help="Queries per batch with --stream")
+    ap.add_argument("--workers", type=int, default=4, help="Search threads with --stream")
+    ap.add_argument("--csv", default=None, help="Per-query measures with --stream")
+    args = ap.parse_args(argv)
+
+    import eqs_evaluate_query_set_v5 as eqs
+
+    if args.stream:
+        eqs.eqs_eval_stream(args.gold, args.cache, depth=args.depth, batch_size=args.batch_size,
+                            workers=args.workers, csv_file=args.csv)
+    elif args.use_async:
+        eqs.eqs_eval_async(args.gold, args.concurrency, args.rate)
+    else:
+        eqs.eqs_eval(args.gold, args.cache, depth=args.depth)
+
+
+def cmd_make_results(argv: List[str]) -> None:
+    import make_results
+
+    ap = argparse.ArgumentParser(prog="ir make-results", description="Run all queries and write the results file.")
+    ap.add_argument("--queries", default=make_results.INPUT_QUERIES_FILE)
+    ap.add_argument("--out", default=make_results.OUTPUT_RESULTS_FILE)
+    ap.add_argument("--index", default=make_results.INDEX)
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--profile", default=None, metavar="CSV",
+                    help="Afterwards profile every query and write the timings to this CSV")
+    args = ap.parse_args(argv)
+
+    make_results.INPUT_QUERIES_FILE = args.queries
+    make_results.OUTPUT_RESULTS_FILE = args.out
+    make_results.INDEX = args.index
+    if args.no_cache:
+        make_results.USE_CACHE = False
+    if args.profile:
+        make_results.PROFILE_FILE = args.profile
+    make_results.main()
+
+
+def cmd_fix_results(argv: List[str]) -> None:
+    # 默认值和 fix_results.py 一样
+    ap = argparse.ArgumentParser(prog="ir fix-results",
+                                 description="Join a results file with the queries file into a run store.")
+    ap.add_argument("results", nargs="?", default="2507244_results.json")
+    ap.add_argument("queries", nargs="?", default="2507244_queries.json")
+    ap.add_argument("store", nargs="?", default="2507244_runs")
+    ap.add_argument("--export", default=None, help="Also write the legacy results JSON to this file")
+    args = ap.parse_args(argv)
+
+    import run_store
+    run_store.main(["merge", args.results, args.queries, args.store]
+                   + (["--export", args.export] if args.export else []))
+
+
+def cmd_sweep(argv: List[str]) -> None:
+    import sweep
+    sweep.main(argv)
+
+
+def cmd_significance(argv: List[str]) -> None:
+    import significance
+    significance.main(argv)
+
+
+def cmd_answers(argv: List[str]) -> None:
+    import answer_matcher
+    answer_matcher.main(argv)
+
+
+def cmd_profile(argv: List[str]) -> None:
+    import query_profile
+    query_profile.main(argv)
+
+
+def cmd_compress(argv: List[str]) -> None:
+    import compressed_input
+    compressed_input.main(argv)
+
+
+def cmd_deep(argv: List[str]) -> None:
+    import deep_search
+    deep_search.main(argv)
+
+
+def cmd_shadow(argv: List[str]) -> None:
+    import shadow
+    code = shadow.main(argv)
+    if code:                                # --min-rbo / --max-map-drop 没过：退出码 1
+        sys.exit(code)
+
+
+def cmd_dense(argv: List[str]) -> None:
+    import dense_index
+    dense_index.main(argv)
+
+
+def cmd_rerank(argv: List[str]) -> None:
+    import reranker
+    reranker.main(argv)
+
+
+def cmd_bench(argv: List[str]) -> None:
+    import bench
+    code = bench.main(argv)
+    if code:                                # compare 发现变慢了：退出码 1，方便脚本里检查
+        sys.exit(code)
+
+
+COMMANDS: Dict[str, Tuple[Callable[[List[str]], None], str]] = {
+    "index": (cmd_index, "index a .json collection (idc_index_doc_collection_v7.py)"),
+    "search": (cmd_search, "search the index and print the top hits"),
+    "eval": (cmd_eval, "evaluate the gold standard queries (eqs_evaluate_query_set_v5.py)"),
+    "make-results": (cmd_make_results, "run all queries and write the results file (make_results.py)"),
+    "fix-results": (cmd_fix_results, "join results with the queries file into a run store (run_store.py)"),
+    "sweep": (cmd_sweep, "try many kibana_query templates (sweep.py)"),
+    "significance": (cmd_significance, "significance tests between runs (significance.py)"),
+    "answers": (cmd_answers, "exact-answer accuracy@k of the retrieved documents (answer_matcher.py)"),
+    "compress": (cmd_compress, "compress a collection into frames that index in parallel (compressed_input.py)"),
+    "deep": (cmd_deep, "IDs-and-scores search, point-in-time deep paging (deep_search.py)"),
+    "shadow": (cmd_shadow, "send each query to two indices/clusters, diff rankings and latency (shadow.py)"),
+    "dense": (cmd_dense, "LSA dense vector index, IVF search, RRF hybrid with lexical runs (dense_index.py)"),
+    "rerank": (cmd_rerank, "train/evaluate a second-stage reranker for the top hits (reranker.py)"),
+    "bench": (cmd_bench, "benchmarks on synthetic data and a local stand-in (bench.py, es_standin.py)"),
+    "profile": (cmd_profile, "server-side profile of every query, per-clause cost report (query_profile.py)"),
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(
+        prog="ir", description="CE306 information retrieval tools.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<14}{text}" for name, (_, text) in COMMANDS.items()))
+    ap.add_argument("--es-url", default=None, help="Elasticsearch URL (default: $IR_ES_URL or http://localhost:9200)")
+    ap.add_argument("--timing", action="store_true", help="Print startup and run time to stderr")
+    ap.add_argument("command", choices=list(COMMANDS), metavar="command")
+    ap.add_argument("args", nargs=argparse.REMAINDER)
+    args = ap.parse_args(argv)
+
+    if args.es_url:
+        import es_client
+        es_client.configure(args.es_url)
+
+    handler = COMMANDS[args.command][0]
+    started = time.perf_counter()
+    try:
+        handler(args.args)
+    finally:
+        if args.timing:
+            done = time.perf_counter()
+            print(f"[timing] startup {(started - _START) * 1000:.0f} ms, "
+                  f"{args.command} {(done - started) * 1000:.0f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
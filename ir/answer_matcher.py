@@ -0,0 +1,313 @@
+"""
+不用大模型、不截断地检查检索结果里有没有标准答案（exact_answers）。
+
+2507244_gemini.py 是把 gold 句子拼起来（最多 6000 个字符）交给 Gemini，让它判断哪些
+exact_answers 出现在文本里——其实就是不区分大小写的子串检查。这里在本地做同样的事，而且
+检查的是 keyword_query / kibana_query 每个返回结果的完整 parsedParagraphs：
+
+    1. gold standard 里所有查询的 exact_answers 规范化（Unicode NFKC + casefold，
+       空白合并成一个空格）后编进一个 Aho-Corasick 自动机
+    2. 每个要看的文档（所有 run 返回的 DocID 去重）只扫一遍，得到文档里出现的全部答案
+    3. 第 r 名的文档包含这个查询自己的某个答案，就是“有答案的结果”（answer-bearing hit）
+    4. accuracy@k = 前 k 个结果里至少有一个有答案的查询比例；MRR = 第一个有答案结果名次的倒数的平均
+
+默认按整词匹配（"1946" 不会匹配 "19461"），--substring 改成和 Gemini 提示里一样的子串匹配。
+
+文档内容从哪里来（按顺序）：--collection 指定的集合文件（idc 用的 bulk 格式 .json）；
+设置了 IR_LOCAL_INDEX 就用本地索引建索引时的集合文件；否则用 Elasticsearch 的 _mget。
+
+用法：
+    python answer_matcher.py 2507244_results_fixed_v2.json
+    python answer_matcher.py 2507244_results.json --gold 2507244_queries.json --collection result_v3_utf8_2500_docs.json
+    python answer_matcher.py 2507244_runs --ks 1 5 10 40 --details --json answers.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import unicodedata
+from collections import deque
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from json_stream import JsonArrayStream
+from run_store import RunStore, load_runs
+
+DEFAULT_KS = (1, 3, 5, 10, 20, 40)
+DEFAULT_FIELDS = ("title", "parsedParagraphs")
+MGET_BATCH = 500
+
+
+# ---------------------------------------------------------------------------
+# 规范化和自动机
+# ---------------------------------------------------------------------------
+
+def fold(text: str, strip_accents: bool = False) -> str:
+    """NFKC + casefold（再 NFKC 一次，casefold 可能产生非规范形式），空白合并成一个空格。"""
+    text = unicodedata.normalize("NFKC", unicodedata.normalize("NFKC", text).casefold())
+    if strip_accents:
+        text = "".join(ch for ch in unicodedata.normalize("NFD", text) if not unicodedata.combining(ch))
+        text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split())
+
+
+class AhoCorasick:
+    """
+    多模式串匹配：所有模式一起编成一个自动机，文本只扫一遍就找到所有出现的模式。
+    goto[节点] 是 {字符: 子节点}，fail 是失败指针，out[节点] 是在这里结束的模式编号
+    （已经合并了失败链上的输出）。
+    """
+
+    def __init__(self, patterns: Sequence[str]):
+        self.patterns = list(patterns)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Tuple[int, ...]] = [()]
+        for pid, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] += (pid,)
+
+        # 按层（BFS）算失败指针，父节点的一定先算好
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                self.out[child] += self.out[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """产生 (结束位置, 模式编号)，结束位置是模式最后一个字符的下标。"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for pid in out[node]:
+                    yield i, pid
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+
+# ---------------------------------------------------------------------------
+# 答案匹配
+# ---------------------------------------------------------------------------
+
+class AnswerMatcher:
+    """
+    answers: {查询编号: [exact answers]}。相同的答案（规范化以后）只进自动机一次。
+    scan() 返回一个文档里出现的答案编号集合，bearing() 判断其中有没有某个查询的答案。
+    """
+
+    def __init__(self, answers: Dict[Any, Sequence[str]], whole_words: bool = True,
+                 strip_accents: bool = False):
+        self.whole_words = whole_words
+        self.strip_accents = strip_accents
+        ids: Dict[str, int] = {}
+        self.query_answers: Dict[Any, FrozenSet[int]] = {}
+        for number, values in answers.items():
+            pids = set()
+            for value in values or ():
+                pattern = fold(str(value), strip_accents)
+                if pattern:
+                    pids.add(ids.setdefault(pattern, len(ids)))
+            if pids:
+                self.query_answers[number] = frozenset(pids)
+        self.automaton = AhoCorasick(list(ids))
+
+    def scan(self, parts: Iterable[str]) -> FrozenSet[int]:
+        """
+        一个文档的所有文本段（标题、每个段落）。每段分别规范化，段之间用换行隔开，
+        答案里没有换行，所以不会跨段匹配。
+        """
+        text = "\n".join(fold(p, self.strip_accents) for p in parts)
+        patterns = self.automaton.patterns
+        found = set()
+        for end, pid in self.automaton.iter_matches(text):
+            if pid in found:
+                continue
+            if self.whole_words:
+                start = end - len(patterns[pid]) + 1
+                if (start > 0 and text[start - 1].isalnum() and text[start].isalnum()) or \
+                        (end + 1 < len(text) and text[end + 1].isalnum() and text[end].isalnum()):
+                    continue
+            found.add(pid)
+        return frozenset(found)
+
+    def bearing(self, number: Any, found: FrozenSet[int]) -> bool:
+        answers = self.query_answers.get(number)
+        return bool(answers and not answers.isdisjoint(found))
+
+
+def source_parts(source: Dict[str, Any], fields: Sequence[str] = DEFAULT_FIELDS) -> List[str]:
+    parts: List[str] = []
+    for field in fields:
+        value = source.get(field)
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, list):
+            parts.extend(v for v in value if isinstance(v, str))
+    return parts
+
+
+# ---------------------------------------------------------------------------
+# 取文档
+# ---------------------------------------------------------------------------
+
+def iter_collection(path: str, wanted: Optional[set] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    读 bulk 格式的集合文件（一行 {"index": {"_id": ...}}，一行文档），产生 (docid, source)。
+    给了 wanted 就只解析这些文档（其他的只读不解析）。集合文件可以是压缩的（compressed_input.py）。
+    """
+    from compressed_input import iter_pairs
+    for action, line in iter_pairs(path):
+        docid = json.loads(action)["index"]["_id"]
+        if wanted is None or docid in wanted:
+            yield docid, json.loads(line)
+
+
+def iter_es(docids: Sequence[str], index: str, fields: Sequence[str] = DEFAULT_FIELDS
+            ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """用 _mget 分批取文档（只取需要的字段）。"""
+    import es_client
+    es = es_client.get_client()
+    for start in range(0, len(docids), MGET_BATCH):
+        resp = es.mget(index=index, ids=list(docids[start:start + MGET_BATCH]), source_includes=list(fields))
+        for doc in resp["docs"]:
+            if doc.get("found"):
+                yield doc["_id"], doc.get("_source") or {}
+
+
+def scan_documents(matcher: AnswerMatcher, docs: Iterable[Tuple[str, Dict[str, Any]]],
+                   fields: Sequence[str] = DEFAULT_FIELDS) -> Dict[str, FrozenSet[int]]:
+    """{docid: 文档里出现的答案编号}，每个文档扫一遍。"""
+    return {docid: matcher.scan(source_parts(source, fields)) for docid, source in docs}
+
+
+# ---------------------------------------------------------------------------
+# 评估
+# ---------------------------------------------------------------------------
+
+def bearing_matrix(run: Dict[Any, Sequence[str]], numbers: Sequence[Any], matcher: AnswerMatcher,
+                   found: Dict[str, FrozenSet[int]], depth: int) -> np.ndarray:
+    """(查询数, depth) bool：第 i 个查询第 r 名的结果有没有答案。没取到内容的文档算没有。"""
+    empty: FrozenSet[int] = frozenset()
+    out = np.zeros((len(numbers), depth), dtype=bool)
+    for i, number in enumerate(numbers):
+        for r, docid in enumerate(list(run.get(number, ()))[:depth]):
+            out[i, r] = matcher.bearing(number, found.get(docid, empty))
+    return out
+
+
+def accuracy_at_k(bearing: np.ndarray, ks: Sequence[int] = DEFAULT_KS) -> Dict[str, float]:
+    """accuracy@k 和 MRR（第一个有答案结果名次的倒数，没有算 0）。"""
+    if bearing.shape[0] == 0:
+        return {**{f"acc@{k}": 0.0 for k in ks}, "MRR": 0.0}
+    seen = np.logical_or.accumulate(bearing, axis=1)
+    out = {f"acc@{k}": float(seen[:, min(k, bearing.shape[1]) - 1].mean()) for k in ks}
+    first = np.where(bearing.any(axis=1), bearing.argmax(axis=1) + 1, np.inf)
+    out["MRR"] = float((1.0 / first).mean())
+    return out
+
+
+def load_answers(path: str) -> Dict[Any, List[str]]:
+    """{number: exact_answers}，可以是 gold / queries / 合并过的 results 文件，或 run_store 目录。"""
+    if os.path.isdir(path):
+        with RunStore(path) as store:
+            return {n: store.meta(n).get("exact_answers") or [] for n in store.numbers()}
+    return {q["number"]: q.get("exact_answers") or [] for q in JsonArrayStream(path)}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Exact-answer accuracy@k of retrieved documents (Aho-Corasick).")
+    ap.add_argument("inputs", nargs="+", help="results JSON files or run store directories (optionally FILE:RUN)")
+    ap.add_argument("--gold", help="File with exact_answers (default: the first input)")
+    ap.add_argument("--collection", help="Collection file in bulk format (default: IR_LOCAL_INDEX's or Elasticsearch)")
+    ap.add_argument("--index", default="student_index", help="Elasticsearch index for _mget")
+    ap.add_argument("--fields", nargs="+", default=list(DEFAULT_FIELDS))
+    ap.add_argument("--ks", nargs="+", type=int, default=list(DEFAULT_KS))
+    ap.add_argument("--substring", action="store_true", help="Match anywhere, not only whole words")
+    ap.add_argument("--strip-accents", action="store_true", help="Also ignore accents (e -> e with acute)")
+    ap.add_argument("--details", action="store_true", help="Print the answer-bearing ranks of every query")
+    ap.add_argument("--json", help="Write per-query answer-bearing ranks to this file")
+    args = ap.parse_args(argv)
+
+    runs: Dict[str, Dict[Any, List[str]]] = {}
+    for spec in args.inputs:
+        prefix = os.path.basename(spec.rstrip("/\\")) + ":" if len(args.inputs) > 1 else ""
+        for name, run in load_runs(spec)[0].items():
+            runs[prefix + name] = run
+
+    answers_path = args.gold or args.inputs[0]
+    if not os.path.exists(answers_path) and ":" in answers_path:
+        answers_path = answers_path.rsplit(":", 1)[0]
+    answers = load_answers(answers_path)
+    matcher = AnswerMatcher(answers, whole_words=not args.substring, strip_accents=args.strip_accents)
+    numbers = [n for n in answers if n in matcher.query_answers]
+    if not numbers:
+        print("[ERROR] No exact_answers found (use --gold).")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    wanted = {d for run in runs.values() for n in numbers for d in run.get(n, ())}
+    collection = args.collection
+    if collection is None and os.environ.get("IR_LOCAL_INDEX"):
+        from local_bm25 import search_backend
+        collection = search_backend().meta.get("collection")
+    if collection:
+        docs = iter_collection(collection, wanted)
+        origin = collection
+    else:
+        docs = iter_es(sorted(wanted), args.index, args.fields)
+        origin = f"Elasticsearch index {args.index}"
+    found = scan_documents(matcher, docs, args.fields)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(numbers)} queries with exact_answers, {len(matcher.automaton.patterns)} distinct answers "
+          f"({len(matcher.automaton)} automaton states)")
+    print(f"Scanned {len(found)} of {len(wanted)} retrieved documents from {origin} in {elapsed:.2f}s")
+    depth = max(args.ks)
+    report: Dict[str, Dict[str, List[int]]] = {}
+    lines = ["run\t" + "\t".join(f"acc@{k}" for k in args.ks) + "\tMRR"]
+    for name, run in runs.items():
+        bearing = bearing_matrix(run, numbers, matcher, found, depth)
+        scores = accuracy_at_k(bearing, args.ks)
+        lines.append(f"{name}\t" + "\t".join(f"{v:.3f}" for v in scores.values()))
+        report[name] = {str(n): (np.flatnonzero(bearing[i]) + 1).tolist() for i, n in enumerate(numbers)}
+    print("-" * 60)
+    print("\n".join(lines))
+
+    if args.details:
+        for name, ranks in report.items():
+            print("-" * 60)
+            print(f"{name}: answer-bearing ranks per query")
+            for number, r in ranks.items():
+                print(f"Q{number}\t{r if r else 'none'}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[DONE] Wrote: {args.json}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+异步并发查询：同时保持多个查询在路上（concurrency），用令牌桶限速（rate），
+并记录每个查询的延迟，输出 p50/p95/p99。
+
+用法（命令行，回放一个查询文件）：
+    python async_runner.py 2507244_queries.json --concurrency 32 --rate 200
+    python async_runner.py query_log.ndjson --concurrency 32 --rate 200
+
+查询文件可以是 queries.json / gold standard（会跑 keyword_query 和 kibana_query），
+也可以是每行一个查询 body 的 NDJSON 日志。
+
+需要 aiohttp: pip install aiohttp
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import es_client
+from deep_search import ID_FILTER_PATH, lean_body
+
+ES_URL = es_client.ES_URL
+INDEX = "student_index"
+TOPK = 40
+
+DEFAULT_CONCURRENCY = 16     # 同时在路上的查询数
+DEFAULT_RATE = 50.0          # 每秒最多发多少个查询（0 = 不限速）
+
+
+class TokenBucket:
+    """
+    令牌桶：平均每秒 rate 个令牌，最多攒 burst 个。每个查询先拿一个令牌再发。
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LatencyHistogram:
+    """
+    延迟直方图：桶按对数划分（每个 2 倍区间分 BUCKETS_PER_DOUBLING 个桶），
+    内存固定，不管记录多少个查询。百分位数的误差在一个桶宽以内（约 9%）。
+    """
+
+    BUCKETS_PER_DOUBLING = 8
+    MIN_SECONDS = 1e-4           # 0.1 ms 以下都算进第一个桶
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, seconds: float) -> int:
+        if seconds <= self.MIN_SECONDS:
+            return 0
+        return int(math.log2(seconds / self.MIN_SECONDS) * self.BUCKETS_PER_DOUBLING) + 1
+
+    def _upper(self, bucket: int) -> float:
+        return self.MIN_SECONDS * 2 ** (bucket / self.BUCKETS_PER_DOUBLING)
+
+    def record(self, seconds: float) -> None:
+        b = self._bucket(seconds)
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p: float) -> float:
+        """返回第 p 百分位（秒），取所在桶的上界。"""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return min(self._upper(b), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """毫秒为单位的 count/mean/p50/p95/p99/max。"""
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.percentile(50),
+            "p95_ms": 1000 * self.percentile(95),
+            "p99_ms": 1000 * self.percentile(99),
+            "max_ms": 1000 * self.max,
+        }
+
+    def format(self, label: str = "latency") -> str:
+        s = self.summary()
+        return (f"{label}: n={s['count']} mean={s['mean_ms']:.1f}ms p50={s['p50_ms']:.1f}ms "
+                f"p95={s['p95_ms']:.1f}ms p99={s['p99_ms']:.1f}ms max={s['max_ms']:.1f}ms")
+
+
+async def _run(query_bodies: Sequence[Dict[str, Any]], size: int, concurrency: int,
+               rate: float, es_url: str, index: str,
+               histogram: LatencyHistogram) -> List[Tuple[List[str], float]]:
+    try:
+        import aiohttp
+    except ImportError:
+        raise RuntimeError("async_runner needs aiohttp: pip install aiohttp")
+
+    url = f"{es_url}/{index}/_search?filter_path={ID_FILTER_PATH}"    # 只要 _id 和分数
+    bucket = TokenBucket(rate)
+    results: List[Optional[Tuple[List[str], float]]] = [None] * len(query_bodies)
+    next_job = iter(range(len(query_bodies)))
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        # 固定 concurrency 个 worker，各自不停地取下一个查询，所以同时在路上的不超过 concurrency
+        async def worker() -> None:
+            for i in next_job:
+                body = lean_body(query_bodies[i], size)
+                await bucket.acquire()
+                start = time.perf_counter()
+                async with session.post(url, json=body) as r:
+                    if r.status >= 400:
+                        raise RuntimeError(f"ES request failed: {r.status}\n{await r.text()}")
+                    data = await r.json()
+                latency = time.perf_counter() - start
+                histogram.record(latency)
+                hits = data.get("hits", {}).get("hits", [])
+                results[i] = ([h.get("_id") for h in hits if "_id" in h], latency)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    return results  # type: ignore[return-value]
+
+
+def run_queries(query_bodies: Sequence[Dict[str, Any]], size: int = TOPK,
+                concurrency: int = DEFAULT_CONCURRENCY, rate: float = DEFAULT_RATE,
+                es_url: str = ES_URL, index: str = INDEX,
+                histogram: Optional[LatencyHistogram] = None) -> List[Tuple[List[str], float]]:
+    """
+    并发跑一批查询。返回和 query_bodies 一一对应的 (docid 列表, 延迟秒数)。
+    如果给了 histogram，每个查询的延迟也会记进去。
+    """
+    if histogram is None:
+        histogram = LatencyHistogram()
+    return asyncio.run(_run(query_bodies, size, concurrency, rate, es_url, index, histogram))
+
+
+def load_query_bodies(path: str) -> List[Dict[str, Any]]:
+    """
+    读查询文件：queries.json / gold standard 格式，或者每行一个 body 的 NDJSON。
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    if isinstance(data, list):
+        return data
+    bodies = []
+    for q in data.get("queries", []):
+        if q.get("keyword_query"):
+            bodies.append({"query": {"multi_match": {
+                "query": q["keyword_query"],
+                "fields": ["title", "parsedParagraphs"],
+                "type": "best_fields"}}})
+        if q.get("kibana_query") and q["kibana_query"].get("query"):
+            bodies.append(q["kibana_query"])
+    return bodies
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay queries against Elasticsearch concurrently.")
+    ap.add_argument("queries", help="queries.json / gold standard, or NDJSON query log")
+    ap.add_argument("--es-url", default=ES_URL)
+    ap.add_argument("--index", default=INDEX)
+    ap.add_argument("--size", type=int, default=TOPK)
+    ap.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    ap.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Max queries/sec, 0 = unlimited")
+    args = ap.parse_args()
+
+    bodies = load_query_bodies(args.queries)
+    print(f"Loaded queries: {len(bodies)}")
+    print(f"ES_URL={args.es_url}, INDEX={args.index}, concurrency={args.concurrency}, rate={args.rate}")
+
+    histogram = LatencyHistogram()
+    start = time.perf_counter()
+    run_queries(bodies, args.size, args.concurrency, args.rate, args.es_url, args.index, histogram)
+    elapsed = time.perf_counter() - start
+
+    print(f"Ran {len(bodies)} queries in {elapsed:.2f}s ({len(bodies) / max(elapsed, 1e-9):.0f} queries/sec)")
+    print(histogram.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+"""
+可重复的基准测试：合成集合 + 合成 gold standard + 进程内的 ES 替身（es_standin.py），
+不需要集群就能测索引吞吐、查询延迟和评测吞吐，结果写成 JSON，每个版本存一份，互相比较。
+
+    python bench.py run --out bench_v7.json                    # 默认 2000 个文档、50 个查询
+    python bench.py run --docs 20000 --queries 200 --out big.json
+    python bench.py run --es-url http://localhost:9200 --out es.json   # 对真的 ES 跑（会删建 bench_index）
+    python bench.py compare bench_v6.json bench_v7.json        # 有指标变差超过 10% 就返回 1
+    python bench.py generate coll.json gold.json --docs 5000   # 只生成数据
+
+合成数据（同一个 seed 生成的文件逐字节相同）：
+    集合     idc_index 的两行格式 {"index": {"_id": ...}} + {"title", "parsedParagraphs"}。
+             词表是 vocab 个造出来的词，按 Zipf 分布抽（skew 越大，高频词越集中，倒排表越长）；
+             每段 paragraph_words 个词左右（±50%），每个文档 paragraphs 段左右。
+    主题     每个查询一个主题：两个专用词组成的短语 + 一个答案（人名），种进 relevant 个文档里，
+             这些文档就是 gold standard 的 matches，种进去的那句话就是 sentences。
+             另外有一些文档只有主题的一个词（干扰项），所以精度不会总是 1。
+    gold     和 gold_standard_v5.json 一样的结构：keyword_query 是主题短语加一个常见词，
+             kibana_query 是 bool.must 里 phrase multi_match + best_fields multi_match。
+
+测什么（每项都记下来，JSON 里 results 下面）：
+    index.raw        idc_index_raw（原始字节直接 _bulk）：docs/s、MB/s
+    index.streaming  idc_index_streaming（parallel_bulk）：docs/s、MB/s
+    query.single     eqs_search 一个一个查：p50 / p95 / p99 / 平均延迟、每秒查询数
+    query.msearch    make_results.es_msearch 批量查：每秒查询数
+    eval.eqs_eval    eqs_eval 整个跑完（查询 + P/R）：每秒查询数、MAP、P@10
+    eval.metrics     eval_metrics.evaluate 只算指标（合成的大 run）：每秒查询数
+替身把所有请求排队处理，打分是纯 Python 的 local_bm25，所以数字只能和同一个 target 的数字比。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import accumulate
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import es_client
+
+BENCH_INDEX = "bench_index"
+SCHEMA_VERSION = 1
+
+DEFAULTS = {
+    "docs": 2000,
+    "paragraphs": 5,
+    "paragraph_words": 60,
+    "vocab": 20000,
+    "skew": 1.1,
+    "queries": 50,
+    "relevant": 8,
+    "seed": 306,
+    "repeat": 3,
+}
+
+# 越大越好的指标（其他的，比如延迟、秒数，越小越好）
+HIGHER_IS_BETTER = ("docs_per_sec", "mb_per_sec", "qps", "MAP", "P@10")
+
+_SYLLABLES = ["ka", "ri", "to", "me", "su", "no", "la", "vi", "de", "po", "zan", "gu",
+              "mor", "sel", "tic", "ba", "ne", "fo", "ly", "ch", "rem", "qua", "xi", "hob"]
+_FIRST = ["Alan", "Maria", "Kenji", "Aisha", "Pedro", "Ingrid", "Tomas", "Mei", "Olu", "Sara"]
+_LAST = ["Clark", "Okafor", "Tanaka", "Novak", "Silva", "Berg", "Moreau", "Kovacs", "Reyes", "Lindqvist"]
+
+
+# ---------------------------------------------------------------------------
+# 合成数据
+# ---------------------------------------------------------------------------
+
+def make_word(i: int) -> str:
+    """第 i 个词：按 24 进制拼音节，i 不同词就不同。"""
+    parts = []
+    while True:
+        i, r = divmod(i, len(_SYLLABLES))
+        parts.append(_SYLLABLES[r])
+        if i == 0:
+            return "".join(parts)
+        i -= 1
+
+
+class _Zipf:
+    """按 Zipf(skew) 抽词：第 r 个词的概率正比于 1 / r^skew。"""
+
+    def __init__(self, words: List[str], skew: float, rng: random.Random):
+        self.words = words
+        self.cum = list(accumulate(1.0 / (r ** skew) for r in range(1, len(words) + 1)))
+        self.rng = rng
+
+    def sample(self, n: int) -> List[str]:
+        return self.rng.choices(self.words, cum_weights=self.cum, k=n)
+
+
+def make_topics(n: int, vocab: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """每个主题两个专用词（不在普通词表里，不会被 Zipf 抽到）和一个答案人名。"""
+    topics = []
+    for t in range(n):
+        a, b = make_word(vocab + 2 * t), make_word(vocab + 2 * t + 1)
+        topics.append({"phrase": f"{a} {b}", "words": (a, b),
+                       "answer": f"{rng.choice(_FIRST)} {rng.choice(_LAST)}"})
+    return topics
+
+
+def generate(collection: str, gold: str, docs: int = DEFAULTS["docs"], paragraphs: int = DEFAULTS["paragraphs"],
+             paragraph_words: int = DEFAULTS["paragraph_words"], vocab: int = DEFAULTS["vocab"],
+             skew: float = DEFAULTS["skew"], queries: int = DEFAULTS["queries"],
+             relevant: int = DEFAULTS["relevant"], seed: int = DEFAULTS["seed"]) -> Dict[str, Any]:
+    """
+    写合成集合和配套的 gold standard。返回 {"docs", "bytes", "queries", "seconds"}。
+    同样的参数和 seed，两个文件逐字节相同。
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    words = [make_word(i) for i in range(vocab)]
+    zipf = _Zipf(words, skew, rng)
+    topics = make_topics(queries, vocab, rng)
+
+    # 每个主题挑 relevant 个相关文档，再挑一半数量的干扰文档（只出现一个主题词）
+    docids = [str(1000000 + 7 * i) for i in range(docs)]
+    planted: Dict[int, List[Tuple[int, bool]]] = {}
+    matches: List[List[Dict[str, Any]]] = [[] for _ in topics]
+    for t in range(len(topics)):
+        chosen = rng.sample(range(docs), min(docs, relevant + relevant // 2))
+        for k, d in enumerate(chosen):
+            planted.setdefault(d, []).append((t, k < relevant))
+
+    nbytes = 0
+    with open(collection, "w", encoding="utf-8", newline="\n") as f:
+        for d, docid in enumerate(docids):
+            n_par = max(1, int(paragraphs * rng.uniform(0.5, 1.5)))
+            paras = [" ".join(zipf.sample(max(1, int(paragraph_words * rng.uniform(0.5, 1.5)))))
+                     for _ in range(n_par)]
+            for t, is_relevant in planted.get(d, []):
+                topic = topics[t]
+                if is_relevant:
+                    sentence = f"{topic['answer']} {' '.join(zipf.sample(4))} {topic['phrase']}."
+                    matches[t].append({"docid": docid, "sentences": [sentence]})
+                else:
+                    sentence = f"{rng.choice(topic['words'])} {' '.join(zipf.sample(6))}."
+                p = rng.randrange(len(paras))
+                paras[p] = f"{paras[p]} {sentence}"
+            title = " ".join(zipf.sample(3)).title()
+            lines = (json.dumps({"index": {"_id": docid}}) + "\n"
+                     + json.dumps({"title": title, "parsedParagraphs": paras}) + "\n")
+            nbytes += len(lines.encode("utf-8"))
+            f.write(lines)
+
+    common = words[:50]
+    gold_queries = []
+    for t, topic in enumerate(topics):
+        extra = rng.choice(common)
+        gold_queries.append({
+            "number": t + 1,
+            "original_query": f"Who is associated with {topic['phrase']}",
+            "keyword_query": f"{topic['phrase']} {extra}",
+            "kibana_query": {"query": {"bool": {"must": [
+                {"multi_match": {"query": topic["phrase"], "fields": ["parsedParagraphs"], "type": "phrase"}},
+                {"multi_match": {"query": extra, "fields": ["parsedParagraphs", "title"], "type": "best_fields"}},
+            ]}}} if t % 2 == 0 else {"query": {"multi_match": {
+                "query": topic["phrase"], "fields": ["parsedParagraphs", "title"], "type": "phrase"}}},
+            "answer_type": "PERSON",
+            "exact_answers": [topic["answer"]],
+            "matches": matches[t],
+        })
+    with open(gold, "w", encoding="utf-8", newline="\n") as f:
+        json.dump({"student_surname": "Bench", "student_givenname": "Synthetic", "student_reg_number": str(seed),
+                   "topic_keywords": "synthetic", "queries": gold_queries}, f, ensure_ascii=False, indent=2)
+
+    return {"docs": docs, "bytes": nbytes, "queries": len(gold_queries),
+            "seconds": time.perf_counter() - start}
+
+
+# ---------------------------------------------------------------------------
+# 计时
+# ---------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def _quiet() -> Iterator[None]:
+    """被测的函数会打印很多（每个查询的 P/R、"Press RETURN"），计时的时候都吞掉；input() 直接读到回车。"""
+    stdin = sys.stdin
+    sys.stdin = io.StringIO("\n" * 1000)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        sys.stdin = stdin
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, float]:
+    ms = sorted(s * 1000 for s in seconds)
+
+    def pct(p: float) -> float:
+        return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))] if ms else 0.0
+
+    total = sum(seconds)
+    return {"count": len(ms), "p50_ms": pct(50), "p95_ms": pct(95), "p99_ms": pct(99),
+            "mean_ms": statistics.fmean(ms) if ms else 0.0, "qps": len(ms) / total if total else 0.0}
+
+
+def _gold_bodies(gold: str) -> List[Dict[str, Any]]:
+    from eqs_evaluate_query_set_v5 import eqs_keyword_query, eqs_read
+    bodies = []
+    for q in eqs_read(gold)["queries"]:
+        if q.get("keyword_query"):
+            bodies.append({"query": eqs_keyword_query(q["keyword_query"])})
+        if (q.get("kibana_query") or {}).get("query"):
+            bodies.append({"query": q["kibana_query"]["query"]})
+    return bodies
+
+
+def bench_indexing(collection: str, index: str = BENCH_INDEX, threads: int = 4) -> Dict[str, Any]:
+    """两种索引方式各跑一遍（每次都删了重建索引）。"""
+    import idc_index_doc_collection_v7 as idc
+
+    out = {}
+    with _quiet():
+        raw = idc.idc_index_raw(collection, index, thread_count=threads)
+        es_client.client.indices.refresh(index=index)
+        streaming = idc.idc_index_streaming(collection, index, thread_count=threads)
+        es_client.client.indices.refresh(index=index)
+    for name, summary in (("raw", raw), ("streaming", streaming)):
+        failed = summary.get("failed", sum(len(c["failures"]) for c in summary.get("failures", [])))
+        out[name] = {"docs": summary["docs"], "bytes": summary["bytes"], "seconds": summary["seconds"],
+                     "docs_per_sec": summary["docs_per_sec"], "mb_per_sec": summary["mb_per_sec"],
+                     "failed": failed}
+    return out
+
+
+def bench_queries(gold: str, index: str = BENCH_INDEX, repeat: int = DEFAULTS["repeat"]) -> Dict[str, Any]:
+    """每个查询先跑一次热身，再计时 repeat 遍。"""
+    import make_results
+    from eqs_evaluate_query_set_v5 import eqs_search
+
+    bodies = _gold_bodies(gold)
+    for body in bodies:
+        eqs_search(body["query"], index=index)
+
+    single = []
+    for _ in range(repeat):
+        for body in bodies:
+            start = time.perf_counter()
+            eqs_search(body["query"], index=index)
+            single.append(time.perf_counter() - start)
+
+    make_results.ES_URL, make_results.INDEX = es_client.ES_URL, index
+    start = time.perf_counter()
+    for _ in range(repeat):
+        make_results.es_msearch(bodies)
+    elapsed = time.perf_counter() - start
+    return {"single": latency_summary(single),
+            "msearch": {"count": repeat * len(bodies), "seconds": elapsed,
+                        "qps": repeat * len(bodies) / elapsed if elapsed else 0.0}}
+
+
+def bench_eval(gold: str, index: str = BENCH_INDEX, runs: int = 20000, seed: int = DEFAULTS["seed"]) -> Dict[str, Any]:
+    """eqs_eval 整个跑一遍；再用一个合成的大 run 单独测 eval_metrics 的速度。"""
+    import eqs_evaluate_query_set_v5 as eqs
+    from eval_metrics import evaluate, summarize
+
+    n_queries = len(eqs.eqs_read(gold)["queries"])
+    with _quiet():
+        start = time.perf_counter()
+        tables = eqs.eqs_eval(gold, index=index)
+        elapsed = time.perf_counter() - start
+    out: Dict[str, Any] = {"eqs_eval": {"queries": n_queries, "seconds": elapsed,
+                                        "qps": n_queries / elapsed if elapsed else 0.0}}
+    for query_type, table in (tables or {}).items():
+        means = summarize(table)
+        out["eqs_eval"][query_type] = {"MAP": means.get("MAP", 0.0), "P@10": means.get("P@10", 0.0)}
+
+    rng = random.Random(seed)
+    pool = [str(i) for i in range(100000)]
+    run = {q: rng.sample(pool, 40) for q in range(runs)}
+    qrels = {q: run[q][:3] + rng.sample(pool, 5) for q in range(runs)}
+    start = time.perf_counter()
+    evaluate(run, qrels, [5, 10])
+    elapsed = time.perf_counter() - start
+    out["metrics"] = {"queries": runs, "seconds": elapsed, "qps": runs / elapsed if elapsed else 0.0}
+    return out
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_suite(config: Dict[str, Any], es_url: Optional[str] = None, work_dir: Optional[str] = None,
+              log: Any = print) -> Dict[str, Any]:
+    """
+    生成数据，跑全部基准，返回结果 dict（写成 JSON 的那个）。
+    es_url 为 None 时起一个进程内的替身，跑完关掉。
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    collection = os.path.join(work_dir, "bench_collection.json")
+    gold = os.path.join(work_dir, "bench_gold.json")
+
+    gen_keys = ("docs", "paragraphs", "paragraph_words", "vocab", "skew", "queries", "relevant", "seed")
+    data = generate(collection, gold, **{k: config[k] for k in gen_keys})
+    log(f"Generated {data['docs']} docs ({data['bytes'] / 2 ** 20:.1f} MB), {data['queries']} queries "
+        f"in {data['seconds']:.1f}s")
+
+    standin = None
+    if es_url is None:
+        from es_standin import StandIn
+        standin = StandIn(os.path.join(work_dir, "standin"))
+        es_url = standin.start()
+    old_url = es_client.ES_URL
+    es_client.configure(es_url)
+    if "IR_LOCAL_INDEX" in os.environ:
+        log("[WARN] IR_LOCAL_INDEX is set, ignoring it for the benchmark.")
+    local_index = os.environ.pop("IR_LOCAL_INDEX", None)
+
+    try:
+        results: Dict[str, Any] = {}
+        log("Indexing ...")
+        results["index"] = bench_indexing(collection, BENCH_INDEX, config.get("threads", 4))
+        if standin is not None:
+            with _quiet():                        # 替身第一次搜索时建索引，不算进查询延迟
+                standin.refresh(BENCH_INDEX)
+        log("Queries ...")
+        results["query"] = bench_queries(gold, BENCH_INDEX, config["repeat"])
+        log("Evaluation ...")
+        results["eval"] = bench_eval(gold, BENCH_INDEX, seed=config["seed"])
+    finally:
+        es_client.configure(old_url)
+        if local_index is not None:
+            os.environ["IR_LOCAL_INDEX"] = local_index
+        if standin is not None:
+            standin.stop()
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "target": "standin" if standin is not None else es_url,
+        "config": config,
+        "data": data,
+        "results": results,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 比较
+# ---------------------------------------------------------------------------
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = float(value)
+    return out
+
+
+def _tracked(name: str) -> Optional[bool]:
+    """这个指标要不要比：True = 越大越好，False = 越小越好，None = 不比（文档数、字节数 ...）。"""
+    last = name.rsplit(".", 1)[-1]
+    if last in HIGHER_IS_BETTER:
+        return True
+    if last.endswith("_ms") or last == "seconds":
+        return False
+    return None
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.10) -> List[Dict[str, Any]]:
+    """两次结果的每个指标：旧值、新值、变化比例，变差超过 threshold 的 regression = True。"""
+    if old.get("config") != new.get("config") or old.get("target") != new.get("target"):
+        print("[WARN] The two runs used different settings or targets; the numbers are not comparable.")
+    a, b = flatten(old.get("results", {})), flatten(new.get("results", {}))
+    rows = []
+    for name in sorted(set(a) & set(b)):
+        higher = _tracked(name)
+        if higher is None:
+            continue
+        change = (b[name] - a[name]) / a[name] if a[name] else 0.0
+        worse = -change if higher else change
+        rows.append({"metric": name, "old": a[name], "new": b[name], "change": change,
+                     "regression": worse > threshold})
+    return rows
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'metric':<36}{'old':>12}{'new':>12}{'change':>9}"]
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        lines.append(f"{r['metric']:<36}{r['old']:>12.3f}{r['new']:>12.3f}{r['change']:>+9.1%}{flag}")
+    return "\n".join(lines)
+
+
+def format_results(report: Dict[str, Any]) -> str:
+    r = report["results"]
+    lines = [f"target={report['target']} commit={report['commit'] or '-'} docs={report['data']['docs']} "
+             f"queries={report['data']['queries']}"]
+    for name, s in r["index"].items():
+        lines.append(f"index {name:<10} {s['docs_per_sec']:9.0f} docs/s {s['mb_per_sec']:7.2f} MB/s "
+                     f"({s['failed']} failed)")
+    q = r["query"]["single"]
+    lines.append(f"query single     p50 {q['p50_ms']:.2f} ms  p95 {q['p95_ms']:.2f} ms  p99 {q['p99_ms']:.2f} ms  "
+                 f"{q['qps']:.0f} q/s")
+    lines.append(f"query msearch    {r['query']['msearch']['qps']:.0f} q/s")
+    e = r["eval"]
+    lines.append(f"eval eqs_eval    {e['eqs_eval']['qps']:.1f} queries/s  "
+                 + "  ".join(f"{t} MAP {m['MAP']:.3f} P@10 {m['P@10']:.3f}"
+                             for t, m in e["eqs_eval"].items() if isinstance(m, dict)))
+    lines.append(f"eval metrics     {e['metrics']['qps']:.0f} queries/s")
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# 命令行
+# ---------------------------------------------------------------------------
+
+def _add_data_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--docs", type=int, default=DEFAULTS["docs"])
+    ap.add_argument("--paragraphs", type=int, default=DEFAULTS["paragraphs"], help="Paragraphs per doc (average)")
+    ap.add_argument("--paragraph-words", type=int, default=DEFAULTS["paragraph_words"],
+                    help="Words per paragraph (average)")
+    ap.add_argument("--vocab", type=int, default=DEFAULTS["vocab"])
+    ap.add_argument("--skew", type=float, default=DEFAULTS["skew"], help="Zipf exponent of the word distribution")
+    ap.add_argument("--queries", type=int, default=DEFAULTS["queries"])
+    ap.add_argument("--relevant", type=int, default=DEFAULTS["relevant"], help="Relevant docs per query")
+    ap.add_argument("--seed", type=int, default=DEFAULTS["seed"])
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmarks for indexing, querying and evaluation.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="Generate data and run all benchmarks")
+    _add_data_args(r)
+    r.add_argument("--repeat", type=int, default=DEFAULTS["repeat"], help="Timed passes over the queries")
+    r.add_argument("--threads", type=int, default=4, help="Indexing threads")
+    r.add_argument("--es-url", default=None, help="Run against this Elasticsearch instead of the stand-in")
+    r.add_argument("--work-dir", default=None, help="Keep the generated files here")
+    r.add_argument("--out", default="bench_results.json")
+    r.add_argument("--compare", default=None, help="Earlier results JSON to compare with")
+    r.add_argument("--threshold", type=float, default=0.10)
+
+    g = sub.add_parser("generate", help="Only write the synthetic collection and gold standard")
+    g.add_argument("collection")
+    g.add_argument("gold")
+    _add_data_args(g)
+
+    c = sub.add_parser("compare", help="Compare two results files")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+
+    args = ap.parse_args(argv)
+    data_config = {k: getattr(args, k) for k in ("docs", "paragraphs", "paragraph_words", "vocab", "skew",
+                                                 "queries", "relevant", "seed") if hasattr(args, k)}
+
+    if args.command == "generate":
+        info = generate(args.collection, args.gold, **data_config)
+        print(f"[DONE] {info['docs']} docs ({info['bytes'] / 2 ** 20:.1f} MB) -> {args.collection}, "
+              f"{info['queries']} queries -> {args.gold}")
+        return 0
+
+    if args.command == "compare":
+        with open(args.old, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        print(format_comparison(rows))
+        return 1 if any(row["regression"] for row in rows) else 0
+
+    config = dict(data_config, repeat=args.repeat, threads=args.threads)
+    report = run_suite(config, args.es_url, args.work_dir)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(format_results(report))
+    print(f"[DONE] Wrote: {args.out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            rows = compare(json.load(f), report, args.threshold)
+        print(format_comparison(rows))
+        return 1 if any(row["regression"] for row in rows) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,486 @@
+"""
+压缩的集合文件：gzip / bzip2 / xz / zstd，直接流式读，不用先解压到磁盘。
+
+result_v3_utf8_*_docs.json 是纯文本 JSON，压缩比一般 4~6 倍（zstd / xz 更高）。
+磁盘慢的时候，读压缩文件 + 解压往往比读原文件还快，因为要读的字节少了好几倍。
+
+两种读法：
+    顺序读     任何 .gz / .bz2 / .xz / .zst 文件都行（gzip -c、zstd 命令行压的也行），
+               在当前进程里边读边解压。
+    分帧并行   用 compress_collection()（python compressed_input.py compress ...）压的文件：
+               每一帧（默认 4 MB 原文）单独压缩，只包含完整的文档（两行一对），
+               帧的位置记在旁边的 <文件>.frames.json 里。这样每一帧可以交给进程池里的
+               一个进程去读、解压、（需要时）解析 JSON，主进程按原来的顺序拿结果交给 bulk 发送。
+               几帧首尾相接本身还是一个合法的 .gz / .bz2 / .xz / .zst 文件，zcat 之类照样能读。
+
+给 idc_index_doc_collection_v7.py 用的：
+    open_collection(path)                 二进制流（不压缩的文件就是 open(path, "rb")）
+    raw_chunks(path, max_chunk_bytes)     和 idc_raw_chunks 一样产生 (offset, end, docs, chunk)，
+                                          offset / end 是解压后的字节位置（checkpoint 用的也是这个）
+    iter_documents(path)                  产生 (docid, source dict, 原文字节数)
+    iter_pairs(path)                      产生 (action 行, source 行)
+
+zstd 需要 zstandard 包（pip install zstandard），Python 3.14 以上用自带的 compression.zstd。
+
+命令行：
+    python compressed_input.py compress result_v3_utf8_2500_docs.json result_v3_utf8_2500_docs.json.zst
+    python compressed_input.py info result_v3_utf8_2500_docs.json.zst
+    python compressed_input.py bench result_v3_utf8_2500_docs.json result_v3_utf8_2500_docs.json.zst
+"""
+
+import argparse
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+FORMATS = ("gzip", "bzip2", "xz", "zstd")
+EXTENSIONS = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bzip2", ".xz": "xz", ".zst": "zstd", ".zstd": "zstd"}
+LEVELS = {"gzip": 6, "bzip2": 9, "xz": 6, "zstd": 10}
+FRAME_BYTES = 4 * 1024 * 1024     # 每帧多少字节原文：太小压缩比变差，太大并行度不够
+FRAMES_VERSION = 1
+
+# 进程池大小，None = CPU 核数。只有一个核或者文件只有一两帧时不开进程池
+PROCESSES: Optional[int] = None
+
+_MAGIC = [(b"\x1f\x8b", "gzip"), (b"BZh", "bzip2"), (b"\xfd7zXZ\x00", "xz"), (b"\x28\xb5\x2f\xfd", "zstd")]
+
+
+# ---------------------------------------------------------------------------
+# 格式
+# ---------------------------------------------------------------------------
+
+def detect_format(path: str) -> Optional[str]:
+    """看文件开头的魔数：gzip / bzip2 / xz / zstd，不压缩返回 None。"""
+    with open(path, "rb") as f:
+        head = f.read(6)
+    for magic, fmt in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def is_compressed(path: str) -> bool:
+    return detect_format(path) is not None
+
+
+def _zstd() -> Any:
+    try:
+        from compression import zstd          # Python 3.14+
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise ImportError("Reading .zst collections needs the zstandard package: pip install zstandard") from None
+
+
+def open_collection(path: str) -> BinaryIO:
+    """按文件内容（不看扩展名）打开：压缩的边读边解压，不压缩的就是普通文件。"""
+    fmt = detect_format(path)
+    if fmt is None:
+        return open(path, "rb", buffering=1 << 20)
+    if fmt == "gzip":
+        return gzip.open(path, "rb")
+    if fmt == "bzip2":
+        return bz2.open(path, "rb")
+    if fmt == "xz":
+        return lzma.open(path, "rb")
+    zstd = _zstd()
+    if hasattr(zstd.ZstdDecompressor, "stream_reader"):      # zstandard：zstandard.open 默认读完第一帧就停
+        raw = open(path, "rb")
+        reader = zstd.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader, buffer_size=1 << 20)
+    return zstd.open(path, "rb")
+
+
+def compress_bytes(fmt: str, data: bytes, level: Optional[int] = None) -> bytes:
+    level = LEVELS[fmt] if level is None else level
+    if fmt == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if fmt == "bzip2":
+        return bz2.compress(data, compresslevel=level)
+    if fmt == "xz":
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    return _zstd().compress(data, level=level)
+
+
+def decompress_bytes(fmt: str, data: bytes) -> bytes:
+    if fmt == "gzip":
+        return gzip.decompress(data)
+    if fmt == "bzip2":
+        return bz2.decompress(data)
+    if fmt == "xz":
+        return lzma.decompress(data)
+    return _zstd().decompress(data)
+
+
+# ---------------------------------------------------------------------------
+# 帧索引
+# ---------------------------------------------------------------------------
+
+def frames_path(path: str) -> str:
+    return path + ".frames.json"
+
+
+def read_frames(path: str) -> Optional[Dict[str, Any]]:
+    """
+    读 <path>.frames.json。没有、或者和文件对不上（文件被换过）返回 None，就只能顺序读。
+    frames 里每项是 [压缩后的位置, 压缩后的长度, 原文位置, 原文长度, 文档数]。
+    """
+    try:
+        with open(frames_path(path), "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get("version") != FRAMES_VERSION or info.get("size") != os.path.getsize(path):
+        return None
+    return info
+
+
+# ---------------------------------------------------------------------------
+# 切成一对一对的行
+# ---------------------------------------------------------------------------
+
+def iter_pairs(path: str) -> Iterator[Tuple[bytes, bytes]]:
+    """顺序读，产生 (action 行, source 行)，都带行尾的换行。空行跳过。"""
+    with open_collection(path) as f:
+        while True:
+            action = f.readline()
+            if not action:
+                return
+            if not action.strip():
+                continue
+            yield action, f.readline()
+
+
+def scan_pairs(data: Any, pos: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """
+    data（bytes 或 mmap）里从 pos 开始的每一对行：(开头, action 行开头, source 行结尾)。
+    空行和 iter_pairs 一样跳过，但算在下一对的开头和 action 行之间，所以位置和原文一致。
+    末尾只剩空行时，最后一项的 action 行开头 == 结尾（没有文档）。
+    """
+    size = len(data)
+    while pos < size:
+        start = pos
+        while pos < size:
+            eol = data.find(b"\n", pos)
+            line_end = size if eol == -1 else eol + 1
+            if data[pos:line_end].strip():
+                break
+            pos = line_end
+        if pos >= size:
+            yield start, size, size
+            return
+        eol = data.find(b"\n", pos)
+        if eol != -1:
+            eol = data.find(b"\n", eol + 1)
+        end = size if eol == -1 else eol + 1
+        yield start, pos, end
+        pos = end
+
+
+def pair_chunks(data: Any, max_chunk_bytes: int, pos: int = 0, base: int = 0
+                ) -> Iterator[Tuple[int, int, int, bytes]]:
+    """
+    data 从 pos 开始按 max_chunk_bytes 切成 (offset, end, docs, chunk)（offset / end 加上 base），
+    只在两行一对的边界上切；一个文档比 max_chunk_bytes 还大就单独成一块（idc_raw_chunks 也用这个）。
+    chunk 里不带空行（_bulk 一行一行对应 items），offset / end 还是算上空行的原文位置。
+    """
+    chunk = bytearray()
+    docs = 0
+    chunk_start = end = pos
+    for start, action, stop in scan_pairs(data, pos):
+        if action == stop:                   # 末尾的空行：算进最后一块
+            end = stop
+            continue
+        if docs > 0 and len(chunk) + stop - action > max_chunk_bytes:
+            yield base + chunk_start, base + start, docs, bytes(chunk)
+            chunk, docs, chunk_start = bytearray(), 0, start
+        chunk += data[action:stop]
+        docs += 1
+        end = stop
+    if docs:
+        yield base + chunk_start, base + end, docs, bytes(chunk)
+
+
+def _parse_pairs(data: bytes) -> List[Tuple[str, Dict[str, Any], int]]:
+    docs = []
+    lines = data.split(b"\n")
+    i = 0
+    while i < len(lines):
+        action = lines[i]
+        if not action.strip():
+            i += 1
+            continue
+        source = lines[i + 1] if i + 1 < len(lines) else b""
+        docs.append((json.loads(action)["index"]["_id"], json.loads(source), len(action) + len(source) + 2))
+        i += 2
+    return docs
+
+
+def _read_frame(path: str, fmt: str, frame: List[int], start: int = 0) -> bytes:
+    """读一帧、解压；start 在这一帧中间时只要 start 以后的部分。"""
+    c_off, c_len, raw_off, raw_len, _ = frame
+    with open(path, "rb") as f:
+        f.seek(c_off)
+        data = decompress_bytes(fmt, f.read(c_len))
+    if len(data) != raw_len:
+        raise ValueError(f"{path}: frame at byte {c_off} decompressed to {len(data)} bytes, expected {raw_len}")
+    return data[start - raw_off:] if start > raw_off else data
+
+
+def _frame_chunks(path: str, fmt: str, frame: List[int], max_chunk_bytes: int,
+                  start: int) -> List[Tuple[int, int, int, bytes]]:
+    """进程池里跑：读一帧、解压、切成 bulk 块。"""
+    base = max(start, frame[2])
+    return list(pair_chunks(_read_frame(path, fmt, frame, start), max_chunk_bytes, 0, base))
+
+
+def _frame_documents(path: str, fmt: str, frame: List[int]) -> List[Tuple[str, Dict[str, Any], int]]:
+    """进程池里跑：读一帧、解压、解析 JSON。"""
+    return _parse_pairs(_read_frame(path, fmt, frame))
+
+
+def _processes(frames: int) -> int:
+    n = PROCESSES or os.cpu_count() or 1
+    return max(1, min(n, frames))
+
+
+def _ordered(pool: Optional[Executor], fn: Callable[..., Any], calls: Iterable[Tuple[Any, ...]],
+             window: int) -> Iterator[Any]:
+    """
+    fn(*args) 在进程池里跑，结果按原来的顺序给出。最多同时 window 个在跑 / 等着被取走，
+    所以发送跟不上的时候不会把整个文件都解压到内存里。pool 为 None 就在当前进程里顺序跑。
+    """
+    if pool is None:
+        for args in calls:
+            yield fn(*args)
+        return
+    pending: deque = deque()
+    for args in calls:
+        pending.append(pool.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _framed(fn: Callable[..., Any], calls: List[Tuple[Any, ...]]) -> Iterator[Any]:
+    n = _processes(len(calls))
+    if n <= 1:
+        yield from _ordered(None, fn, calls, 1)
+        return
+    with ProcessPoolExecutor(max_workers=n) as pool:
+        yield from _ordered(pool, fn, calls, 2 * n)
+
+
+def raw_chunks(path: str, max_chunk_bytes: int = 10 * 1024 * 1024,
+               start: int = 0) -> Iterator[Tuple[int, int, int, bytes]]:
+    """
+    和 idc_raw_chunks 一样产生 (offset, end, docs, chunk)，offset / end 是原文（解压后）的字节位置。
+    有帧索引就并行解压，没有就顺序读。start 必须是某个 action 行的开头（比如 checkpoint 里的 offset）。
+    """
+    fmt = detect_format(path)
+    info = read_frames(path) if fmt else None
+    if info is not None:
+        frames = [fr for fr in info["frames"] if fr[2] + fr[3] > start]
+        calls = [(path, fmt, fr, max_chunk_bytes, start) for fr in frames]
+        for pieces in _framed(_frame_chunks, calls):
+            yield from pieces
+        return
+
+    # 顺序读：跳过 start 以前的，之后攒够 max_chunk_bytes 就给出一块
+    offset = 0
+    chunk = bytearray()
+    docs = 0
+    chunk_start = start
+    for blank, action, source in _pairs_with_blank(path):
+        n = len(blank) + len(action) + len(source)
+        if offset < start or not action:
+            offset += n
+            continue
+        if docs > 0 and len(chunk) + len(action) + len(source) > max_chunk_bytes:
+            yield chunk_start, offset, docs, bytes(chunk)
+            chunk_start, chunk, docs = offset, bytearray(), 0
+        chunk += action
+        chunk += source
+        docs += 1
+        offset += n
+    if chunk:
+        yield chunk_start, offset, docs, bytes(chunk)
+
+
+def _pairs_with_blank(path: str) -> Iterator[Tuple[bytes, bytes, bytes]]:
+    """
+    (前面的空行, action 行, source 行)。空行和 iter_pairs 一样跳过，但字节留着算进下一对，
+    位置和原文一致；文件末尾只剩空行时 action 和 source 是 b""。
+    """
+    with open_collection(path) as f:
+        blank = bytearray()
+        while True:
+            line = f.readline()
+            if not line:
+                if blank:
+                    yield bytes(blank), b"", b""
+                return
+            if not line.strip():
+                blank += line
+                continue
+            yield bytes(blank), line, f.readline()
+            blank = bytearray()
+
+
+def iter_documents(path: str) -> Iterator[Tuple[str, Dict[str, Any], int]]:
+    """
+    产生 (docid, source, 这个文档在原文里占的字节数)。有帧索引时解压和 JSON 解析在进程池里做，
+    顺序不变；否则在当前进程里顺序读（不压缩的文件也走这里）。
+    """
+    fmt = detect_format(path)
+    info = read_frames(path) if fmt else None
+    if info is not None:
+        for docs in _framed(_frame_documents, [(path, fmt, fr) for fr in info["frames"]]):
+            yield from docs
+        return
+    for action, source in iter_pairs(path):
+        yield json.loads(action)["index"]["_id"], json.loads(source), len(action) + len(source)
+
+
+# ---------------------------------------------------------------------------
+# 压缩
+# ---------------------------------------------------------------------------
+
+def _frames_of(path: str, frame_bytes: int) -> Iterator[Tuple[bytes, int]]:
+    """
+    原文（可以本身就是压缩的）按 frame_bytes 切成只含完整文档的帧，给出 (帧, 文档数)。
+    空行留在帧里（原文位置不变），只会在一对行的前面，不会把 action 行和 source 行分开。
+    """
+    frame = bytearray()
+    docs = 0
+    for blank, action, source in _pairs_with_blank(path):
+        if docs and action and len(frame) + len(blank) + len(action) + len(source) > frame_bytes:
+            yield bytes(frame), docs
+            frame, docs = bytearray(), 0
+        frame += blank
+        frame += action
+        frame += source
+        docs += bool(action)
+    if frame:
+        yield bytes(frame), docs
+
+
+def _compress_frame(fmt: str, data: bytes, docs: int, level: Optional[int]) -> Tuple[bytes, int, int]:
+    return compress_bytes(fmt, data, level), len(data), docs
+
+
+def compress_collection(src: str, dst: str, fmt: Optional[str] = None, level: Optional[int] = None,
+                        frame_bytes: int = FRAME_BYTES) -> Dict[str, Any]:
+    """
+    把集合文件压成分帧的 dst，并写 dst.frames.json。fmt 不给就看 dst 的扩展名（.gz .bz2 .xz .zst）。
+    各帧的压缩也在进程池里并行。返回帧索引（里面有原文和压缩后的大小）。
+    """
+    fmt = fmt or EXTENSIONS.get(os.path.splitext(dst)[1].lower())
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format for {dst!r}: give one of {', '.join(FORMATS)}")
+    start = time.perf_counter()
+    frames = []
+    c_off = raw_off = docs = 0
+    n = _processes(2 ** 31)
+    pool = ProcessPoolExecutor(max_workers=n) if n > 1 else None
+    tmp = dst + ".tmp"
+    try:
+        with open(tmp, "wb") as out:
+            calls = ((fmt, data, docs, level) for data, docs in _frames_of(src, frame_bytes))
+            for packed, raw_len, n_docs in _ordered(pool, _compress_frame, calls, 2 * n):
+                out.write(packed)
+                frames.append([c_off, len(packed), raw_off, raw_len, n_docs])
+                c_off += len(packed)
+                raw_off += raw_len
+                docs += n_docs
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    os.replace(tmp, dst)
+    info = {"version": FRAMES_VERSION, "format": fmt, "level": LEVELS[fmt] if level is None else level,
+            "frame_bytes": frame_bytes, "size": c_off, "raw_bytes": raw_off, "docs": docs,
+            "seconds": time.perf_counter() - start, "frames": frames}
+    with open(frames_path(dst), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    return info
+
+
+# ---------------------------------------------------------------------------
+# 命令行
+# ---------------------------------------------------------------------------
+
+def _time_read(path: str, parse: bool) -> Tuple[float, int, int]:
+    start = time.perf_counter()
+    docs = nbytes = 0
+    if parse:
+        for _, _, n in iter_documents(path):
+            docs += 1
+            nbytes += n
+    else:
+        for offset, end, n, _ in raw_chunks(path):
+            docs += n
+            nbytes += end - offset
+    return time.perf_counter() - start, docs, nbytes
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Compressed collection files (gzip, bzip2, xz, zstd).")
+    sub = ap.add_subparsers(dest="command", required=True)
+    c = sub.add_parser("compress", help="Compress a collection into independent frames")
+    c.add_argument("src")
+    c.add_argument("dst", help="Output file; the extension picks the format (.gz .bz2 .xz .zst)")
+    c.add_argument("--format", choices=FORMATS, default=None)
+    c.add_argument("--level", type=int, default=None)
+    c.add_argument("--frame-mb", type=float, default=FRAME_BYTES / 2 ** 20)
+    i = sub.add_parser("info", help="Show format, frames and compression ratio")
+    i.add_argument("path")
+    b = sub.add_parser("bench", help="Time reading each file as raw bulk chunks and as parsed documents")
+    b.add_argument("paths", nargs="+")
+    for p in (c, b):
+        p.add_argument("--processes", type=int, default=None, help="Process pool size (default: CPU count)")
+    args = ap.parse_args(argv)
+
+    global PROCESSES
+    if getattr(args, "processes", None):
+        PROCESSES = args.processes
+
+    if args.command == "compress":
+        info = compress_collection(args.src, args.dst, args.format, args.level, int(args.frame_mb * 2 ** 20))
+        print(f"[DONE] {info['docs']} docs, {info['raw_bytes'] / 2 ** 20:.1f} MB -> {info['size'] / 2 ** 20:.1f} MB "
+              f"({info['raw_bytes'] / max(info['size'], 1):.1f}x, {len(info['frames'])} frames) "
+              f"in {info['seconds']:.1f}s: {args.dst}")
+    elif args.command == "info":
+        fmt = detect_format(args.path)
+        info = read_frames(args.path) if fmt else None
+        size = os.path.getsize(args.path)
+        if info is None:
+            print(f"{args.path}: {fmt or 'not compressed'}, {size / 2 ** 20:.1f} MB"
+                  + (", no frame index (read sequentially)" if fmt else ""))
+        else:
+            print(f"{args.path}: {fmt} level {info['level']}, {info['docs']} docs in {len(info['frames'])} frames, "
+                  f"{info['raw_bytes'] / 2 ** 20:.1f} MB -> {size / 2 ** 20:.1f} MB "
+                  f"({info['raw_bytes'] / max(size, 1):.1f}x)")
+    else:
+        print("file\tMB on disk\tmode\tseconds\tdocs/s\tMB/s (uncompressed)")
+        for path in args.paths:
+            for parse in (False, True):
+                seconds, docs, nbytes = _time_read(path, parse)
+                print(f"{path}\t{os.path.getsize(path) / 2 ** 20:.1f}\t{'documents' if parse else 'raw'}\t"
+                      f"{seconds:.2f}\t{docs / seconds:.0f}\t{nbytes / 2 ** 20 / seconds:.1f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+只要 DocID 和分数的检索，和用 point-in-time + search_after 一页一页往下翻的深度检索。
+
+make_results.py 和 eqs_eval 只用 hits 里的 _id，可是 ES 默认把每个命中的整个 _source
+（整篇 parsedParagraphs）都发回来，40 个命中就是几百 KB。这里：
+
+    精简模式    "_source": false + filter_path=hits.hits._id,hits.hits._score，
+                响应里只剩 DocID 和分数，小两三个数量级；track_total_hits 也关掉
+    深度检索    iter_hits() 是生成器：先开一个 point-in-time（PIT，索引的快照，翻页期间
+                有新文档写进来也不影响顺序），每页按 (_score 降序, _shard_doc 升序) 排，
+                下一页从上一页最后一个命中的 sort 值接着取（search_after）。
+                不受 from + size <= 10000 的限制，想要多深就多深，翻完（或不再迭代）就关掉 PIT
+
+所以 R@1000 这种评测也跑得动：eqs_eval( gold, depth = 1000 )（eqs_fetch）一页以内用精简模式一次取完，
+更深就用 iter_hits() 翻页。
+设置了 IR_LOCAL_INDEX 时用本地索引（local_bm25.py），一次取够 depth 个，不用翻页。
+
+用法：
+    python deep_search.py "climate change policy" --depth 1000
+    python deep_search.py '{"match": {"title": "climate"}}' --payload     # 比较完整响应和精简响应的大小
+
+在 Python 里：
+    from deep_search import iter_hits, deep_ids, search_ids
+    for docid, score in iter_hits({"match": {"title": "climate"}}, depth=1000): ...
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import es_client
+
+INDEX = "student_index"
+PAGE_SIZE = 1000            # 每页多少个命中（ES 一次最多 10000）
+KEEP_ALIVE = "1m"           # PIT 两页之间最多空闲多久（每页都会续期）
+
+# 只留 DocID 和分数。_msearch 每项多留 status 和 error：没有命中的查询也不会被过滤成空对象，
+# 响应的个数还是和查询一一对应
+ID_FILTER_PATH = "hits.hits._id,hits.hits._score"
+MSEARCH_FILTER_PATH = "responses.status,responses.error,responses.hits.hits._id,responses.hits.hits._score"
+PAGE_FILTER_PATH = "pit_id,hits.hits._id,hits.hits._score,hits.hits.sort"
+
+# 和 ES 默认的顺序一样（分数高的在前，分数相同按索引顺序），_shard_doc 保证每个文档的 sort 值唯一
+PIT_SORT = [{"_score": {"order": "desc"}}, {"_shard_doc": {"order": "asc"}}]
+
+
+def _local():
+    from local_bm25 import search_backend
+    return search_backend()
+
+
+def _body(response: Any) -> Dict[str, Any]:
+    """elasticsearch 客户端返回的是 ObjectApiResponse，本地索引返回 dict。"""
+    return getattr(response, "body", response) or {}
+
+
+def lean_body(body: Dict[str, Any], size: int) -> Dict[str, Any]:
+    """查询 body 改成精简模式：不要 _source，不数总命中数。"""
+    body = dict(body)
+    body["size"] = size
+    body["_source"] = False
+    body.setdefault("track_total_hits", False)
+    return body
+
+
+def hit_pairs(response: Any) -> List[Tuple[str, float]]:
+    """[(DocID, 分数)]。filter_path 下没有命中的响应是 {}，也能处理。"""
+    hits = _body(response).get("hits", {}).get("hits", [])
+    return [(h["_id"], h.get("_score")) for h in hits if "_id" in h]
+
+
+# ---------------------------------------------------------------------------
+# 一次取 size 个
+# ---------------------------------------------------------------------------
+
+def search_ids(query: Dict[str, Any], index: str = INDEX, size: int = 40) -> List[Tuple[str, float]]:
+    """一个查询的前 size 个命中，只要 (DocID, 分数)。"""
+    local = _local()
+    if local is not None:
+        return hit_pairs(local.search(query=query, size=size, source=False))
+    response = es_client.get_client().search(
+        index=index, query=query, size=size, source=False,
+        track_total_hits=False, filter_path=ID_FILTER_PATH)
+    return hit_pairs(response)
+
+
+# ---------------------------------------------------------------------------
+# 深度检索：PIT + search_after
+# ---------------------------------------------------------------------------
+
+def iter_hits(query: Dict[str, Any], index: str = INDEX, depth: Optional[int] = None,
+              page_size: int = PAGE_SIZE, keep_alive: str = KEEP_ALIVE) -> Iterator[Tuple[str, float]]:
+    """
+    按排名依次给出 (DocID, 分数)，最多 depth 个（None = 所有命中）。
+    需要的时候才取下一页，所以只看前几个就停也只发了一页；生成器结束或被丢掉时关掉 PIT。
+    """
+    if depth is not None and depth <= 0:
+        return
+    local = _local()
+    if local is not None:
+        top, _, _ = local.top_k(query, depth if depth is not None else local.n_docs)
+        for docno, score in top:
+            yield local.docid(docno), score
+        return
+
+    client = es_client.get_client()
+    pit_id = _body(client.open_point_in_time(index=index, keep_alive=keep_alive))["id"]
+    try:
+        search_after = None
+        returned = 0
+        while depth is None or returned < depth:
+            size = page_size if depth is None else min(page_size, depth - returned)
+            extra = {"search_after": search_after} if search_after is not None else {}
+            page = _body(client.search(
+                pit={"id": pit_id, "keep_alive": keep_alive}, query=query, size=size, sort=PIT_SORT,
+                source=False, track_total_hits=False, filter_path=PAGE_FILTER_PATH, **extra))
+            pit_id = page.get("pit_id", pit_id)        # PIT 的 id 可能变，要用最新的
+            hits = page.get("hits", {}).get("hits", [])
+            for hit in hits:
+                yield hit["_id"], hit.get("_score")
+            returned += len(hits)
+            if len(hits) < size:
+                break
+            search_after = hits[-1]["sort"]
+    finally:
+        try:
+            client.close_point_in_time(id=pit_id)
+        except Exception:
+            pass                                       # 关不掉也没关系，keep_alive 到了 ES 自己会清掉
+
+
+def deep_ids(query: Dict[str, Any], index: str = INDEX, depth: int = 1000,
+             page_size: int = PAGE_SIZE) -> List[str]:
+    """前 depth 个 DocID（按排名）。"""
+    return [docid for docid, _ in iter_hits(query, index, depth, page_size)]
+
+
+# ---------------------------------------------------------------------------
+# 响应大小对比
+# ---------------------------------------------------------------------------
+
+def payload_sizes(query: Dict[str, Any], index: str = INDEX, size: int = 40) -> Dict[str, int]:
+    """同一个查询，完整响应和精简响应各多少字节（解压后的 JSON）。"""
+    session = es_client.get_session()
+    url = f"{es_client.ES_URL}/{index}/_search"
+    full = session.post(url, json={"query": query, "size": size}, timeout=60)
+    lean = session.post(url, json=lean_body({"query": query}, size),
+                        params={"filter_path": ID_FILTER_PATH}, timeout=60)
+    for r in (full, lean):
+        if not r.ok:
+            raise RuntimeError(f"ES request failed: {r.status_code}\n{r.text}")
+    return {"full": len(full.content), "lean": len(lean.content)}
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="IDs-and-scores search and point-in-time deep paging.")
+    ap.add_argument("query", help="Keyword text (multi_match like eqs_keyword_query) or a JSON query")
+    ap.add_argument("--index", default=INDEX)
+    ap.add_argument("--depth", type=int, default=1000, help="Number of hits to fetch (0 = all)")
+    ap.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    ap.add_argument("--show", type=int, default=10, help="Print the first N hits")
+    ap.add_argument("--payload", action="store_true",
+                    help="Compare full and lean response sizes for the top 40 instead")
+    args = ap.parse_args(argv)
+
+    if args.query.lstrip().startswith("{"):
+        query = json.loads(args.query)
+    else:
+        from eqs_evaluate_query_set_v5 import eqs_keyword_query
+        query = eqs_keyword_query(args.query)
+
+    if args.payload:
+        sizes = payload_sizes(query, args.index)
+        print(f"full response: {sizes['full']:,} bytes")
+        print(f"lean response: {sizes['lean']:,} bytes  ({sizes['full'] / max(sizes['lean'], 1):.0f}x smaller)")
+        return
+
+    start = time.perf_counter()
+    n = 0
+    for docid, score in iter_hits(query, args.index, args.depth or None, args.page_size):
+        if n < args.show:
+            print(f"{n + 1:>5}  {score:10.4f}  {docid}")
+        n += 1
+    elapsed = time.perf_counter() - start
+    print(f"{n} hits in {elapsed:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,543 @@
+"""
+语义检索（只用 CPU 和 NumPy）：LSA 稠密向量 + IVF 倒排向量索引，和词法检索用 RRF 融合。
+
+现在所有的检索都是词法的（idc_search 的 multi_match、gold standard 的 kibana_query），
+"Who founded Sony?" 这种问法要靠手写的关键词扩展才能找到 "Akio Morita ... co-founded"。
+这里从同一个集合文件建一个稠密向量索引（一个目录）：
+
+    1. TF-IDF      title + parsedParagraphs 分词（和 local_bm25 一样），tf 取 1 + log(tf)，乘 idf，
+                   每个文档 L2 归一化。词表按 df 取前 vocab 个（去掉 df < MIN_DF 和出现在一半以上文档里的）
+    2. SVD         随机化 SVD（Halko et al. 2011）：X^T X 乘一个随机矩阵，做 POWER_ITERS 次幂迭代，
+                   然后在这个子空间里求特征分解。每一步都是分批扫一遍磁盘上的稀疏矩阵，
+                   内存只有 词表 × (dim + OVERSAMPLE) 的几个矩阵，和文档数无关
+    3. 文档向量    X V_k（dim 维），L2 归一化，余弦相似度就是点积
+    4. IVF         球面 k-means 分成 nlist 个簇（约 4 * sqrt(文档数)），向量按簇连续存成 float16 的 memmap。
+                   查询只算离它最近的 nprobe 个簇里的向量，几百万个文档也是毫秒级
+
+文件（都 mmap 打开）：
+    meta.json        文档数、维数、簇数、词表大小、集合文件
+    terms.json       词表；idf.npy 每个词的 idf；proj.npy 词 -> 向量的投影矩阵（词表 × dim）
+    centroids.npy    簇中心；lists.npy 每个簇在 vectors 里的起止位置
+    vectors.f16      所有文档向量，按簇排好；rows.i32 每个位置是原来的第几个文档
+    docids.blob/.off DocID
+
+建索引时集合文件读两遍（第一遍数 df，第二遍写稀疏矩阵），中间文件放在索引目录里，建完删掉。
+集合文件可以是压缩的（compressed_input.py）。
+
+融合：rrf() 是 reciprocal rank fusion，每个排名里第 r 名得 1 / (RRF_K + r) 分，加起来排序。
+hybrid = kibana_query 的词法结果 + 稠密结果（用 original_query 这句自然语言问句）。
+
+用法：
+    python dense_index.py build result_v3_utf8_2500_docs.json dense_index --dim 128
+    python dense_index.py search dense_index "Who founded Sony?"
+    python dense_index.py eval dense_index gold_standard_v5.json              # dense 和 hybrid 的 P/R
+    python dense_index.py eval dense_index gold_standard_v5.json --no-lexical  # 不用 ES，只评 dense
+
+eval 走的是和 eqs_eval 一样的 eqs_metrics()（P@5、R@10、MAP ...），keyword / kibana / dense / hybrid 四个 run
+放在一起比。需要 numpy。
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from local_bm25 import DEFAULT_FIELDS, analyze, field_values
+
+FORMAT_VERSION = 1
+
+DEFAULT_DIM = 128
+DEFAULT_VOCAB = 50000
+MIN_DF = 2                   # 只在一个文档里出现的词不要
+MAX_DF = 0.5                 # 出现在一半以上文档里的词不要（相当于停用词）
+OVERSAMPLE = 10              # 随机化 SVD 多取几维，结果更准
+POWER_ITERS = 2
+BATCH_NNZ = 1 << 17          # 每批最多多少个非零元素：中间矩阵 BATCH_NNZ × (dim + OVERSAMPLE) 个 float32
+MAX_TRACKED_TERMS = 2_000_000  # 数 df 时最多记这么多个词，超过就丢掉目前只出现过一次的
+TRAIN_SAMPLE = 100_000       # k-means 最多用这么多个文档训练
+KMEANS_ITERS = 20
+DEFAULT_NPROBE = 16
+RRF_K = 60
+SEED = 42
+
+
+# ---------------------------------------------------------------------------
+# TF-IDF
+# ---------------------------------------------------------------------------
+
+def doc_terms(source: Dict[str, Any], fields: Sequence[str] = DEFAULT_FIELDS) -> Dict[str, int]:
+    """一个文档里每个词出现几次。"""
+    counts: Dict[str, int] = {}
+    for name in fields:
+        values = field_values(source.get(name))
+        for value in values or ():
+            for term in analyze(value):
+                counts[term] = counts.get(term, 0) + 1
+    return counts
+
+
+def _documents(collection: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    from compressed_input import iter_documents
+    for docid, source, _ in iter_documents(collection):
+        yield str(docid), source
+
+
+def count_df(collection: str, fields: Sequence[str] = DEFAULT_FIELDS) -> Tuple[int, Dict[str, int]]:
+    """第一遍：文档数和每个词的 df。词太多时丢掉 df = 1 的（它们本来也进不了词表）。"""
+    df: Dict[str, int] = {}
+    n = 0
+    for _, source in _documents(collection):
+        for term in doc_terms(source, fields):
+            df[term] = df.get(term, 0) + 1
+        n += 1
+        if len(df) > MAX_TRACKED_TERMS:
+            df = {t: c for t, c in df.items() if c > 1}
+    return n, df
+
+
+def select_vocab(df: Dict[str, int], n_docs: int, size: int = DEFAULT_VOCAB, min_df: int = MIN_DF,
+                 max_df: float = MAX_DF) -> Tuple[List[str], np.ndarray]:
+    """按 df 从大到小取 size 个词，返回 (词表, idf)。idf = ln((1 + N) / (1 + df)) + 1。"""
+    limit = max_df * n_docs if n_docs >= 10 else n_docs
+    keep = [(c, t) for t, c in df.items() if c >= min(min_df, n_docs) and c <= limit]
+    keep.sort(key=lambda item: (-item[0], item[1]))
+    terms = [t for _, t in keep[:size]]
+    counts = np.array([df[t] for t in terms], dtype=np.float64)
+    idf = (np.log((1 + n_docs) / (1 + counts)) + 1).astype(np.float32)
+    return terms, idf
+
+
+def tfidf_row(counts: Dict[str, int], term_id: Dict[str, int], idf: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """一个文档 / 查询的 TF-IDF 稀疏向量 (词编号, 值)，L2 归一化；词都不在词表里时是空的。"""
+    pairs = sorted((term_id[t], c) for t, c in counts.items() if t in term_id)
+    if not pairs:
+        return np.zeros(0, np.int32), np.zeros(0, np.float32)
+    ids = np.array([i for i, _ in pairs], dtype=np.int32)
+    values = (1 + np.log(np.array([c for _, c in pairs], dtype=np.float32))) * idf[ids]
+    values /= np.linalg.norm(values)
+    return ids, values.astype(np.float32)
+
+
+# ---------------------------------------------------------------------------
+# 磁盘上的稀疏矩阵（CSR）
+# ---------------------------------------------------------------------------
+
+class _Csr:
+    """文档 × 词的稀疏矩阵：indptr / indices / data 三个文件，memmap 打开，分批读。"""
+
+    def __init__(self, prefix: str):
+        self.indptr = np.memmap(prefix + ".indptr", dtype=np.int64, mode="r")
+        nnz = int(self.indptr[-1])
+        self.indices = np.memmap(prefix + ".indices", dtype=np.int32, mode="r", shape=(nnz,)) if nnz else \
+            np.zeros(0, np.int32)
+        self.data = np.memmap(prefix + ".data", dtype=np.float32, mode="r", shape=(nnz,)) if nnz else \
+            np.zeros(0, np.float32)
+        self.rows = len(self.indptr) - 1
+
+    def batches(self, max_nnz: int = BATCH_NNZ) -> Iterator[Tuple[int, int, np.ndarray, np.ndarray, np.ndarray]]:
+        """(第一行, 最后一行 + 1, 本批的 indptr（从 0 开始）, indices, data)，每批的非零元素不超过 max_nnz。"""
+        start = 0
+        while start < self.rows:
+            limit = self.indptr[start] + max_nnz
+            stop = int(np.searchsorted(self.indptr, limit, side="right")) - 1
+            stop = min(max(stop, start + 1), self.rows)
+            lo, hi = int(self.indptr[start]), int(self.indptr[stop])
+            yield (start, stop, np.asarray(self.indptr[start:stop + 1]) - lo,
+                   np.asarray(self.indices[lo:hi]), np.asarray(self.data[lo:hi]))
+            start = stop
+
+
+def write_csr(collection: str, prefix: str, term_id: Dict[str, int], idf: np.ndarray,
+              fields: Sequence[str] = DEFAULT_FIELDS) -> Tuple[bytearray, List[int]]:
+    """第二遍：每个文档的 TF-IDF 行追加写进 prefix.indptr / .indices / .data。返回 DocID。"""
+    docid_blob = bytearray()
+    docid_off = [0]
+    nnz = 0
+    with open(prefix + ".indptr", "wb") as fp, open(prefix + ".indices", "wb") as fi, \
+            open(prefix + ".data", "wb") as fd:
+        pending: List[int] = [0]
+        for docid, source in _documents(collection):
+            ids, values = tfidf_row(doc_terms(source, fields), term_id, idf)
+            ids.tofile(fi)
+            values.tofile(fd)
+            nnz += len(ids)
+            pending.append(nnz)
+            if len(pending) >= 65536:
+                np.array(pending, dtype=np.int64).tofile(fp)
+                pending = []
+            docid_blob += docid.encode("utf-8")
+            docid_off.append(len(docid_blob))
+        np.array(pending, dtype=np.int64).tofile(fp)
+    return docid_blob, docid_off
+
+
+def _x_times(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, m: np.ndarray) -> np.ndarray:
+    """X_batch @ m（行数 × m 的列数）。"""
+    rows = len(indptr) - 1
+    out = np.zeros((rows, m.shape[1]), dtype=np.float32)
+    if len(indices) == 0:
+        return out
+    lengths = np.diff(indptr)
+    nonempty = lengths > 0
+    prod = data[:, None] * m[indices]
+    out[nonempty] = np.add.reduceat(prod, indptr[:-1][nonempty], axis=0)
+    return out
+
+
+def _xt_times_add(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, z: np.ndarray,
+                  out: np.ndarray) -> None:
+    """out += X_batch^T @ z。按词编号排序后用 reduceat 分段求和，不用 np.add.at（慢很多）。"""
+    if len(indices) == 0:
+        return
+    row_of = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    terms = indices[order]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(terms)) + 1))
+    sums = np.add.reduceat(data[order, None] * z[row_of[order]], starts, axis=0)
+    out[terms[starts]] += sums
+
+
+def randomized_svd(csr: _Csr, n_terms: int, dim: int, b_path: str, oversample: int = OVERSAMPLE,
+                   power_iters: int = POWER_ITERS, seed: int = SEED) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    X（文档 × 词）的随机化 SVD。每一轮分批扫一遍 X：
+        Y = X^T (X Q)，Q = qr(Y)       （power_iters + 1 轮）
+        B = X Q 写进 b_path（memmap），G = B^T B，G = U S^2 U^T
+    返回 (Q 词表 × 宽度, U_k 宽度 × dim, 奇异值)。V_k = Q U_k；文档向量 X V_k = B U_k。
+    """
+    width = min(dim + oversample, n_terms)
+    rng = np.random.default_rng(seed)
+    q = rng.standard_normal((n_terms, width)).astype(np.float32)
+    for _ in range(power_iters + 1):
+        y = np.zeros((n_terms, width), dtype=np.float64)
+        for _, _, indptr, indices, data in csr.batches():
+            _xt_times_add(indptr, indices, data, _x_times(indptr, indices, data, q), y)
+        q = np.linalg.qr(y)[0].astype(np.float32)
+
+    b = np.memmap(b_path, dtype=np.float32, mode="w+", shape=(csr.rows, width))
+    gram = np.zeros((width, width), dtype=np.float64)
+    for start, stop, indptr, indices, data in csr.batches():
+        block = _x_times(indptr, indices, data, q)
+        b[start:stop] = block
+        gram += block.T.astype(np.float64) @ block
+    b.flush()
+    del b
+
+    eigvals, eigvecs = np.linalg.eigh(gram)
+    order = np.argsort(eigvals)[::-1][:dim]
+    return q, eigvecs[:, order].astype(np.float32), np.sqrt(np.maximum(eigvals[order], 0))
+
+
+# ---------------------------------------------------------------------------
+# IVF
+# ---------------------------------------------------------------------------
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return m / norms
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 65536) -> np.ndarray:
+    """每个向量最近（点积最大）的簇。"""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        block = np.asarray(vectors[start:start + batch], dtype=np.float32)
+        out[start:start + batch] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def train_kmeans(vectors: np.ndarray, nlist: int, iters: int = KMEANS_ITERS, sample: int = TRAIN_SAMPLE,
+                 seed: int = SEED) -> np.ndarray:
+    """球面 k-means（余弦）：最多用 sample 个文档训练。空的簇换成随机一个文档。"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    idx = np.sort(rng.choice(n, min(n, sample), replace=False))
+    train = np.asarray(vectors[idx], dtype=np.float32)
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(train, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        sums[present] = np.add.reduceat(train[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = train[rng.choice(len(train), len(empty))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def default_nlist(n_docs: int) -> int:
+    return max(1, min(n_docs, 65536, int(4 * math.sqrt(n_docs))))
+
+
+# ---------------------------------------------------------------------------
+# 建索引
+# ---------------------------------------------------------------------------
+
+def build_dense(collection: str, index_dir: str, dim: int = DEFAULT_DIM, vocab: int = DEFAULT_VOCAB,
+                nlist: Optional[int] = None, fields: Sequence[str] = DEFAULT_FIELDS,
+                power_iters: int = POWER_ITERS, seed: int = SEED) -> Dict[str, Any]:
+    """从集合文件建稠密向量索引到 index_dir，返回 meta。"""
+    os.makedirs(index_dir, exist_ok=True)
+    start = time.time()
+
+    n_docs, df = count_df(collection, fields)
+    terms, idf = select_vocab(df, n_docs, vocab)
+    del df
+    if n_docs == 0 or not terms:
+        raise ValueError(f"{collection}: no documents or no usable terms to build vectors from")
+    term_id = {t: i for i, t in enumerate(terms)}
+    print(f"[dense] {n_docs} documents, vocabulary {len(terms)} terms ({time.time() - start:.1f}s)")
+
+    tmp = [os.path.join(index_dir, name) for name in
+           ("tfidf.tmp.indptr", "tfidf.tmp.indices", "tfidf.tmp.data", "b.tmp", "docvecs.tmp")]
+    try:
+        docid_blob, docid_off = write_csr(collection, os.path.join(index_dir, "tfidf.tmp"), term_id, idf, fields)
+        csr = _Csr(os.path.join(index_dir, "tfidf.tmp"))
+        dim = min(dim, len(terms), n_docs)
+        q, u, singular = randomized_svd(csr, len(terms), dim, tmp[3], power_iters=power_iters, seed=seed)
+        del csr
+        print(f"[dense] SVD to {dim} dimensions ({time.time() - start:.1f}s)")
+
+        # 文档向量 = B U_k，归一化
+        b = np.memmap(tmp[3], dtype=np.float32, mode="r", shape=(n_docs, q.shape[1]))
+        docvecs = np.memmap(tmp[4], dtype=np.float32, mode="w+", shape=(n_docs, dim))
+        for s in range(0, n_docs, 65536):
+            docvecs[s:s + 65536] = _normalize(np.asarray(b[s:s + 65536]) @ u)
+        del b
+
+        nlist = min(nlist or default_nlist(n_docs), n_docs)
+        centroids = train_kmeans(docvecs, nlist, seed=seed)
+        labels = _assign(docvecs, centroids)
+        rows = np.argsort(labels, kind="stable").astype(np.int32)
+        lists = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist)))).astype(np.int64)
+        del labels
+        print(f"[dense] IVF with {nlist} lists ({time.time() - start:.1f}s)")
+
+        vectors = np.memmap(os.path.join(index_dir, "vectors.f16"), dtype=np.float16, mode="w+", shape=(n_docs, dim))
+        for s in range(0, n_docs, 65536):
+            vectors[s:s + 65536] = docvecs[rows[s:s + 65536]]
+        vectors.flush()
+        del vectors, docvecs
+    finally:
+        for path in tmp:
+            if os.path.exists(path):
+                os.remove(path)
+
+    rows.tofile(os.path.join(index_dir, "rows.i32"))
+    np.save(os.path.join(index_dir, "lists.npy"), lists)
+    np.save(os.path.join(index_dir, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(index_dir, "idf.npy"), idf)
+    np.save(os.path.join(index_dir, "proj.npy"), (q @ u).astype(np.float32))
+    with open(os.path.join(index_dir, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    with open(os.path.join(index_dir, "docids.blob"), "wb") as f:
+        f.write(docid_blob)
+    np.array(docid_off, dtype=np.int64).tofile(os.path.join(index_dir, "docids.off"))
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "docs": n_docs,
+        "dim": dim,
+        "vocab": len(terms),
+        "nlist": nlist,
+        "fields": list(fields),
+        "singular_values": [round(float(x), 4) for x in singular[:10]],
+        "collection": os.path.abspath(collection),
+        "build_id": f"{time.time():.6f}",
+    }
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"[dense] Indexed {n_docs} documents, {dim} dimensions, {nlist} lists in {time.time() - start:.2f}s "
+          f"-> {index_dir}")
+    return meta
+
+
+# ---------------------------------------------------------------------------
+# 查询
+# ---------------------------------------------------------------------------
+
+class DenseIndex:
+    """打开 build_dense 建的目录（mmap），search(text, k) 返回 [(DocID, 余弦相似度)]。"""
+
+    def __init__(self, index_dir: str):
+        self.dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{index_dir} was built by a different version of dense_index.py, rebuild it.")
+        with open(os.path.join(index_dir, "terms.json"), "r", encoding="utf-8") as f:
+            self.term_id = {t: i for i, t in enumerate(json.load(f))}
+        self.fields = self.meta["fields"]
+        self.idf = np.load(os.path.join(index_dir, "idf.npy"))
+        self.proj = np.load(os.path.join(index_dir, "proj.npy"), mmap_mode="r")
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.lists = np.load(os.path.join(index_dir, "lists.npy"))
+        n, dim = self.meta["docs"], self.meta["dim"]
+        self.vectors = np.memmap(os.path.join(index_dir, "vectors.f16"), dtype=np.float16, mode="r", shape=(n, dim))
+        self.rows = np.memmap(os.path.join(index_dir, "rows.i32"), dtype=np.int32, mode="r", shape=(n,))
+        with open(os.path.join(index_dir, "docids.blob"), "rb") as f:
+            self.docid_blob = f.read()
+        self.docid_off = np.fromfile(os.path.join(index_dir, "docids.off"), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.meta["docs"]
+
+    def docid(self, docno: int) -> str:
+        return self.docid_blob[self.docid_off[docno]:self.docid_off[docno + 1]].decode("utf-8")
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """查询文本 -> 归一化的向量；一个词都不在词表里时返回 None。"""
+        counts: Dict[str, int] = {}
+        for term in analyze(text):
+            counts[term] = counts.get(term, 0) + 1
+        ids, values = tfidf_row(counts, self.term_id, self.idf)
+        if not len(ids):
+            return None
+        vec = values @ np.asarray(self.proj[ids])
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else None
+
+    def search_vector(self, vec: np.ndarray, k: int = 40, nprobe: int = DEFAULT_NPROBE) -> List[Tuple[int, float]]:
+        """[(docno, 分数)]，只看最近的 nprobe 个簇。nprobe >= 簇数就是精确搜索。"""
+        nlist = len(self.centroids)
+        nprobe = min(nprobe, nlist)
+        near = np.argsort(-(self.centroids @ vec))[:nprobe] if nprobe < nlist else np.arange(nlist)
+        slots = [np.arange(self.lists[c], self.lists[c + 1]) for c in near if self.lists[c + 1] > self.lists[c]]
+        if not slots:
+            return []
+        chunks = [np.asarray(self.vectors[self.lists[c]:self.lists[c + 1]], dtype=np.float32) @ vec
+                  for c in near if self.lists[c + 1] > self.lists[c]]
+        scores = np.concatenate(chunks)
+        slots_all = np.concatenate(slots)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        rows = np.asarray(self.rows[slots_all[top]])
+        # 分数相同时原来的文档顺序小的在前（和 local_bm25 / ES 一样）
+        order = np.lexsort((rows, -scores[top]))
+        return [(int(rows[i]), float(scores[top][i])) for i in order]
+
+    def search(self, text: str, k: int = 40, nprobe: int = DEFAULT_NPROBE) -> List[Tuple[str, float]]:
+        vec = self.embed(text)
+        if vec is None:
+            return []
+        return [(self.docid(docno), score) for docno, score in self.search_vector(vec, k, nprobe)]
+
+
+# ---------------------------------------------------------------------------
+# 融合
+# ---------------------------------------------------------------------------
+
+def rrf(rankings: Sequence[Sequence[str]], k: int = RRF_K, depth: Optional[int] = None) -> List[str]:
+    """
+    Reciprocal rank fusion：每个排名里第 r 名（从 1 开始）得 1 / (k + r)，加起来从高到低。
+    分数相同时按第一次出现的先后。
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for r, docid in enumerate(ranking, 1):
+            scores[docid] = scores.get(docid, 0.0) + 1.0 / (k + r)
+    fused = sorted(scores, key=lambda d: -scores[d])
+    return fused[:depth] if depth is not None else fused
+
+
+# ---------------------------------------------------------------------------
+# 评估（和 eqs_eval 一样的 P/R）
+# ---------------------------------------------------------------------------
+
+def evaluate_gold(dense: DenseIndex, gold_standard: str, index: str = "student_index", depth: int = 40,
+                  nprobe: int = DEFAULT_NPROBE, lexical: bool = True) -> Dict[str, Any]:
+    """
+    gold standard 的每个查询跑 dense（original_query，没有就用 keyword_query），lexical 时再跑
+    keyword / kibana（eqs_fetch，ES 或 IR_LOCAL_INDEX），hybrid = rrf(kibana, dense)。
+    用 eqs_metrics 算 P@k / R@k / MAP ...，返回每个 run 的结果表，另外打印 dense 的延迟。
+    """
+    from async_runner import LatencyHistogram
+    from eqs_evaluate_query_set_v5 import (eqs_depth_ks, eqs_fetch, eqs_gold_docid_list, eqs_keyword_query,
+                                           eqs_metrics)
+    from gold_stream import DOCIDS_ONLY, iter_queries
+
+    runs: Dict[str, Dict[Any, List[str]]] = {"dense": {}}
+    if lexical:
+        runs.update({"keyword": {}, "kibana": {}, "hybrid": {}})
+    qrels: Dict[Any, List[str]] = {}
+    latency = LatencyHistogram()
+
+    def ids(result: Dict[str, Any]) -> List[str]:
+        return [h["_id"] for h in result["hits"]["hits"]]
+
+    for q in iter_queries(gold_standard, DOCIDS_ONLY):
+        number = q["number"]
+        qrels[number] = eqs_gold_docid_list(q["matches"])
+        text = q.get("original_query") or q.get("keyword_query") or ""
+        t = time.perf_counter()
+        runs["dense"][number] = [d for d, _ in dense.search(text, depth, nprobe)]
+        latency.record(time.perf_counter() - t)
+        if lexical:
+            if q.get("keyword_query"):
+                runs["keyword"][number] = ids(eqs_fetch(eqs_keyword_query(q["keyword_query"]), index, depth))
+            if (q.get("kibana_query") or {}).get("query"):
+                runs["kibana"][number] = ids(eqs_fetch(q["kibana_query"]["query"], index, depth))
+            runs["hybrid"][number] = rrf([runs["kibana"].get(number, []), runs["dense"][number]], depth=depth)
+
+    tables = eqs_metrics(runs, qrels, eqs_depth_ks(depth))
+    print("\n" + latency.format("dense search"))
+    return tables
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="LSA dense vectors with an IVF index, and RRF hybrid fusion.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="Build a dense index from a .json collection")
+    b.add_argument("collection")
+    b.add_argument("index_dir")
+    b.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    b.add_argument("--vocab", type=int, default=DEFAULT_VOCAB)
+    b.add_argument("--nlist", type=int, default=None, help="IVF lists (default about 4 * sqrt(docs))")
+    b.add_argument("--power-iters", type=int, default=POWER_ITERS)
+    b.add_argument("--fields", nargs="*", default=DEFAULT_FIELDS)
+
+    s = sub.add_parser("search", help="Search a dense index")
+    s.add_argument("index_dir")
+    s.add_argument("query")
+    s.add_argument("--size", type=int, default=10)
+    s.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+
+    e = sub.add_parser("eval", help="P/R of dense and hybrid runs on a gold standard (eqs_metrics)")
+    e.add_argument("index_dir")
+    e.add_argument("gold", nargs="?", default="gold_standard_v5.json")
+    e.add_argument("--index", default="student_index", help="Lexical index for keyword/kibana/hybrid")
+    e.add_argument("--depth", type=int, default=40)
+    e.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    e.add_argument("--no-lexical", dest="lexical", action="store_false", help="Only evaluate the dense run")
+
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        build_dense(args.collection, args.index_dir, args.dim, args.vocab, args.nlist, args.fields, args.power_iters)
+        return
+
+    dense = DenseIndex(args.index_dir)
+    if args.command == "eval":
+        evaluate_gold(dense, args.gold, args.index, args.depth, args.nprobe, args.lexical)
+        return
+
+    start = time.perf_counter()
+    hits = dense.search(args.query, args.size, args.nprobe)
+    print(f"{len(hits)} hits in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for docid, score in hits:
+        print(f"{score:8.4f}  {docid}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+增量重建索引用的清单（manifest）：上次建索引时每个 DocID 的内容哈希。
+
+新的集合文件从头到尾流式读一遍，每个文档算一个内容哈希（source 那一行的原始字节），
+和清单比：
+    added      清单里没有的 DocID           -> bulk index
+    changed    有，但哈希不一样              -> bulk index（覆盖）
+    unchanged  哈希一样                      -> 不发
+    deleted    清单里有、新文件里没有的 DocID -> bulk delete
+所以只改了 1% 的文档，发给 Elasticsearch 的也只有这 1%；读文件 + 算哈希是本地的，很快。
+
+清单格式（一个 .npz，numpy 直接读，几百万个文档也只要几十 MB）：
+    keys       uint64，DocID 的 64 位哈希，排好序（二分查找）
+    hashes     uint64，内容哈希，和 keys 一一对应
+    docid_blob / docid_off   DocID 原文（删除的时候要用），和 keys 一一对应
+    meta       JSON：索引名、集合文件、文档数、时间
+64 位哈希在几百万个文档里撞车的概率是 1e-7 量级，撞了也只是漏掉一个文档的更新。
+
+idc_index_delta()（idc_index_doc_collection_v7.py）用这里的 Delta 决定发什么。
+"""
+
+import hashlib
+import json
+import os
+import time
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+BATCH = 10000                # 每读这么多个文档，和清单批量比一次（numpy 向量化）
+MANIFEST_VERSION = 1
+
+
+def key_hash(docid: str) -> int:
+    return int.from_bytes(hashlib.blake2b(docid.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def content_hash(source: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(source, digest_size=8).digest(), "little")
+
+
+def manifest_path(index_name: str) -> str:
+    """默认的清单文件：当前目录下 <索引名>.manifest.npz（清单记录的是索引的状态，不跟集合文件走）。"""
+    return f"{index_name}.manifest.npz"
+
+
+class Manifest:
+    """一个索引的 DocID -> 内容哈希。"""
+
+    def __init__(self, keys: np.ndarray, hashes: np.ndarray, docid_blob: bytes, docid_off: np.ndarray,
+                 meta: Optional[Dict[str, Any]] = None):
+        self.keys = keys
+        self.hashes = hashes
+        self.docid_blob = docid_blob
+        self.docid_off = docid_off
+        self.meta = meta or {}
+
+    @classmethod
+    def empty(cls) -> "Manifest":
+        return cls(np.zeros(0, np.uint64), np.zeros(0, np.uint64), b"", np.zeros(1, np.uint64))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Manifest"]:
+        """读清单；文件不存在返回 None。"""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as z:
+            meta = json.loads(bytes(z["meta"]).decode("utf-8"))
+            if meta.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"{path} was written by a different version, rebuild the index.")
+            return cls(z["keys"], z["hashes"], z["docid_blob"].tobytes(), z["docid_off"], meta)
+
+    def save(self, path: str, **meta: Any) -> None:
+        """先写临时文件再改名，中途出错不会留下半个清单。"""
+        self.meta = dict(self.meta, **meta, version=MANIFEST_VERSION, docs=len(self),
+                         saved=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, keys=self.keys, hashes=self.hashes,
+                 docid_blob=np.frombuffer(self.docid_blob, np.uint8), docid_off=self.docid_off,
+                 meta=np.frombuffer(json.dumps(self.meta).encode("utf-8"), np.uint8))
+        os.replace(tmp, path)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def docid(self, i: int) -> str:
+        return self.docid_blob[int(self.docid_off[i]):int(self.docid_off[i + 1])].decode("utf-8")
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """每个 key 在清单里的下标和找到没有。"""
+        pos = np.searchsorted(self.keys, keys)
+        clipped = np.minimum(pos, max(len(self.keys) - 1, 0))
+        found = (pos < len(self.keys)) & (self.keys[clipped] == keys) if len(self.keys) else \
+            np.zeros(len(keys), bool)
+        return clipped, found
+
+
+class _Entries:
+    """新清单的条目，边读边攒（array 比 list 省内存：每个文档 16 字节 + DocID）。"""
+
+    def __init__(self) -> None:
+        self.keys = array("Q")
+        self.hashes = array("Q")
+        self.blob = bytearray()
+        self.off = array("Q", [0])
+
+    def add(self, key: int, h: int, docid: bytes) -> None:
+        self.keys.append(key)
+        self.hashes.append(h)
+        self.blob += docid
+        self.off.append(len(self.blob))
+
+    def build(self) -> Manifest:
+        """按 key 排序；同一个 DocID 出现多次时留最后一个（和 ES 一样，后写的覆盖先写的）。"""
+        keys = np.frombuffer(self.keys, np.uint64) if self.keys else np.zeros(0, np.uint64)
+        n = len(keys)
+        order = np.lexsort((np.arange(n), keys))            # 按 key，key 相同按出现顺序
+        if n:
+            last = np.append(keys[order][1:] != keys[order][:-1], True)
+            order = order[last]
+        hashes = np.frombuffer(self.hashes, np.uint64)[order] if n else np.zeros(0, np.uint64)
+        off = np.frombuffer(self.off, np.uint64)
+        blob = bytearray()
+        new_off = array("Q", [0])
+        for i in order.tolist():
+            blob += self.blob[off[i]:off[i + 1]]
+            new_off.append(len(blob))
+        return Manifest(keys[order], hashes, bytes(blob), np.frombuffer(new_off, np.uint64).copy())
+
+
+class Delta:
+    """
+    把新集合文件和旧清单比，产生要发的 _bulk 请求体。用法：
+
+        delta = Delta("collection.json", Manifest.load(path) or Manifest.empty())
+        for kind, docids, body in delta.chunks():     # kind 是 "index" 或 "delete"
+            ... 发出去，记下失败的 DocID ...
+        delta.manifest(failed).save(path)
+
+    chunks() 是生成器，读完一批就给出一批，不会把整个文件读进内存。
+    counts 里是 added / changed / deleted / unchanged / bytes（读了多少字节）。
+    """
+
+    def __init__(self, filename: str, old: Manifest, max_chunk_bytes: int = 10 * 1024 * 1024):
+        self.filename = filename
+        self.old = old
+        self.max_chunk_bytes = max_chunk_bytes
+        self.counts = {"added": 0, "changed": 0, "deleted": 0, "unchanged": 0, "bytes": 0}
+        self.seen = np.zeros(len(old), bool)
+        self.entries = _Entries()
+        self.added: Set[str] = set()      # 新加的 DocID，发送失败时要从新清单里去掉
+        self.deleted: List[int] = []      # 要删的文档在旧清单里的下标
+
+    def _pairs(self) -> Iterator[Tuple[bytes, bytes]]:
+        from compressed_input import iter_pairs      # 集合文件可以是压缩的
+        for action, source in iter_pairs(self.filename):
+            self.counts["bytes"] += len(action) + len(source)
+            yield action, source
+
+    def chunks(self) -> Iterator[Tuple[str, List[str], bytes]]:
+        out = bytearray()
+        out_ids: List[str] = []
+        batch: List[Tuple[str, bytes, bytes]] = []
+
+        def flush_batch() -> Iterator[Tuple[str, List[str], bytes]]:
+            nonlocal out, out_ids
+            keys = np.fromiter((key_hash(d) for d, _, _ in batch), np.uint64, len(batch))
+            hashes = np.fromiter((content_hash(s.rstrip(b"\r\n")) for _, _, s in batch), np.uint64, len(batch))
+            pos, found = self.old.lookup(keys)
+            same = found & (self.old.hashes[pos] == hashes) if len(self.old) else found
+            self.seen[pos[found]] = True
+            for i, (docid, action, source) in enumerate(batch):
+                self.entries.add(int(keys[i]), int(hashes[i]), docid.encode("utf-8"))
+                if same[i]:
+                    self.counts["unchanged"] += 1
+                    continue
+                if found[i]:
+                    self.counts["changed"] += 1
+                else:
+                    self.counts["added"] += 1
+                    self.added.add(docid)
+                if out and len(out) + len(action) + len(source) > self.max_chunk_bytes:
+                    yield "index", out_ids, bytes(out)
+                    out, out_ids = bytearray(), []
+                out += action if action.endswith(b"\n") else action + b"\n"
+                out += source if source.endswith(b"\n") else source + b"\n"
+                out_ids.append(docid)
+            batch.clear()
+
+        for action, source in self._pairs():
+            docid = json.loads(action)["index"]["_id"]
+            batch.append((str(docid), action, source))
+            if len(batch) >= BATCH:
+                yield from flush_batch()
+        if batch:
+            yield from flush_batch()
+        if out:
+            yield "index", out_ids, bytes(out)
+
+        # 旧清单里有、这次一个都没见到的：删掉
+        self.deleted = np.flatnonzero(~self.seen).tolist()
+        self.counts["deleted"] = len(self.deleted)
+        out, out_ids = bytearray(), []
+        for i in self.deleted:
+            docid = self.old.docid(i)
+            line = json.dumps({"delete": {"_id": docid}}, ensure_ascii=False).encode("utf-8") + b"\n"
+            if out and len(out) + len(line) > self.max_chunk_bytes:
+                yield "delete", out_ids, bytes(out)
+                out, out_ids = bytearray(), []
+            out += line
+            out_ids.append(docid)
+        if out:
+            yield "delete", out_ids, bytes(out)
+
+    def manifest(self, failed: Sequence[str] = ()) -> Manifest:
+        """
+        发完以后的新清单。failed 是没发成功的 DocID：新加的不记，改过的记旧哈希、
+        要删的留着，这样下次还会再发一次。
+        """
+        failed = set(failed)
+        entries = self.entries
+        if failed:
+            entries = _Entries()
+            off = self.entries.off
+            old_hash = {}
+            for i in range(len(self.entries.keys)):
+                docid = bytes(self.entries.blob[off[i]:off[i + 1]]).decode("utf-8")
+                if docid not in failed:
+                    entries.add(self.entries.keys[i], self.entries.hashes[i], docid.encode("utf-8"))
+                elif docid not in self.added:
+                    if not old_hash:
+                        old_hash = {int(k): int(h) for k, h in zip(self.old.keys, self.old.hashes)}
+                    entries.add(self.entries.keys[i], old_hash[self.entries.keys[i]], docid.encode("utf-8"))
+        for i in self.deleted:
+            docid = self.old.docid(i)
+            if docid in failed:
+                entries.add(int(self.old.keys[i]), int(self.old.hashes[i]), docid.encode("utf-8"))
+        return entries.build()
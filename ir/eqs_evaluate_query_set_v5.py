@@ -17,23 +17,26 @@ correct. Check those below before you run this program!
 
 """
 
-from elasticsearch import Elasticsearch
 import json
+import sys
 # from rgs_read_gold_standard_v6 import rgs_read
 # now have eqs_read() below
 
-es = Elasticsearch( "http://localhost:9200" )
-# Create the client. Make sure Elasticsearch is already running!
+import es_client
 
-import warnings
-from elasticsearch.exceptions import ElasticsearchWarning
-warnings.simplefilter('ignore', ElasticsearchWarning)
+es = es_client.client
+# The client is shared with the other programs and only created when es is
+# first used ( see es_client.py ). Make sure Elasticsearch is already running!
 
 """-----------------------------------------------------------------------------
 
 Read a gold standard JSON file. json.loads() reads a string containing a JSON
 and converts it to a Python dictionary. Returns this dictionary.
 
+The whole file has to fit in memory. For very big gold standards use
+gold_stream.iter_queries(), which gives the queries one at a time, and
+eqs_eval_stream() below.
+
 """
 
 def eqs_read( gold_standard ):
@@ -90,6 +93,9 @@ n_vals: List of required values for n, e.g. [ 5, 10 ]
 
 Calculates Precision and Recall at the values of n specified.  
 
+Returns a dictionary { n: ( precision, recall ) } for the values of n which
+could be computed.
+
 """
 
 def eqs_eval_query( query_type, returned_hits, gold_hits, n_vals ):
@@ -97,15 +103,22 @@ def eqs_eval_query( query_type, returned_hits, gold_hits, n_vals ):
     # print( 'eqs_eval_query:' )
     # print( query_type, returned_hits, gold_hits, n_vals )
 
+    results = {}
     for n in n_vals:
 
         print( '\nResults for n=', n )
-        eqs_eval_query_n( query_type, returned_hits, gold_hits, n )
+        pr = eqs_eval_query_n( query_type, returned_hits, gold_hits, n )
+        if pr is not None:
+            results[ n ] = pr
+
+    return results
 
 """-----------------------------------------------------------------------------
 
 Args as above, except last arg is an integer value of n.
 
+Returns ( precision, recall ), or None if there are not enough results.
+
 """
 
 def eqs_eval_query_n( query_type, returned_hits, gold_hits, n ):
@@ -120,14 +133,122 @@ def eqs_eval_query_n( query_type, returned_hits, gold_hits, n ):
         if matching_docids_in_collection == 0:
             print( 'ERROR: No gold_hits! .json must be wrong!' )
 
+        # A set, so each gold DocID is checked in one step rather than by
+        # scanning the top n every time.
+        top_n = set( returned_hits[ 0: n ] )
         matching_docids_in_results = 0
         for docid in gold_hits:
-            if docid in returned_hits[ 0: n ]:
+            if docid in top_n:
                 matching_docids_in_results += 1
 
-        print( 'Precision = %.2f' % ( matching_docids_in_results / n ) )
-        print( 'Recall    = %.2f' % \
-               ( matching_docids_in_results / matching_docids_in_collection ) )
+        precision = matching_docids_in_results / n
+        recall = matching_docids_in_results / matching_docids_in_collection
+
+        print( 'Precision = %.2f' % precision )
+        print( 'Recall    = %.2f' % recall )
+
+        return precision, recall
+
+"""-----------------------------------------------------------------------------
+
+Turns a keyword_query string into the query actually submitted to Elastic.
+
+"""
+
+def eqs_keyword_query( keyword_query ):
+
+    return { "multi_match": { "query": keyword_query, "fields": ["parsedParagraphs","title"],\
+             "type": "best_fields"}}
+
+"""-----------------------------------------------------------------------------
+
+Opens the result cache in cache_file. Returns ( cache, generation ) where
+generation identifies the current state of the index. After a re-index it is
+different, so all the old results are ignored.
+
+"""
+
+def eqs_open_cache( cache_file, index = 'student_index' ):
+
+    from result_cache import ResultCache, generation_from_stats
+
+    local = eqs_backend()
+    if local is not es:
+        return ( ResultCache( cache_file ), local.generation() )
+
+    stats = es.indices.stats( index = index, metric = [ 'docs', 'indexing', 'segments' ] )
+    return ( ResultCache( cache_file ), generation_from_stats( stats.body ) )
+
+"""-----------------------------------------------------------------------------
+
+Returns what to search: the local index from local_bm25.py if the environment
+variable IR_LOCAL_INDEX is set, otherwise Elasticsearch.
+
+"""
+
+def eqs_backend():
+
+    from local_bm25 import search_backend
+
+    return search_backend() or es
+
+"""-----------------------------------------------------------------------------
+
+Submits query to Elastic and returns the result. If cache is given ( from
+eqs_open_cache() ) and the same query was run before on the same index, the
+DocIDs are taken from the cache instead. Only [ 'hits' ][ 'hits' ][ i ][ '_id' ]
+is filled in for cached results.
+
+Only the DocIDs and scores are returned ( see eqs_fetch() ), not the _source of
+the documents.
+
+"""
+
+def eqs_search( query, cache = None, index = 'student_index', size = 40 ):
+
+    if cache is None:
+        return eqs_fetch( query, index, size )
+
+    from result_cache import cache_key
+
+    result_cache, generation = cache
+    key = cache_key( { 'query': query }, size, generation )
+    docids = result_cache.get( key )
+    if docids is None:
+        result = eqs_fetch( query, index, size )
+        result_cache.put( key, eqs_returned_docid_list( result[ 'hits' ][ 'hits' ] ) )
+        return result
+
+    return { 'hits': { 'hits': [ { '_id': docid } for docid in docids ] } }
+
+"""-----------------------------------------------------------------------------
+
+Gets the top size hits for query with only [ '_id' ] and [ '_score' ] in each
+hit. "_source": false and filter_path make Elastic send back the DocIDs and
+scores and nothing else, instead of the whole parsedParagraphs of every hit.
+
+Up to one page ( deep_search.PAGE_SIZE, 1000 hits ) this is one request. Deeper
+than that, the hits are fetched page by page with a point-in-time and
+search_after ( deep_search.iter_hits() ), so any size works, e.g. 5000.
+
+"""
+
+def eqs_fetch( query, index = 'student_index', size = 40 ):
+
+    from deep_search import ID_FILTER_PATH, PAGE_SIZE, hit_pairs, iter_hits
+
+    if size <= PAGE_SIZE:
+        pairs = hit_pairs( eqs_backend().search(
+            index = index,
+            size = size, # Max number of hits to return. Default is 10.
+            query = query,
+            source = False,
+            track_total_hits = False,
+            filter_path = ID_FILTER_PATH ) )
+    else:
+        pairs = iter_hits( query, index, size )
+
+    return { 'hits': { 'hits': [ { '_id': docid, '_score': score } for docid, score in pairs ] } }
 
 """-----------------------------------------------------------------------------
 
@@ -139,9 +260,28 @@ Evaluates the queries on the Gold Standard. Always double-check:
 20.03.25 now takes gold_standard filename as a parameter. Now read in using
 eqs_read() above.
 
+cache_file: Optional. If given, e.g. 'results_cache.sqlite', results are kept
+in this file (see result_cache.py) and a query is only sent to Elastic again if
+it or the index has changed since it was last run.
+
+Also returns the results for all queries together, computed by eval_metrics.py
+(needs numpy): { 'keyword': table, 'kibana': table }. Each table is a dictionary
+with 'qid' ( the query numbers ) and one array per measure, 'P@5', 'R@5',
+'P@10', 'R@10', 'AP', 'RR', 'nDCG@5', ..., 'R-prec', one value per query.
+
+index: Index to search, student_index unless told otherwise (bench.py uses
+its own index so that it does not overwrite yours).
+
+depth: Number of hits to fetch for each query, 40 by default. With a deeper
+depth, the tables also have P@100 / R@100 and P@depth / R@depth, e.g.
+
+eqs_eval( 'gold_standard_v5.json', depth = 1000 )    # R@1000
+
 """
 
-def eqs_eval( gold_standard ):
+def eqs_eval( gold_standard, cache_file = None, index = 'student_index', depth = 40 ):
+
+    cache = eqs_open_cache( cache_file, index ) if cache_file else None
 
     d = eqs_read( gold_standard )
 
@@ -149,6 +289,8 @@ def eqs_eval( gold_standard ):
 
     print( 'Number of queries in Gold Standard:', len( query_list ) )
  
+    runs = { 'keyword': {}, 'kibana': {} }  # query number -> returned DocIDs
+    qrels = {}                              # query number -> gold DocIDs
 
     for q in query_list:
         original_query = q[ "original_query" ]
@@ -165,13 +307,9 @@ def eqs_eval( gold_standard ):
 
         if keyword_query != '':
 
-            query = { "multi_match": { "query": keyword_query, "fields": ["parsedParagraphs","title"],\
-                       "type": "best_fields"}}
+            query = eqs_keyword_query( keyword_query )
             print( 'keyword_query actually submitted:', query )
-            keyword_result = es.search(
-                index = 'student_index',
-                size = 40, # Max number of hits to return. Default is 10.
-                query = query )
+            keyword_result = eqs_search( query, cache, index, depth )
         else:
             print( 'Could not submit keyword_query=''' )
             keyword_result = []
@@ -179,10 +317,7 @@ def eqs_eval( gold_standard ):
 
         # Blank queries, i.e. {} crash Elastic...
         if kibana_query[ "query" ] != {}:
-            kibana_result = es.search(
-                index = 'student_index',
-                size = 40, # Max number of hits to return. Default is 10.
-                query = kibana_query[ "query" ])
+            kibana_result = eqs_search( kibana_query[ "query" ], cache, index, depth )
         else:
             print( 'Could not submit kibana_query={}' )
             kibana_result = []
@@ -217,6 +352,325 @@ def eqs_eval( gold_standard ):
             eqs_returned_docid_list( kibana_result[ 'hits' ] [ 'hits' ] ),\
             eqs_gold_docid_list( q[ "matches" ] ), [ 5, 10 ] )
 
+        qrels[ q[ "number" ] ] = eqs_gold_docid_list( q[ "matches" ] )
+        runs[ 'keyword' ][ q[ "number" ] ] = \
+            eqs_returned_docid_list( keyword_result[ 'hits' ] [ 'hits' ] )
+        runs[ 'kibana' ][ q[ "number" ] ] = \
+            eqs_returned_docid_list( kibana_result[ 'hits' ] [ 'hits' ] )
+
+    if cache:
+        print( '\n' + cache[ 0 ].stats() )
+        cache[ 0 ].close()
+
+    return eqs_metrics( runs, qrels, eqs_depth_ks( depth ) )
+
+"""-----------------------------------------------------------------------------
+
+The cut-offs k to measure P@k, R@k and nDCG@k at when depth hits are fetched
+for each query: 5 and 10, plus 100 and depth itself when they are deeper than
+the usual 40.
+
+"""
+
+def eqs_depth_ks( depth ):
+
+    ks = [ 5, 10 ] + [ k for k in ( 100, depth ) if 40 < k <= depth ]
+
+    return sorted( set( ks ) )
+
+"""-----------------------------------------------------------------------------
+
+Computes P@k, R@k, AP, RR, nDCG@k and R-precision for every query in one go
+using eval_metrics.py (needs numpy), and prints the averages over all queries.
+
+runs: { 'keyword': { number: [ returned DocIDs ] }, 'kibana': { ... } }
+qrels: { number: [ gold DocIDs ] }
+ks: Values of k for P@k, R@k and nDCG@k
+
+Returns { 'keyword': table, 'kibana': table }, see eqs_eval().
+
+"""
+
+def eqs_metrics( runs, qrels, ks = [ 5, 10 ] ):
+
+    from eval_metrics import evaluate, summarize
+
+    tables = {}
+    for query_type in runs:
+        tables[ query_type ] = evaluate( runs[ query_type ], qrels, ks )
+
+        print( '\nAverage over all queries for', query_type + '_query:' )
+        for measure, value in summarize( tables[ query_type ] ).items():
+            print( '%-8s = %.2f' % ( measure, value ) )
+
+    return tables
+
+"""-----------------------------------------------------------------------------
+
+Same as eqs_eval() but the queries are not sent one after another. They are all
+sent to Elasticsearch concurrently by async_runner.py (needs aiohttp), then
+evaluated in order as before.
+
+concurrency: Number of queries in flight at once.
+rate: Max queries per second, so that a shared cluster is not overloaded.
+      0 means no limit.
+
+Latency of every query is recorded, and p50/p95/p99 for the keyword and kibana
+queries are printed after the Precision and Recall results. Returns the same
+tables as eqs_eval().
+
+eqs_eval_async( 'gold_standard_v5.json', concurrency = 16, rate = 100 )
+
+"""
+
+def eqs_eval_async( gold_standard, concurrency = 8, rate = 50.0 ):
+
+    from async_runner import LatencyHistogram, run_queries
+
+    d = eqs_read( gold_standard )
+
+    query_list = d[ "queries" ]
+
+    print( 'Number of queries in Gold Standard:', len( query_list ) )
+
+    # Collect every query to submit: ( position in query_list, type, body )
+    jobs = []
+    for i, q in enumerate( query_list ):
+        if q[ "keyword_query" ] != '':
+            jobs.append( ( i, 'keyword', \
+                           { 'query': eqs_keyword_query( q[ "keyword_query" ] ) } ) )
+        # Blank queries, i.e. {} crash Elastic...
+        if q[ "kibana_query" ][ "query" ] != {}:
+            jobs.append( ( i, 'kibana', { 'query': q[ "kibana_query" ][ "query" ] } ) )
+
+    answers = run_queries( [ body for i, query_type, body in jobs ], size = 40, \
+                           concurrency = concurrency, rate = rate, \
+                           index = 'student_index' )
+
+    histograms = { 'keyword': LatencyHistogram(), 'kibana': LatencyHistogram() }
+    returned = {}
+    runs = { 'keyword': {}, 'kibana': {} }
+    qrels = {}
+    for ( i, query_type, body ), ( docids, latency ) in zip( jobs, answers ):
+        returned[ ( i, query_type ) ] = docids
+        histograms[ query_type ].record( latency )
+
+    for i, q in enumerate( query_list ):
+
+        print( '\n==========================================================' )
+
+        print( '\noriginal_query:', q[ "original_query" ] )
+        print( 'keyword_query:', q[ "keyword_query" ] )
+        print( 'kibana_query:', q[ "kibana_query" ] )
+
+        for query_type in [ 'keyword', 'kibana' ]:
+
+            if ( i, query_type ) not in returned:
+                print( 'Could not submit', query_type + '_query' )
+                continue
+
+            print( "\nResult of %s Elastic search:" % query_type.capitalize() )
+            print( 'Number of hits:', len( returned[ ( i, query_type ) ] ) )
+
+            eqs_eval_query( query_type + '_result', returned[ ( i, query_type ) ], \
+                eqs_gold_docid_list( q[ "matches" ] ), [ 5, 10 ] )
+
+            runs[ query_type ][ q[ "number" ] ] = returned[ ( i, query_type ) ]
+        qrels[ q[ "number" ] ] = eqs_gold_docid_list( q[ "matches" ] )
+
+    tables = eqs_metrics( runs, qrels )
+
+    print( '\n==========================================================' )
+    print( '\nLatency:' )
+    for query_type in [ 'keyword', 'kibana' ]:
+        print( histograms[ query_type ].format( query_type + '_query' ) )
+
+    return tables
+
+"""-----------------------------------------------------------------------------
+
+Same measures as eqs_eval(), for gold standards too big to read in one go,
+e.g. hundreds of thousands of queries. The file is parsed incrementally
+( gold_stream.py, without the sentences ), and parsing, querying and scoring
+overlap: while one batch of batch_size queries is scored, the next ones are
+already being searched by workers threads. Only running totals are kept, so
+memory stays flat however long the file is, and the averages so far are
+printed after every batch.
+
+csv_file: Optional. One row per query and query type with every measure.
+
+Returns the averages, { 'keyword': { 'P@5': ..., 'MAP': ... }, 'kibana': ... },
+the same numbers eqs_eval() prints at the end.
+
+eqs_eval_stream( 'gold_standard_big.json', batch_size = 500, workers = 4 )
+
+"""
+
+def eqs_eval_stream( gold_standard, cache_file = None, index = 'student_index', depth = 40, \
+                     batch_size = 200, workers = 4, csv_file = None ):
+
+    import csv
+    import time
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    from gold_stream import iter_batches
+
+    cache = eqs_open_cache( cache_file, index ) if cache_file else None
+    ks = eqs_depth_ks( depth )
+    totals = { 'keyword': {}, 'kibana': {} }
+    counts = { 'keyword': 0, 'kibana': 0 }
+    out = open( csv_file, 'w', newline = '', encoding = 'utf-8' ) if csv_file else None
+    writer = csv.writer( out ) if out else None
+    start = time.perf_counter()
+    done = 0
+
+    pending = deque()
+    with ThreadPoolExecutor( max( 1, workers ) ) as pool:
+        for batch in iter_batches( gold_standard, batch_size ):
+            pending.append( eqs_stream_submit( pool, batch, cache, index, depth ) )
+            # Parse at most workers batches ahead of the scoring
+            if len( pending ) > workers:
+                done += eqs_stream_score( pending.popleft(), cache, ks, totals, counts, writer )
+                eqs_stream_progress( done, start, totals, counts )
+        while pending:
+            done += eqs_stream_score( pending.popleft(), cache, ks, totals, counts, writer )
+            eqs_stream_progress( done, start, totals, counts )
+
+    if out:
+        out.close()
+        print( 'Wrote', csv_file )
+    if cache:
+        print( cache[ 0 ].stats() )
+        cache[ 0 ].close()
+
+    names = { 'AP': 'MAP', 'RR': 'MRR' }
+    averages = {}
+    for query_type in totals:
+        averages[ query_type ] = { names.get( measure, measure ): total / max( counts[ query_type ], 1 ) \
+                                   for measure, total in totals[ query_type ].items() }
+        print( '\nAverage over all queries for', query_type + '_query:' )
+        for measure, value in averages[ query_type ].items():
+            print( '%-8s = %.2f' % ( measure, value ) )
+
+    return averages
+
+"""-----------------------------------------------------------------------------
+
+Used by eqs_eval_stream(). Starts searching one batch of gold standard queries
+in the thread pool and returns what eqs_stream_score() needs to finish it.
+Cached results are looked up here and only the rest is searched ( the cache is
+only ever used from this thread ).
+
+"""
+
+def eqs_stream_submit( pool, batch, cache, index, depth ):
+
+    jobs = []   # ( position in batch, type, query )
+    for i, q in enumerate( batch ):
+        if q[ "keyword_query" ] != '':
+            jobs.append( ( i, 'keyword', eqs_keyword_query( q[ "keyword_query" ] ) ) )
+        # Blank queries, i.e. {} crash Elastic...
+        if q[ "kibana_query" ][ "query" ] != {}:
+            jobs.append( ( i, 'kibana', q[ "kibana_query" ][ "query" ] ) )
+
+    keys = []
+    answers = [ None ] * len( jobs )
+    if cache:
+        from result_cache import cache_key
+        result_cache, generation = cache
+        keys = [ cache_key( { 'query': query }, depth, generation ) for i, query_type, query in jobs ]
+        answers = result_cache.get_many( keys )
+
+    missing = [ j for j, docids in enumerate( answers ) if docids is None ]
+    future = pool.submit( eqs_stream_search, [ jobs[ j ][ 2 ] for j in missing ], index, depth )
+
+    return batch, jobs, keys, answers, missing, future
+
+def eqs_stream_search( queries, index, depth ):
+
+    return [ eqs_returned_docid_list( eqs_fetch( query, index, depth )[ 'hits' ][ 'hits' ] ) \
+             for query in queries ]
+
+"""-----------------------------------------------------------------------------
+
+Used by eqs_eval_stream(). Waits for one batch from eqs_stream_submit(),
+scores it with eval_metrics.py and adds the results to the running totals.
+Returns the number of gold standard queries in the batch.
+
+"""
+
+def eqs_stream_score( submitted, cache, ks, totals, counts, writer ):
+
+    from eval_metrics import evaluate
+
+    batch, jobs, keys, answers, missing, future = submitted
+
+    searched = future.result()
+    for j, docids in zip( missing, searched ):
+        answers[ j ] = docids
+    if cache and missing:
+        cache[ 0 ].put_many( [ ( keys[ j ], answers[ j ] ) for j in missing ] )
+
+    qrels = { i: eqs_gold_docid_list( q[ "matches" ] ) for i, q in enumerate( batch ) }
+    runs = { 'keyword': {}, 'kibana': {} }
+    for ( i, query_type, query ), docids in zip( jobs, answers ):
+        runs[ query_type ][ i ] = docids
+
+    tables = { query_type: evaluate( runs[ query_type ], qrels, ks ) for query_type in runs }
+    measures = [ m for m in tables[ 'keyword' ] if m != 'qid' ]
+    if writer and counts[ 'keyword' ] == 0:
+        writer.writerow( [ 'number', 'type' ] + measures )
+
+    for query_type, table in tables.items():
+        for m in measures:
+            totals[ query_type ][ m ] = totals[ query_type ].get( m, 0.0 ) + float( table[ m ].sum() )
+        counts[ query_type ] += len( batch )
+        if writer:
+            for row, i in enumerate( table[ 'qid' ] ):
+                writer.writerow( [ batch[ i ][ "number" ], query_type ] + \
+                                 [ '%.4f' % table[ m ][ row ] for m in measures ] )
+
+    return len( batch )
+
+def eqs_stream_progress( done, start, totals, counts ):
+
+    import time
+
+    rate = done / max( time.perf_counter() - start, 1e-9 )
+    line = 'Queries: %d ( %.0f/s )' % ( done, rate )
+    for query_type in totals:
+        n = max( counts[ query_type ], 1 )
+        line += '   %s MAP %.3f P@10 %.3f' % ( query_type, totals[ query_type ][ 'AP' ] / n, \
+                                             totals[ query_type ][ 'P@10' ] / n )
+    print( line, flush = True )
+
+"""-----------------------------------------------------------------------------
+
+Same queries as eqs_eval(), but each one is sent with "profile": true so that
+Elasticsearch reports where the time went (query_profile.py). For every query
+prints took, rewrite, create_weight, build_scorer, next_doc, score next to
+P@5, P@10 and R@10, then the clauses (TermQuery on title, PhraseQuery ...)
+that cost the most over the whole query set.
+
+repeat: Run each query this many times and keep the median (first run is cold).
+csv_file: One row per query with the timings and P/R. None = do not write.
+
+eqs_profile( 'gold_standard_v5.json', csv_file = 'profile.csv' )
+
+"""
+
+def eqs_profile( gold_standard, csv_file = 'profile.csv', repeat = 1, top = 10 ):
+
+    from query_profile import format_report, profile_gold
+
+    rows, clauses = profile_gold( gold_standard, repeat = repeat, csv_file = csv_file )
+
+    print( format_report( rows, clauses, top ) )
+    if csv_file:
+        print( '\nWrote', csv_file )
+
+    return rows, clauses
+
 #eqs_eval( 'gold_standard_v5.json' )
 # Evaluate Results
 # ASSUMES
@@ -226,5 +680,6 @@ def eqs_eval( gold_standard ):
 # 4. .json file contains queries you want to test
 # 5. The program refers to the CORRECT index above
 # 6. The program refers to the CORRECT .json in rgs_read_gold_standard_v6.py
-print( 'To run this do: eqs_eval( \'gold_standard_v5.json\' )' )
+if __name__ == '__main__' and len( sys.argv ) <= 1:
+    print( 'To run this do: eqs_eval( \'gold_standard_v5.json\' )' )
 
@@ -0,0 +1,112 @@
+"""
+整个进程共用一个 Elasticsearch 客户端（和一个 requests.Session），第一次真正用到时才创建。
+
+以前每个模块 import 的时候就自己建一个 Elasticsearch(...)，超时设置还各不一样；
+import elasticsearch 本身就要 0.5 秒左右。现在：
+    es_client.client          代理对象，第一次访问属性（es.search、es.indices ...）时才
+                              import elasticsearch 并建客户端，之后一直用同一个
+    es_client.get_client()    直接拿到真正的客户端
+    es_client.get_session()   make_results.py 这种直接发 HTTP 的代码用的共享 Session
+两个都有连接池、keep-alive、gzip 压缩和重试（429 / 502 / 503 / 504 和超时）。
+
+Elasticsearch 地址默认 http://localhost:9200，可以用环境变量 IR_ES_URL 改。
+"""
+
+import os
+import threading
+from typing import Any, Optional
+
+ES_URL = os.environ.get("IR_ES_URL", "http://localhost:9200")
+
+# 连接池大小：sweep / 并行 bulk 最多同时这么多个请求，多了要排队等连接
+POOL_SIZE = 16
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 10
+RETRY_STATUS = (429, 502, 503, 504)
+
+_lock = threading.Lock()
+_client = None
+_session = None
+
+
+def get_client() -> Any:
+    """共享的 elasticsearch.Elasticsearch 客户端（第一次调用时创建）。"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import warnings
+                from elasticsearch import Elasticsearch
+                from elasticsearch.exceptions import ElasticsearchWarning
+
+                # 关掉安全警告（本机的 ES 没开安全认证）
+                warnings.simplefilter("ignore", ElasticsearchWarning)
+                _client = Elasticsearch(
+                    ES_URL,
+                    request_timeout=REQUEST_TIMEOUT,
+                    max_retries=MAX_RETRIES,
+                    retry_on_timeout=True,
+                    retry_on_status=RETRY_STATUS,
+                    http_compress=True,
+                    connections_per_node=POOL_SIZE,
+                )
+    return _client
+
+
+def get_session() -> Any:
+    """共享的 requests.Session：连接池 + keep-alive + 重试，响应用 gzip 压缩传输。"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                # 只读请求（_search / _msearch / _stats），POST 重试也没问题
+                retry = Retry(total=3, backoff_factor=0.5, status_forcelist=RETRY_STATUS,
+                              allowed_methods=None, raise_on_status=False)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers["Accept-Encoding"] = "gzip, deflate"
+                _session = session
+    return _session
+
+
+def close() -> None:
+    """关掉客户端和 Session（一般不用调，进程结束时会自己关）。"""
+    global _client, _session
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+class LazyClient:
+    """
+    看起来就是一个 Elasticsearch 客户端，但只有第一次访问属性时才真的创建。
+    模块里原来的 es = Elasticsearch(...) 换成 es = es_client.client，其他代码不用改。
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_client(), name)
+
+    def __repr__(self) -> str:
+        state = "connected" if _client is not None else "not created yet"
+        return f"<LazyClient {ES_URL} ({state})>"
+
+
+client = LazyClient()
+
+
+def configure(url: Optional[str] = None) -> None:
+    """换一个 Elasticsearch 地址（已经建好的客户端和 Session 会关掉，下次用时按新地址重建）。"""
+    global ES_URL
+    if url and url != ES_URL:
+        close()
+        ES_URL = url
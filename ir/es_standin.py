@@ -0,0 +1,463 @@
+"""
+进程内的 Elasticsearch 替身：一个本地 HTTP 服务器，只实现我们的脚本用到的那几个接口，
+打分用 local_bm25.py（和 ES 一样的 BM25），所以不用装 ES / 起 JVM 也能跑基准和测试。
+
+    HEAD/PUT/DELETE /<index>           索引存在吗 / 建索引 / 删索引
+    POST /_bulk, /<index>/_bulk        index / create / delete / update（只支持 {"doc": ...}）
+    POST /<index>/_search              query、size、from、_source
+    POST /_msearch, /<index>/_msearch
+    POST /<index>/_pit, DELETE /_pit    开 / 关 point-in-time；POST /_search 带 "pit" 和 search_after 翻页
+                                       （只支持按 _score 降序、_shard_doc 升序，也就是默认顺序）
+    ?filter_path=a.b,c.d               _search / _msearch 的响应只留这些路径（不支持通配符）
+    POST /<index>/_mget                {"ids": [...]} 或 {"docs": [{"_id": ...}]}
+    GET  /<index>/_count
+    /<index>/_refresh、_forcemerge、_settings   直接回 acknowledged
+    GET  /                              集群信息（elasticsearch 客户端要看 X-Elastic-Product 头）
+
+文档就放在内存里（DocID -> 原始 source 行）。有改动以后第一次搜索（或 _refresh）时，
+把这个索引写成一个 idc_index 格式的集合文件，用 local_bm25.build_index 重建本地索引，
+所以效果和 ES 的 refresh 一样：写进去的文档要等下一次 refresh 才搜得到，之后的搜索不再有建索引的开销。
+
+请求体可以是 gzip 压缩的（es_client 的客户端开着 http_compress）。
+所有请求排队用一把锁（local_bm25 读 source 用的是同一个文件句柄），所以它测不出 ES 的并发能力，
+只是一个行为正确、延迟稳定的对照。
+
+用法：
+    with StandIn() as url:                # 随机端口，退出时关掉、删临时目录
+        es_client.configure(url)
+        ...
+    python es_standin.py --port 9200      # 单独跑，给别的进程用
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from local_bm25 import LocalIndex, build_index
+
+
+class _Index:
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: Dict[str, bytes] = {}       # DocID -> source 行（不含换行）
+        self.settings: Dict[str, Any] = {}
+        self.dirty = True
+        self.generation = 0
+        self.local: Optional[LocalIndex] = None
+        self.local_dir: Optional[str] = None
+
+
+class StandIn:
+    """替身服务器。start() 返回地址，stop() 关掉；也可以用 with。"""
+
+    def __init__(self, work_dir: Optional[str] = None):
+        self.own_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="es_standin_")
+        self.indices: Dict[str, _Index] = {}
+        self.lock = threading.RLock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.url = ""
+        self._auto_id = 0
+        self._last_auto_id = ""
+        self.pits: Dict[str, Tuple[str, LocalIndex, Dict[str, Any]]] = {}   # PIT id -> (索引名, 快照, 排名缓存)
+        self._pit_seq = 0
+
+    # ------------------------------------------------------------------
+    # 启动 / 关闭
+    # ------------------------------------------------------------------
+
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> str:
+        standin = self
+
+        class Handler(_Handler):
+            owner = standin
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        return self.url
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.own_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __enter__(self) -> str:
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    # ------------------------------------------------------------------
+    # 索引
+    # ------------------------------------------------------------------
+
+    def create(self, name: str, settings: Optional[Dict[str, Any]] = None) -> None:
+        with self.lock:
+            self.delete(name)
+            self.indices[name] = _Index(name)
+            self.indices[name].settings = settings or {}
+
+    def delete(self, name: str) -> bool:
+        with self.lock:
+            index = self.indices.pop(name, None)
+            if index is None:
+                return False
+            if index.local_dir:
+                shutil.rmtree(index.local_dir, ignore_errors=True)
+            return True
+
+    def refresh(self, name: str) -> LocalIndex:
+        """有改动就把文档写成集合文件，重建本地索引（新目录，旧的删掉：旧目录可能还被 mmap 着）。"""
+        with self.lock:
+            index = self.indices[name]
+            if index.dirty or index.local is None:
+                index.generation += 1
+                target = os.path.join(self.work_dir, f"{name}-{index.generation}")
+                os.makedirs(target, exist_ok=True)
+                collection = os.path.join(target, "collection.json")
+                with open(collection, "wb") as f:
+                    for docid, source in index.docs.items():
+                        f.write(json.dumps({"index": {"_id": docid}}).encode("utf-8") + b"\n")
+                        f.write(source + b"\n")
+                build_index(collection, os.path.join(target, "index"))
+                old = index.local_dir
+                index.local = LocalIndex(os.path.join(target, "index"))
+                index.local_dir = target
+                index.dirty = False
+                if old:
+                    shutil.rmtree(old, ignore_errors=True)
+            return index.local
+
+    def bulk(self, body: bytes, default_index: Optional[str]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        lines = body.split(b"\n")
+        items: List[Dict[str, Any]] = []
+        errors = False
+        i = 0
+        with self.lock:
+            while i < len(lines):
+                line = lines[i]
+                i += 1
+                if not line.strip():
+                    continue
+                op, meta = next(iter(json.loads(line).items()))
+                name = meta.get("_index", default_index)
+                docid = meta.get("_id")
+                source = lines[i].rstrip(b"\r") if op != "delete" and i < len(lines) else None
+                if op != "delete":
+                    i += 1
+                status, error = self._apply(op, name, docid, source)
+                if docid is None and op in ("index", "create") and status < 300:
+                    docid = self._last_auto_id
+                item: Dict[str, Any] = {"_index": name, "_id": docid, "status": status}
+                if error:
+                    errors = True
+                    item["error"] = error
+                items.append({op: item})
+        return {"took": int((time.perf_counter() - start) * 1000), "errors": errors, "items": items}
+
+    def _apply(self, op: str, name: Optional[str], docid: Optional[str],
+               source: Optional[bytes]) -> Tuple[int, Optional[Dict[str, str]]]:
+        if name is None:
+            return 400, {"type": "action_request_validation_exception", "reason": "index is missing"}
+        if name not in self.indices:
+            self.indices[name] = _Index(name)            # ES 默认也会自动建索引
+        index = self.indices[name]
+        if op == "delete":
+            if index.docs.pop(docid, None) is None:
+                return 404, None
+            index.dirty = True
+            return 200, None
+        if source is None:
+            return 400, {"type": "parse_exception", "reason": "missing source line"}
+        try:
+            doc = json.loads(source)
+        except ValueError as e:
+            return 400, {"type": "mapper_parsing_exception", "reason": str(e)}
+        if not isinstance(doc, dict):
+            return 400, {"type": "mapper_parsing_exception", "reason": "source is not an object"}
+        if op == "update":
+            if docid not in index.docs:
+                return 404, {"type": "document_missing_exception", "reason": f"[{docid}]: document missing"}
+            merged = json.loads(index.docs[docid])
+            merged.update(doc.get("doc") or {})
+            source = json.dumps(merged, ensure_ascii=False).encode("utf-8")
+        elif op == "create" and docid in index.docs:
+            return 409, {"type": "version_conflict_engine_exception", "reason": f"[{docid}]: document already exists"}
+        elif op not in ("index", "create"):
+            return 400, {"type": "illegal_argument_exception", "reason": f"unknown bulk action [{op}]"}
+        if docid is None:
+            self._auto_id += 1
+            docid = self._last_auto_id = f"auto-{self._auto_id}"
+        existed = docid in index.docs
+        index.docs[docid] = source
+        index.dirty = True
+        return (200 if existed else 201), None
+
+    def search(self, name: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            if name not in self.indices:
+                raise KeyError(name)
+            local = self.refresh(name)
+            result = local.search(body=body, source=body.get("_source", True), from_=body.get("from", 0))
+        for hit in result["hits"]["hits"]:
+            hit["_index"] = name
+        return result
+
+    # ------------------------------------------------------------------
+    # point-in-time
+    # ------------------------------------------------------------------
+
+    def open_pit(self, name: str) -> str:
+        """快照就是当时的 LocalIndex 对象：之后 refresh 换了新索引，它还能用（文件已经 mmap 着）。"""
+        with self.lock:
+            local = self.refresh(name)
+            self._pit_seq += 1
+            pit_id = f"{name}:{self._pit_seq}"
+            self.pits[pit_id] = (name, local, {})
+            return pit_id
+
+    def close_pit(self, pit_id: str) -> bool:
+        with self.lock:
+            return self.pits.pop(pit_id, None) is not None
+
+    def pit_search(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        带 PIT 的搜索。排名按 (-分数, docno)，和 top_k 的顺序一样；sort 值就是 [分数, docno]。
+        每个查询的排名缓存在 PIT 里，不够深的时候加倍重算，所以一页一页翻下去总共只算 log 次。
+        """
+        start = time.perf_counter()
+        for clause in body.get("sort", []):
+            field = next(iter(clause)) if isinstance(clause, dict) else clause
+            if field not in ("_score", "_shard_doc"):
+                raise ValueError(f"es_standin only sorts PIT searches by _score and _shard_doc, not [{field}]")
+        pit_id = body["pit"]["id"]
+        with self.lock:
+            if pit_id not in self.pits:
+                raise LookupError(pit_id)
+            name, local, ranked = self.pits[pit_id]
+            query = body.get("query", {"match_all": {}})
+            size = body.get("size", 10)
+            key = json.dumps(query, sort_keys=True)
+            after = body.get("search_after")
+            need = size + body.get("from", 0)
+            while True:
+                top, complete = ranked.get(key, ([], False))
+                if after is None:
+                    begin = body.get("from", 0)
+                else:
+                    keys = [(-score, docno) for docno, score in top]
+                    begin = bisect.bisect_right(keys, (-float(after[0]), int(after[1])))
+                if complete or begin + size <= len(top):
+                    break
+                need = max(need, begin + size, 2 * len(top))
+                found, _, _ = local.top_k(query, need)
+                ranked[key] = (found, len(found) < need)
+            hits = []
+            for docno, score in top[begin:begin + size]:
+                hit = {"_index": name, "_id": local.docid(docno), "_score": score, "sort": [score, docno]}
+                if body.get("_source", True) is not False:
+                    hit["_source"] = local.source(docno)
+                hits.append(hit)
+        return {"pit_id": pit_id, "took": int((time.perf_counter() - start) * 1000), "timed_out": False,
+                "hits": {"max_score": hits[0]["_score"] if hits else None, "hits": hits}}
+
+    def mget(self, name: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        ids = body.get("ids") or [d["_id"] for d in body.get("docs", [])]
+        with self.lock:
+            docs = self.indices[name].docs if name in self.indices else {}
+            out = []
+            for docid in ids:
+                source = docs.get(docid)
+                doc: Dict[str, Any] = {"_index": name, "_id": docid, "found": source is not None}
+                if source is not None:
+                    doc["_source"] = json.loads(source)
+                out.append(doc)
+        return {"docs": out}
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+def _error(status: int, kind: str, reason: str) -> Tuple[int, Dict[str, Any]]:
+    return status, {"error": {"type": kind, "reason": reason}, "status": status}
+
+
+def _filter_path(obj: Any, paths: List[List[str]]) -> Any:
+    """只留 paths 里的路径；列表里的每一项分别过滤，过滤完是空的就去掉（ES 也是这样）。"""
+    if any(not p for p in paths):
+        return obj
+    if isinstance(obj, list):
+        kept = [_filter_path(item, paths) for item in obj]
+        return [item for item in kept if item is not None]
+    if not isinstance(obj, dict):
+        return None
+    out = {}
+    for key, value in obj.items():
+        sub = [p[1:] for p in paths if p[0] == key]
+        if sub:
+            value = _filter_path(value, sub)
+            if value is not None and value != {} and value != []:
+                out[key] = value
+    return out or None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"          # keep-alive，和真的 ES 一样
+    disable_nagle_algorithm = True         # 头和正文分两次写，不关 Nagle 每个请求要多等 40 ms（延迟 ACK）
+    owner: StandIn
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(n) if n else b""
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return data
+
+    def _send(self, status: int, obj: Any) -> None:
+        out = json.dumps(obj, ensure_ascii=False).encode("utf-8") if obj is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(out)
+
+    def do_HEAD(self) -> None:
+        name = urlparse(self.path).path.strip("/")
+        self._body()
+        self._send(200 if name in self.owner.indices or not name else 404, None)
+
+    def do_DELETE(self) -> None:
+        name = urlparse(self.path).path.strip("/")
+        body = self._body()
+        if name == "_pit":
+            freed = self.owner.close_pit(json.loads(body)["id"])
+            self._send(200 if freed else 404, {"succeeded": True, "num_freed": int(freed)})
+        elif self.owner.delete(name):
+            self._send(200, {"acknowledged": True})
+        else:
+            self._send(*_error(404, "index_not_found_exception", f"no such index [{name}]"))
+
+    def do_PUT(self) -> None:
+        self._dispatch()
+
+    def do_GET(self) -> None:
+        self._dispatch()
+
+    def do_POST(self) -> None:
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split("/") if p]
+        body = self._body()
+        try:
+            status, obj = self._route(parts, params, body)
+        except KeyError as e:
+            status, obj = _error(404, "index_not_found_exception", f"no such index [{e.args[0]}]")
+        except LookupError as e:
+            status, obj = _error(404, "search_context_missing_exception", f"no such point in time [{e.args[0]}]")
+        except (ValueError, TypeError) as e:
+            status, obj = _error(400, "parsing_exception", str(e))
+        if status == 200 and "filter_path" in params and parts and parts[-1] in ("_search", "_msearch"):
+            obj = _filter_path(obj, [p.split(".") for p in params["filter_path"].split(",") if p]) or {}
+        self._send(status, obj)
+
+    def _route(self, parts: List[str], params: Dict[str, str], body: bytes) -> Tuple[int, Any]:
+        owner = self.owner
+        endpoint = parts[-1] if parts else ""
+        name = parts[0] if parts and not parts[0].startswith("_") else None
+
+        if not parts:
+            return 200, {"name": "es_standin", "cluster_name": "standin",
+                         "version": {"number": "8.19.0", "build_flavor": "default"},
+                         "tagline": "You Know, for Search"}
+        if endpoint == "_bulk":
+            return 200, owner.bulk(body, name)
+        if endpoint == "_search" and name is None:
+            request = json.loads(body) if body else {}
+            if "pit" not in request:
+                return _error(400, "illegal_argument_exception", "es_standin needs an index or a pit to search")
+            return 200, owner.pit_search(request)
+        if endpoint == "_pit" and name is not None:
+            return 200, {"id": owner.open_pit(name)}
+        if endpoint == "_msearch":
+            lines = [line for line in body.split(b"\n") if line.strip()]
+            responses = []
+            for header, query in zip(lines[::2], lines[1::2]):
+                target = json.loads(header).get("index", name)
+                try:
+                    responses.append(dict(owner.search(target, json.loads(query)), status=200))
+                except KeyError as e:
+                    status, err = _error(404, "index_not_found_exception", f"no such index [{e.args[0]}]")
+                    responses.append(err)
+                except (ValueError, TypeError) as e:
+                    responses.append(_error(400, "parsing_exception", str(e))[1])
+            return 200, {"took": 0, "responses": responses}
+        if name is None:
+            return _error(400, "illegal_argument_exception", f"unsupported endpoint {self.path}")
+        if len(parts) == 1 and self.command == "PUT":
+            owner.create(name, json.loads(body) if body else None)
+            return 200, {"acknowledged": True, "index": name}
+        if endpoint == "_search":
+            request = json.loads(body) if body else {}
+            for key in ("size", "from"):
+                if key in params:
+                    request[key] = int(params[key])
+            if params.get("_source") == "false":
+                request["_source"] = False
+            return 200, owner.search(name, request)
+        if endpoint == "_mget":
+            return 200, owner.mget(name, json.loads(body))
+        if endpoint == "_count":
+            with owner.lock:
+                return 200, {"count": len(owner.indices[name].docs)}
+        if endpoint == "_refresh":
+            owner.refresh(name)
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if endpoint in ("_forcemerge", "_settings", "_flush"):
+            if name not in owner.indices:
+                raise KeyError(name)
+            return 200, {"acknowledged": True, "_shards": {"total": 1, "successful": 1, "failed": 0}}
+        return _error(400, "illegal_argument_exception", f"unsupported endpoint {self.path}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="In-process Elasticsearch stand-in backed by local_bm25.")
+    ap.add_argument("--port", type=int, default=9200)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--dir", default=None, help="Working directory (default: a temporary one, removed on exit)")
+    args = ap.parse_args()
+
+    standin = StandIn(args.dir)
+    print(f"Elasticsearch stand-in on {standin.start(args.port, args.host)} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == "__main__":
+    main()
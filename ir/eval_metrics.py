@@ -0,0 +1,204 @@
+"""
+向量化的评估：把返回结果（runs）和 gold（qrels）一次性转成整数 ID 的 NumPy 矩阵，
+然后一次算完每个查询、每个 k 的 P@k、R@k、MAP、MRR、nDCG@k、R-precision。
+
+用法：
+    from eval_metrics import evaluate, summarize, format_table
+    table = evaluate(runs, qrels, ks=[5, 10])
+    print(format_table(table))
+
+runs:  {查询编号: [返回的 docid, 按排名]}
+qrels: {查询编号: [gold docid]}
+
+返回的 table 是一个 dict（像一张表）：
+    table["qid"]   -> 查询编号列表
+    table["P@5"]   -> 每个查询的 P@5（np.ndarray），其他指标同理
+summarize(table) 给出每个指标的平均值（MAP、MRR 就是 AP、RR 的平均）。
+
+需要 numpy: pip install numpy
+"""
+
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_KS = (5, 10)
+
+# 一次处理多少行（查询），控制中间矩阵的内存
+BLOCK_ROWS = 8192
+
+# gold 数不超过这个时，用逐列比较找相关结果，超过就用哈希表
+SMALL_GOLD = 16
+
+
+def encode(runs: Dict[Hashable, Sequence[str]], qrels: Dict[Hashable, Sequence[str]],
+           depth: Optional[int] = None) -> Tuple[List[Hashable], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    把 runs 和 qrels 转成整数矩阵（docid 字符串只在这里处理一次）。
+
+    返回 (qids, ranked, gold, n_rel)：
+        ranked: (查询数, depth) int32，每行是返回的 docid 编号，不够的补 -1
+        gold:   (查询数, 最多 gold 数) int32，每行是 gold docid 编号（去重），不够的补 -2
+        n_rel:  (查询数,) 每个查询的 gold 数
+    只评估在 qrels 里出现的查询；runs 里没有的查询当作什么都没返回。
+    """
+    qids = list(qrels)
+    ids: Dict[str, int] = {}
+
+    gold_rows = [list(dict.fromkeys(ids.setdefault(d, len(ids)) for d in qrels[q])) for q in qids]
+    run_rows = [[ids.setdefault(d, len(ids)) for d in runs.get(q, ())] for q in qids]
+
+    if depth is None:
+        depth = max((len(r) for r in run_rows), default=0)
+    max_gold = max((len(g) for g in gold_rows), default=0)
+
+    ranked = np.full((len(qids), max(depth, 1)), -1, dtype=np.int32)
+    gold = np.full((len(qids), max(max_gold, 1)), -2, dtype=np.int32)
+    for i, row in enumerate(run_rows):
+        row = row[:depth]
+        ranked[i, :len(row)] = row
+    for i, row in enumerate(gold_rows):
+        gold[i, :len(row)] = row
+    n_rel = np.array([len(g) for g in gold_rows], dtype=np.int64)
+
+    return qids, ranked, gold, n_rel
+
+
+def _hash(x: np.ndarray, row_salt: np.ndarray, bits: int) -> np.ndarray:
+    """(行, docid) -> [0, 2**bits) 的哈希，全部用 uint32 向量运算。"""
+    v = x.view(np.uint32) * np.uint32(0x9E3779B1)
+    v += row_salt
+    v ^= v >> np.uint32(15)
+    v *= np.uint32(0x2C1B3C6D)
+    return v >> np.uint32(32 - bits)
+
+
+def relevance_matrix(ranked: np.ndarray, gold: np.ndarray) -> np.ndarray:
+    """
+    (查询数, depth) bool：ranked[i, j] 是不是查询 i 的 gold。
+
+    gold 少（不超过 SMALL_GOLD 个）时，按 gold 的列逐列比较整个矩阵。
+    gold 多时，先把所有 (行, gold) 放进一个 bool 哈希表，ranked 查一次表得到候选，
+    再只对候选做精确比较，所以开销和 gold 的个数无关。
+    """
+    # 补位的 -2 永远不会等于 ranked 里的值（>= -1），多出来的列可以直接跳过
+    width = int((gold >= 0).sum(axis=1).max(initial=0))
+    if width <= SMALL_GOLD:
+        rel = np.zeros(ranked.shape, dtype=bool)
+        for j in range(width):
+            rel |= ranked == gold[:, j:j + 1]
+        return rel
+
+    ranked = np.ascontiguousarray(ranked, dtype=np.int32)
+    gold = np.ascontiguousarray(gold, dtype=np.int32)
+    n_q = ranked.shape[0]
+    bits = min(30, max(16, int(np.ceil(np.log2(gold.size * 8)))))
+    row_salt = np.arange(n_q, dtype=np.uint32)[:, None] * np.uint32(0x85EBCA77)
+
+    is_gold = gold >= 0
+    table = np.zeros(1 << bits, dtype=bool)
+    table[_hash(gold, row_salt, bits)[is_gold]] = True
+    rows, cols = np.nonzero(table[_hash(ranked, row_salt, bits)])
+
+    # 精确比较：(行 << 32 | docid) 在所有 gold 的有序 key 里能不能找到
+    keys = (rows.astype(np.int64) << 32) | ranked[rows, cols].astype(np.int64)
+    g_rows, g_cols = np.nonzero(is_gold)
+    gold_keys = np.sort((g_rows.astype(np.int64) << 32) | gold[g_rows, g_cols].astype(np.int64))
+    pos = np.minimum(np.searchsorted(gold_keys, keys), gold_keys.size - 1)
+    found = gold_keys[pos] == keys
+
+    rel = np.zeros(ranked.shape, dtype=bool)
+    rel[rows[found], cols[found]] = True
+    return rel
+
+
+def _metrics_block(rel: np.ndarray, n_rel: np.ndarray, ks: Sequence[int]) -> Dict[str, np.ndarray]:
+    """
+    相关的位置很稀疏，所以先取出所有 (行, 排名) 再用 bincount 按行汇总，
+    不在整个 (查询数, depth) 矩阵上做 cumsum。
+    """
+    n_q, depth = rel.shape
+    out: Dict[str, np.ndarray] = {}
+    safe_n_rel = np.maximum(n_rel, 1)
+
+    rows, cols = np.nonzero(rel)             # 按行、再按排名排好序
+    # 每个相关位置是本行第几个相关的（1, 2, 3...）
+    row_start = np.searchsorted(rows, np.arange(n_q))
+    nth = np.arange(1, rows.size + 1) - row_start[rows]
+
+    def per_row(weights: Optional[np.ndarray] = None, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        r = rows if mask is None else rows[mask]
+        w = weights if mask is None or weights is None else weights[mask]
+        return np.bincount(r, weights=w, minlength=n_q).astype(float)
+
+    for k in ks:
+        hits_at_k = per_row(mask=cols < k)
+        out[f"P@{k}"] = hits_at_k / k
+        out[f"R@{k}"] = hits_at_k / safe_n_rel
+
+    # AP：每个相关位置的 precision 之和 / gold 数
+    out["AP"] = per_row(nth / (cols + 1)) / safe_n_rel
+
+    # RR：第一个相关结果排名的倒数，没有就是 0
+    has_rel = np.bincount(rows, minlength=n_q) > 0
+    first = cols[np.minimum(row_start, max(rows.size - 1, 0))] if rows.size else np.zeros(n_q, dtype=int)
+    out["RR"] = np.where(has_rel, 1.0 / (first + 1), 0.0)
+
+    # nDCG@k（二元相关）
+    discount = 1.0 / np.log2(np.arange(2, max(depth, max(ks)) + 2))
+    ideal = np.concatenate([[0.0], np.cumsum(discount)])
+    gains = discount[cols]
+    for k in ks:
+        dcg = per_row(gains, cols < k)
+        idcg = ideal[np.minimum(n_rel, k)]
+        out[f"nDCG@{k}"] = np.divide(dcg, idcg, out=np.zeros(n_q), where=idcg > 0)
+
+    # R-precision：前 R 个结果（R = gold 数）里的 precision
+    out["R-prec"] = per_row(mask=cols < n_rel[rows]) / safe_n_rel
+
+    return out
+
+
+def evaluate_matrices(ranked: np.ndarray, gold: np.ndarray, n_rel: np.ndarray,
+                      ks: Sequence[int] = DEFAULT_KS) -> Dict[str, np.ndarray]:
+    """
+    已经编码好的矩阵（见 encode）-> 每个指标一个 (查询数,) 数组。
+    按 BLOCK_ROWS 行分块算，内存不随查询数增长太多。
+    """
+    parts: List[Dict[str, np.ndarray]] = []
+    for start in range(0, ranked.shape[0], BLOCK_ROWS):
+        stop = start + BLOCK_ROWS
+        rel = relevance_matrix(ranked[start:stop], gold[start:stop])
+        parts.append(_metrics_block(rel, n_rel[start:stop], ks))
+    if not parts:
+        return {}
+    return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+
+def evaluate(runs: Dict[Hashable, Sequence[str]], qrels: Dict[Hashable, Sequence[str]],
+             ks: Sequence[int] = DEFAULT_KS, depth: Optional[int] = None) -> Dict[str, Any]:
+    """
+    runs + qrels -> 结果表（dict）：{"qid": [...], "P@5": array, "R@5": array, ...}
+    """
+    qids, ranked, gold, n_rel = encode(runs, qrels, depth)
+    table: Dict[str, Any] = {"qid": qids}
+    table.update(evaluate_matrices(ranked, gold, n_rel, ks))
+    return table
+
+
+def summarize(table: Dict[str, Any]) -> Dict[str, float]:
+    """每个指标在所有查询上的平均值。AP -> MAP，RR -> MRR。"""
+    names = {"AP": "MAP", "RR": "MRR"}
+    return {names.get(k, k): float(np.mean(v)) if len(v) else 0.0
+            for k, v in table.items() if k != "qid"}
+
+
+def format_table(table: Dict[str, Any], digits: int = 2) -> str:
+    """把结果表排成文字，每行一个查询，最后一行是平均值。"""
+    cols = [k for k in table if k != "qid"]
+    lines = ["qid\t" + "\t".join(cols)]
+    for i, qid in enumerate(table["qid"]):
+        lines.append(f"{qid}\t" + "\t".join(f"{table[c][i]:.{digits}f}" for c in cols))
+    means = summarize(table)
+    lines.append("mean\t" + "\t".join(f"{v:.{digits}f}" for v in means.values()))
+    return "\n".join(lines)
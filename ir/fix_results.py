@@ -1,58 +1,25 @@
-import json
+from run_store import merge_results
 
 QUERIES_FILE = "2507244_queries.json"
 RESULTS_FILE = "2507244_results.json"
 OUT_FILE = "2507244_results_fixed_v2.json"
 
-def load_json(path: str):
-    with open(path, "r", encoding="utf-8-sig") as f:
-        return json.loads(f.read())
-
-def save_json(path: str, obj):
-    # 用 utf-8（不带 BOM）写出
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
-
-qfile = load_json(QUERIES_FILE)
-rfile = load_json(RESULTS_FILE)
-
-# 你的 results 文件可能顶层叫 results 或 queries（你之前替换过）
-r_list = rfile.get("queries") or rfile.get("results")
-if r_list is None:
-    raise KeyError("你的 results 文件顶层既没有 'queries' 也没有 'results'，先打开检查一下结构。")
-
-# 建一个 number -> query 的映射
-qmap = {}
-for q in qfile["queries"]:
-    qmap[q["number"]] = q
-
-# 把缺的字段补进去（最关键是 kibana_query）
-for item in r_list:
-    n = item["number"]
-    if n not in qmap:
-        raise KeyError(f"results 里有 number={n}，但 queries 文件里找不到对应条目。")
-
-    src = qmap[n]
-
-    # 必补：评分脚本会读
-    if "kibana_query" not in item:
-        item["kibana_query"] = src["kibana_query"]
-
-    # 建议也补上这些（有些版本脚本会用到/打印）
-    for k in ["original_query", "keyword_query", "answer_type", "exact_answers"]:
-        if k in src and k not in item:
-            item[k] = src[k]
-    if "matches" not in item:
-        item["matches"] = src["matches"]
-# 顶层信息也补齐（可有可无，但规范）
-for k in ["student_surname", "student_givenname", "student_reg_number", "topic_keywords"]:
-    if k in qfile and k not in rfile:
-        rfile[k] = qfile[k]
-
-# 确保顶层用 queries（评分脚本就是 d["queries"]）
-rfile["queries"] = r_list
-if "results" in rfile:
-    del rfile["results"]
-
-save_json(OUT_FILE, rfile)
-print(f"[DONE] Wrote: {OUT_FILE}")
\ No newline at end of file
+# 合并后的 run store（一个目录）：DocID 表 + 每个查询的整数数组，查询信息单独存，按 number 关联。
+# 以后改结果就重新 merge 这个目录，不用再多存一份完整的大 JSON。
+STORE_DIR = "2507244_runs"
+
+# 评分脚本要的旧格式（顶层 queries，每条带 kibana_query / matches 等）只是 store 的一个导出视图，
+# 随时可以重新导出：python run_store.py export 2507244_runs 2507244_results_fixed_v2.json
+EXPORT_LEGACY = True
+
+# queries 文件和 results 文件都是流式读的（一次一个查询），
+# results 里缺的字段（最关键是 kibana_query、matches）按 number 从 queries 文件补上，
+# 顶层的学生信息也一样补齐；results 顶层叫 results 或 queries 都可以
+store = merge_results(RESULTS_FILE, QUERIES_FILE, STORE_DIR)
+print(f"[DONE] Wrote: {STORE_DIR} ({len(store)} queries, {store.num_docs} distinct DocIDs)")
+
+if EXPORT_LEGACY:
+    # 输出和以前 json.dump(indent=2) 的一样（utf-8，不带 BOM）
+    store.export_legacy(OUT_FILE)
+    print(f"[DONE] Wrote: {OUT_FILE}")
+store.close()
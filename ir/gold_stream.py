@@ -0,0 +1,43 @@
+"""
+流式读 gold standard：边解析 "queries" 数组边一个一个给出查询，不用先把整个文件读进内存。
+
+eqs_read() 是 f.read() + json.loads()，整个文件（包括每个 matches[].sentences 的句子）
+都要先变成一个大 dict，第一个查询才能开始跑。几十万个查询的 gold standard 光这一步就要几 GB。
+这里用 json_stream.JsonArrayStream 一次读一块（CHUNK 字节），从缓冲区里解析出一个完整的查询
+就给出去，已经解析过的部分丢掉，所以内存只和最大的那一个查询有关：
+
+    for q in iter_queries("gold_standard_v5.json", skip=DOCIDS_ONLY):
+        q["number"], q["keyword_query"], q["kibana_query"], q["matches"][0]["docid"] ...
+
+    skip        要丢掉的字段名（任何一层的对象里都丢），比如只要 DocID 时丢掉 sentences
+    header      传一个 dict 进去，"queries" 以外的顶层字段（student_surname、topic_keywords ...）
+                会放进去（读完 "queries" 之前只有它前面的那些）
+
+BOM 和 eqs_read 的 utf-8-sig 一样处理（有就去掉）。文件格式不对时抛 ValueError，带字符位置。
+eqs_eval_stream()（eqs_evaluate_query_set_v5.py）用它一边解析一边查询一边打分。
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from json_stream import JsonArrayStream
+
+CHUNK = 1 << 20                  # 每次读 1 MB
+DOCIDS_ONLY = ("sentences",)     # 只要 matches[].docid 的时候丢掉的字段
+
+
+def iter_queries(path: str, skip: Sequence[str] = (), header: Optional[Dict[str, Any]] = None,
+                 chunk: int = CHUNK) -> Iterator[Dict[str, Any]]:
+    """按文件里的顺序给出 "queries" 里的每个查询（dict）。"""
+    return iter(JsonArrayStream(path, ("queries",), chunk, skip=skip, header=header))
+
+
+def iter_batches(path: str, batch_size: int, skip: Sequence[str] = DOCIDS_ONLY) -> Iterator[List[Dict[str, Any]]]:
+    """每次给出 batch_size 个查询（最后一批可能不满）。"""
+    batch: List[Dict[str, Any]] = []
+    for q in iter_queries(path, skip):
+        batch.append(q)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
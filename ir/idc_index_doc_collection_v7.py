@@ -8,30 +8,43 @@ Thanks to Catalin-Andrei Preda for a new version which is considerably faster
 than the original. It indexes the files in batches rather than individually.
 
 This version changes timeouts when Elasticsearch client is created on line 26.
+The client is now shared and created on first use, see es_client.py.
 
 *****************************************************************************"""
 
 import time
 
-from elasticsearch import Elasticsearch, helpers
+import argparse
+import io
 import json
+import mmap
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-# Disable security warnings:
-import warnings
-from elasticsearch.exceptions import ElasticsearchWarning
-warnings.simplefilter('ignore', ElasticsearchWarning)
+import es_client
 
-# Connect to ElasticSearch
-es = Elasticsearch( "http://localhost:9200", request_timeout=30, max_retries=10, retry_on_timeout=True )
+# Connect to ElasticSearch. Nothing happens until es is first used: then the
+# elasticsearch package is imported and one client is created, with the
+# timeouts, retries and connection pool set in es_client.py. Security warnings
+# are disabled there too.
+es = es_client.client
 
 """-----------------------------------------------------------------------------
 
 Creates and index. If it already exists, deletes it
 
+confirm: If True, waits for the user to press RETURN afterwards. Pass False
+when running unattended.
+settings, mappings: Optional index settings and mappings, e.g.
+IDC_BUILD_SETTINGS and IDC_MAPPINGS below. Default is Elasticsearch's own.
+
 """
 
-def idc_create_index( index_name ):
+def idc_create_index( index_name, confirm = True, settings = None,
+                      mappings = None ):
 
     # Check if the index exists
     if es.indices.exists( index=index_name ):
@@ -41,10 +54,11 @@ def idc_create_index( index_name ):
         es.indices.delete( index=index_name )
 
 
-    es.indices.create( index=index_name )
+    es.indices.create( index=index_name, settings=settings, mappings=mappings )
     print( 'New index', index_name, 'has been created.')
-    print( 'Press RETURN to continue.' )
-    input()
+    if confirm:
+        print( 'Press RETURN to continue.' )
+        input()
 
 """-----------------------------------------------------------------------------
 
@@ -64,10 +78,15 @@ If student_index already exists, it will be deleted first.
 
 5. Then you can search it - see below.
 
+6. The .json can also be compressed ( .gz, .bz2, .xz or .zst ). It is read and
+decompressed as it goes, see compressed_input.py.
+
 """
 
 def idc_index( filename, index_name ):
 
+    from elasticsearch import helpers
+
     filename = Path( filename )
     if not filename.is_file():
         print( f"File '{filename}' containing docs to be indexed does not exist." )
@@ -80,7 +99,9 @@ def idc_index( filename, index_name ):
     # Start the timer
     start_time = time.time()
 
-    with open( filename, 'r', encoding='utf-8' ) as f:
+    from compressed_input import open_collection
+
+    with io.TextIOWrapper( open_collection( filename ), encoding='utf-8' ) as f:
         while True:
             docid_json_str = f.readline()    # Read string containing JSON for ID
             content_json_str = f.readline()  # Read string containing JSON for doc
@@ -120,6 +141,735 @@ def idc_index( filename, index_name ):
 
 """-----------------------------------------------------------------------------
 
+Streaming version of idc_index() for very large collections.
+
+idc_stream_actions() is a generator which reads the .json one pair of lines at
+a time and yields one bulk action per document. Nothing is collected in a list,
+so memory stays flat however large the file is.
+
+stats is an optional dictionary. If given, the generator keeps 'docs' and
+'bytes' (raw bytes read from the file) up to date in it.
+
+If the .json is compressed and was written by compressed_input.py in frames,
+the frames are decompressed and parsed by a pool of processes, and the actions
+still come out in file order.
+
+"""
+
+def idc_stream_actions( filename, index_name, stats = None ):
+
+    from compressed_input import iter_documents
+
+    if stats is None:
+        stats = {}
+    stats[ 'docs' ] = 0
+    stats[ 'bytes' ] = 0
+
+    for docid, source, nbytes in iter_documents( str( filename ) ):
+
+        stats[ 'docs' ] += 1
+        stats[ 'bytes' ] += nbytes
+
+        yield {
+            "_index": index_name,
+            "_id": docid,
+            "_source": source
+        }
+
+"""-----------------------------------------------------------------------------
+
+Like idc_index() but feeds idc_stream_actions() to helpers.parallel_bulk() so
+that several bulk requests are in flight at once.
+
+thread_count: Number of worker threads sending bulk requests.
+chunk_size: Max number of documents in one bulk request.
+max_chunk_bytes: Max size in bytes of one bulk request.
+
+Each batch is capped by BOTH chunk_size and max_chunk_bytes, whichever is hit
+first. Instead of printing every DocID it prints a summary at the end with
+docs/sec and MB/sec. Returns the summary as a dictionary.
+
+idc_index_streaming( 'result_v3_utf8_2500_docs.json', 'student_index' )
+
+"""
+
+def idc_index_streaming( filename, index_name, thread_count = 4,
+                         chunk_size = 1000, max_chunk_bytes = 10 * 1024 * 1024 ):
+
+    from elasticsearch import helpers
+
+    filename = Path( filename )
+    if not filename.is_file():
+        print( f"File '{filename}' containing docs to be indexed does not exist." )
+        return
+
+    idc_create_index( index_name )
+
+    stats = {}
+    failed = 0
+
+    start_time = time.time()
+
+    # queue_size bounds the number of batches waiting for a free thread, so
+    # at most ( thread_count + queue_size ) batches are held in memory.
+    for ok, item in helpers.parallel_bulk(
+            es, idc_stream_actions( filename, index_name, stats ),
+            thread_count = thread_count,
+            chunk_size = chunk_size,
+            max_chunk_bytes = max_chunk_bytes,
+            queue_size = thread_count,
+            raise_on_error = False ):
+        if not ok:
+            failed += 1
+            if failed <= 10:                 # Don't flood the screen
+                print( 'Failed:', item )
+
+    elapsed_time = time.time() - start_time
+
+    summary = idc_throughput_summary( stats[ 'docs' ], stats[ 'bytes' ],
+                                      elapsed_time )
+    summary[ 'failed' ] = failed
+    print( f'Failed documents: {failed}' )
+
+    return summary
+
+"""-----------------------------------------------------------------------------
+
+Prints and returns docs/sec and MB/sec for an indexing run.
+
+"""
+
+def idc_throughput_summary( docs, nbytes, elapsed_time ):
+
+    elapsed_time = max( elapsed_time, 1e-9 )
+    summary = {
+        'docs': docs,
+        'bytes': nbytes,
+        'seconds': elapsed_time,
+        'docs_per_sec': docs / elapsed_time,
+        'mb_per_sec': nbytes / ( 1024 * 1024 ) / elapsed_time
+    }
+
+    print( f'Indexed {docs} documents ({nbytes / ( 1024 * 1024 ):.1f} MB) '
+           f'in {elapsed_time:.2f} seconds' )
+    print( f'Throughput: {summary[ "docs_per_sec" ]:.0f} docs/sec, '
+           f'{summary[ "mb_per_sec" ]:.2f} MB/sec' )
+
+    return summary
+
+"""-----------------------------------------------------------------------------
+
+Raw (zero-parse) ingestion.
+
+The collection .json is already in Elasticsearch bulk format: an
+{"index":{"_id":...}} line followed by a source line. So there is no need to
+decode it with json.loads() and have the client encode it again. We can just
+cut the file into pieces and send each piece as the body of a _bulk request.
+
+idc_raw_chunks() memory-maps the file and yields ( offset, end, docs, chunk )
+where chunk is the pairs of lines between offset and end. A chunk always
+contains whole pairs of lines and is at most max_chunk_bytes long, unless a
+single document is bigger than that, in which case it is sent on its own.
+
+Blank lines are skipped the same way idc_stream_actions() skips them: they
+are counted in offset and end but never sent, so every item in the _bulk
+response still lines up with one pair in the chunk.
+
+start: Byte offset to begin at. Must be the start of an action line.
+
+A compressed .json is handed to compressed_input.raw_chunks(), which gives the
+same chunks. Offsets are then in the decompressed file.
+
+"""
+
+def idc_raw_chunks( filename, max_chunk_bytes = 10 * 1024 * 1024, start = 0 ):
+
+    from compressed_input import is_compressed, pair_chunks, raw_chunks
+
+    if is_compressed( filename ):
+        yield from raw_chunks( str( filename ), max_chunk_bytes, start )
+        return
+
+    with open( filename, 'rb' ) as f:
+        if f.seek( 0, 2 ) == 0:          # mmap cannot map an empty file
+            return
+        with mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ ) as mm:
+            yield from pair_chunks( mm, max_chunk_bytes, start )
+
+"""-----------------------------------------------------------------------------
+
+Sends one raw chunk as a _bulk request. Returns a list of failed items, one
+dictionary per rejected document:
+
+{ 'docid': ..., 'status': ..., 'error': ..., 'action': b'...', 'source': b'...' }
+
+'action' and 'source' are the original lines, so the document can be retried
+exactly as it was in the file. Only the action line is ever decoded, and only
+when Elasticsearch did not report the _id itself.
+
+"""
+
+def idc_send_raw_chunk( chunk, index_name ):
+
+    response = es.bulk( index = index_name, operations = chunk )
+    if not response[ 'errors' ]:
+        return []
+
+    # One ( action, source ) per item, pairing lines the way they were read
+    lines = iter( chunk.split( b'\n' ) )
+    pairs = []
+    for line in lines:
+        if line.strip():
+            pairs.append( ( line, next( lines, b'' ) ) )
+
+    failures = []
+    for i, item in enumerate( response[ 'items' ] ):
+        result = next( iter( item.values() ) )
+        if result.get( 'status', 500 ) < 300:
+            continue
+
+        action, source = pairs[ i ]
+        docid = result.get( '_id' )
+        if docid is None:
+            docid = json.loads( action )[ 'index' ][ '_id' ]
+
+        failures.append( {
+            'docid': docid,
+            'status': result.get( 'status' ),
+            'error': result.get( 'error' ),
+            'action': action,
+            'source': source
+        } )
+
+    return failures
+
+"""-----------------------------------------------------------------------------
+
+Runs fn over items on thread_count threads and yields ( item, result ) in the
+original order. At most 2 * thread_count items are read ahead, so a generator
+of chunks is never pulled into memory all at once.
+
+"""
+
+def idc_ordered_map( fn, items, thread_count ):
+
+    with ThreadPoolExecutor( max_workers = thread_count ) as pool:
+        pending = deque()
+        for item in items:
+            pending.append( ( item, pool.submit( fn, item ) ) )
+            if len( pending ) >= 2 * thread_count:
+                item, future = pending.popleft()
+                yield item, future.result()
+
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+"""-----------------------------------------------------------------------------
+
+Indexes a collection using the raw ingestion path above.
+
+Returns a dictionary with the throughput summary plus 'failures', a list with
+one entry per chunk that had rejected documents:
+
+{ 'chunk': n, 'offset': byte offset of chunk, 'failures': [ ... ] }
+
+To retry the bad documents, send b''.join( f[ 'action' ] + b'\\n' +
+f[ 'source' ] + b'\\n' for f in failures ) with idc_send_raw_chunk().
+
+idc_index_raw( 'result_v3_utf8_2500_docs.json', 'student_index' )
+
+"""
+
+def idc_index_raw( filename, index_name, thread_count = 4,
+                   max_chunk_bytes = 10 * 1024 * 1024 ):
+
+    filename = Path( filename )
+    if not filename.is_file():
+        print( f"File '{filename}' containing docs to be indexed does not exist." )
+        return
+
+    idc_create_index( index_name )
+
+    docs = 0
+    nbytes = 0
+    chunk_failures = []
+
+    start_time = time.time()
+
+    def send( numbered_chunk ):
+        return idc_send_raw_chunk( numbered_chunk[ 1 ][ 3 ], index_name )
+
+    chunks = enumerate( idc_raw_chunks( filename, max_chunk_bytes ) )
+
+    for ( n, ( offset, end, count, chunk ) ), failures in \
+            idc_ordered_map( send, chunks, thread_count ):
+        docs += count
+        nbytes += end - offset
+        if failures:
+            chunk_failures.append( { 'chunk': n, 'offset': offset,
+                                     'failures': failures } )
+
+    elapsed_time = time.time() - start_time
+
+    summary = idc_throughput_summary( docs, nbytes, elapsed_time )
+    summary[ 'failures' ] = chunk_failures
+    print( 'Failed documents:',
+           sum( len( c[ 'failures' ] ) for c in chunk_failures ) )
+
+    return summary
+
+"""-----------------------------------------------------------------------------
+
+Resumable indexing.
+
+The checkpoint file is a small .json recording how far we have got:
+
+{ "filename": ..., "index": ..., "offset": ..., "batch": ..., "docs": ...,
+  "complete": false }
+
+offset is the byte offset just after the last bulk request which Elasticsearch
+acknowledged. Chunks are sent on several threads but are acknowledged in file
+order, so everything before offset is known to be indexed.
+
+The dead letter file holds documents which Elasticsearch rejected, in the same
+two-line bulk format as the collection, so it can be fed straight back in.
+
+"""
+
+def idc_read_checkpoint( checkpoint ):
+
+    if not Path( checkpoint ).is_file():
+        return None
+    with open( checkpoint, 'r', encoding='utf-8' ) as f:
+        return json.load( f )
+
+def idc_write_checkpoint( checkpoint, state ):
+
+    # Write to a temporary file then rename, so a crash while writing never
+    # leaves a half-written checkpoint behind.
+    tmp = str( checkpoint ) + '.tmp'
+    with open( tmp, 'w', encoding='utf-8' ) as f:
+        json.dump( state, f )
+    os.replace( tmp, checkpoint )
+
+"""-----------------------------------------------------------------------------
+
+Sends a raw chunk, retrying with exponential backoff ( backoff, 2 * backoff,
+4 * backoff, ... seconds ) if the request itself fails, e.g. a timeout or a 429
+because the cluster is overloaded. Gives up after max_attempts and re-raises.
+max_attempts must be at least 1.
+
+Returns the rejected documents, as idc_send_raw_chunk().
+
+"""
+
+def idc_send_with_backoff( chunk, index_name, max_attempts = 5, backoff = 1.0 ):
+
+    from elasticsearch import ApiError, TransportError
+
+    if max_attempts < 1:
+        raise ValueError( f'max_attempts must be at least 1, got {max_attempts}' )
+
+    for attempt in range( max_attempts ):
+        try:
+            return idc_send_raw_chunk( chunk, index_name )
+        except ( ApiError, TransportError ) as e:
+            status = getattr( e, 'status_code', None )
+            if status is not None and status != 429 and status < 500:
+                raise                    # e.g. 400 - retrying will not help
+            if attempt == max_attempts - 1:
+                raise
+            delay = backoff * 2 ** attempt
+            print( f'Bulk request failed ({e}), retrying in {delay:.1f} seconds' )
+            time.sleep( delay )
+
+"""-----------------------------------------------------------------------------
+
+Resends the documents in a dead letter file. Each round sends whatever is still
+failing, waiting backoff, 2 * backoff, 4 * backoff, ... seconds between rounds.
+Documents which still fail after max_attempts rounds are written back to the
+dead letter file. Returns the number left in it.
+
+"""
+
+def idc_retry_dead_letter( dead_letter, index_name, max_attempts = 5,
+                           backoff = 1.0 ):
+
+    if not Path( dead_letter ).is_file():
+        return 0
+    if max_attempts < 1:
+        raise ValueError( f'max_attempts must be at least 1, got {max_attempts}' )
+
+    for attempt in range( max_attempts ):
+        remaining = []
+        for offset, end, count, chunk in idc_raw_chunks( dead_letter ):
+            remaining += idc_send_with_backoff( chunk, index_name,
+                                                max_attempts, backoff )
+
+        with open( dead_letter, 'wb' ) as f:
+            for failure in remaining:
+                f.write( failure[ 'action' ] + b'\n' + failure[ 'source' ] + b'\n' )
+
+        if not remaining:
+            break
+        if attempt < max_attempts - 1:
+            delay = backoff * 2 ** attempt
+            print( f'{len( remaining )} documents still rejected, '
+                   f'retrying in {delay:.1f} seconds' )
+            time.sleep( delay )
+
+    if remaining:
+        print( f'{len( remaining )} documents could not be indexed, '
+               f'see {dead_letter}' )
+        for failure in remaining[ :10 ]:
+            print( 'DocID:', failure[ 'docid' ], failure[ 'error' ] )
+
+    return len( remaining )
+
+"""-----------------------------------------------------------------------------
+
+Like idc_index_raw() but can be restarted after a crash.
+
+checkpoint: Checkpoint file, default <filename>.checkpoint.json
+dead_letter: Dead letter file, default <filename>.dead_letter.json
+resume: If True and the checkpoint is for the same file and index, carry on
+        from the last acknowledged offset. Otherwise the index is recreated and
+        indexing starts from the beginning.
+settings, mappings: Passed to idc_create_index() when the index is created.
+
+Rejected documents go to the dead letter file and are retried at the end with
+idc_retry_dead_letter().
+
+idc_index_resumable( 'result_v3_utf8_2500_docs.json', 'student_index' )
+idc_index_resumable( 'result_v3_utf8_2500_docs.json', 'student_index',
+                     resume = True )
+
+"""
+
+def idc_index_resumable( filename, index_name, checkpoint = None,
+                         dead_letter = None, resume = False, thread_count = 4,
+                         max_chunk_bytes = 10 * 1024 * 1024, max_attempts = 5,
+                         backoff = 1.0, settings = None, mappings = None ):
+
+    filename = Path( filename )
+    if not filename.is_file():
+        print( f"File '{filename}' containing docs to be indexed does not exist." )
+        return
+
+    checkpoint = checkpoint or str( filename ) + '.checkpoint.json'
+    dead_letter = dead_letter or str( filename ) + '.dead_letter.json'
+
+    state = idc_read_checkpoint( checkpoint ) if resume else None
+    if state is not None and ( state[ 'filename' ] != str( filename ) or
+                               state[ 'index' ] != index_name or
+                               state[ 'size' ] != filename.stat().st_size ):
+        print( 'Checkpoint', checkpoint, 'is for a different run, starting again.' )
+        state = None
+
+    if state is None:
+        idc_create_index( index_name, confirm = False, settings = settings,
+                          mappings = mappings )
+        open( dead_letter, 'wb' ).close()
+        state = { 'filename': str( filename ), 'index': index_name,
+                  'size': filename.stat().st_size, 'offset': 0, 'batch': 0,
+                  'docs': 0, 'complete': False }
+        idc_write_checkpoint( checkpoint, state )
+    elif state[ 'complete' ]:
+        print( 'Checkpoint says', filename, 'is already fully indexed.' )
+    else:
+        print( f'Resuming at byte {state[ "offset" ]}, batch {state[ "batch" ]}, '
+               f'{state[ "docs" ]} documents already indexed.' )
+
+    start_offset = state[ 'offset' ]
+    start_docs = state[ 'docs' ]
+    rejected = 0
+
+    def send( chunk ):
+        return idc_send_with_backoff( chunk[ 3 ], index_name, max_attempts,
+                                      backoff )
+
+    start_time = time.time()
+
+    with open( dead_letter, 'ab' ) as dead:
+        for ( offset, end, count, chunk ), failures in idc_ordered_map(
+                send, idc_raw_chunks( filename, max_chunk_bytes, start_offset ),
+                thread_count ):
+
+            for failure in failures:
+                dead.write( failure[ 'action' ] + b'\n' +
+                            failure[ 'source' ] + b'\n' )
+            dead.flush()
+            rejected += len( failures )
+
+            state[ 'offset' ] = end
+            state[ 'batch' ] += 1
+            state[ 'docs' ] += count - len( failures )
+            idc_write_checkpoint( checkpoint, state )
+
+    elapsed_time = time.time() - start_time
+
+    summary = idc_throughput_summary( state[ 'docs' ] - start_docs,
+                                      state[ 'offset' ] - start_offset,
+                                      elapsed_time )
+
+    if rejected:
+        print( rejected, 'documents rejected, retrying them from', dead_letter )
+    summary[ 'failed' ] = idc_retry_dead_letter( dead_letter, index_name,
+                                                 max_attempts, backoff )
+
+    state[ 'complete' ] = True
+    idc_write_checkpoint( checkpoint, state )
+
+    return summary
+
+"""-----------------------------------------------------------------------------
+
+Index build profile.
+
+idc_build_index() never touches the index that is being searched. It builds a
+new versioned index, e.g. student_index_v20251217103000, and when that is
+complete it moves the alias student_index over to it in one atomic step. So
+eqs_eval() and make_results.py, which search 'student_index', keep working all
+through a rebuild and then see the new index.
+
+While loading, refresh is switched off and there are no replicas, which makes
+indexing much faster. Afterwards these are set back, and the index is force
+merged down to one segment since it will not change again.
+
+"""
+
+IDC_MAPPINGS = {
+    'properties': {
+        'title': {
+            'type': 'text',
+            'fields': { 'keyword': { 'type': 'keyword', 'ignore_above': 256 } }
+        },
+        'parsedParagraphs': { 'type': 'text' }
+    }
+}
+
+IDC_BUILD_SETTINGS = {
+    'index': {
+        'refresh_interval': '-1',    # No refreshes during the load
+        'number_of_replicas': 0
+    }
+}
+
+"""-----------------------------------------------------------------------------
+
+Builds a new version of the index and points alias at it.
+
+replicas: Number of replicas once the load is finished.
+keep_old: If False, indices which the alias pointed to before are deleted.
+resume: If True, carry on with the unfinished build in the checkpoint file.
+
+Other args as idc_index_resumable(). Returns the name of the new index.
+
+idc_build_index( 'result_v3_utf8_2500_docs.json', 'student_index' )
+
+"""
+
+def idc_build_index( filename, alias, replicas = 1, keep_old = True,
+                     resume = False, checkpoint = None, thread_count = 4,
+                     max_chunk_bytes = 10 * 1024 * 1024 ):
+
+    filename = Path( filename )
+    if not filename.is_file():
+        print( f"File '{filename}' containing docs to be indexed does not exist." )
+        return
+
+    checkpoint = checkpoint or str( filename ) + '.checkpoint.json'
+
+    index_name = None
+    if resume:
+        state = idc_read_checkpoint( checkpoint )
+        if state is not None and state[ 'index' ].startswith( alias + '_v' ):
+            index_name = state[ 'index' ]
+    if index_name is None:
+        index_name = alias + '_v' + time.strftime( '%Y%m%d%H%M%S' )
+
+    print( 'Building', index_name, 'for alias', alias )
+
+    summary = idc_index_resumable( filename, index_name,
+                                   checkpoint = checkpoint, resume = resume,
+                                   thread_count = thread_count,
+                                   max_chunk_bytes = max_chunk_bytes,
+                                   settings = IDC_BUILD_SETTINGS,
+                                   mappings = IDC_MAPPINGS )
+    if summary is None:
+        return
+
+    # Back to normal settings. None means the Elasticsearch default.
+    es.indices.put_settings( index = index_name, settings = {
+        'index': { 'refresh_interval': None, 'number_of_replicas': replicas } } )
+    es.indices.refresh( index = index_name )
+    print( 'Force merging', index_name )
+    es.options( request_timeout = 3600 ).indices.forcemerge(
+        index = index_name, max_num_segments = 1 )
+
+    old_indices = idc_swap_alias( alias, index_name )
+
+    if not keep_old:
+        for old in old_indices:
+            print( 'Deleting old index', old )
+            es.indices.delete( index = old )
+
+    return index_name
+
+"""-----------------------------------------------------------------------------
+
+Atomically points alias at index_name. Returns the indices the alias pointed
+to before. If there is an ordinary index called alias (e.g. one made by
+idc_index()), it is deleted in the same atomic step, since an alias cannot have
+the same name as an index.
+
+"""
+
+def idc_swap_alias( alias, index_name ):
+
+    actions = [ { 'add': { 'index': index_name, 'alias': alias } } ]
+    old_indices = []
+
+    if es.indices.exists_alias( name = alias ):
+        old_indices = [ i for i in es.indices.get_alias( name = alias )
+                        if i != index_name ]
+        for old in old_indices:
+            actions.append( { 'remove': { 'index': old, 'alias': alias } } )
+    elif es.indices.exists( index = alias ):
+        print( 'Index', alias, 'will be replaced by alias', alias )
+        actions.append( { 'remove_index': { 'index': alias } } )
+
+    es.indices.update_aliases( actions = actions )
+    print( 'Alias', alias, 'now points to', index_name )
+
+    return old_indices
+
+"""-----------------------------------------------------------------------------
+
+Delta (incremental) indexing.
+
+All the functions above start by deleting the index, so even if only a few
+documents have changed the whole collection is sent again. idc_index_delta()
+keeps a manifest, by default <index_name>.manifest.npz, with a content hash for
+every DocID from the last run (see doc_manifest.py). The new .json is read once
+and compared with it:
+
+added      DocID not in the manifest        -> sent with a bulk index
+changed    DocID there, hash different      -> sent with a bulk index
+deleted    DocID in manifest, not in .json  -> sent with a bulk delete
+unchanged  same hash                        -> not sent at all
+
+So if 1% of the documents changed, 1% is sent. Reading and hashing the file is
+done locally and is much faster than indexing.
+
+The manifest is only written when the run has finished. Documents which were
+rejected are left out of it (or keep their old hash), so the next run sends
+them again. If the run crashes, just run it again.
+
+If there is no manifest yet, every document counts as added. If the index
+already exists then, DocIDs which are no longer in the .json cannot be found,
+so either rebuild it or run once with adopt = True straight after a full
+index ( idc_index_raw() etc. ) of the same file.
+
+dry_run: Only print what would be sent. Nothing is sent or saved.
+adopt: Nothing is sent, but the manifest is written, i.e. the index is taken to
+       hold exactly this .json already.
+
+idc_index_delta( 'result_v3_utf8_2500_docs.json', 'student_index' )
+
+"""
+
+def idc_index_delta( filename, index_name, manifest = None, thread_count = 4,
+                     max_chunk_bytes = 10 * 1024 * 1024, dry_run = False,
+                     adopt = False ):
+
+    from doc_manifest import Delta, Manifest, manifest_path
+
+    filename = Path( filename )
+    if not filename.is_file():
+        print( f"File '{filename}' containing docs to be indexed does not exist." )
+        return
+
+    manifest = manifest or manifest_path( index_name )
+    old = Manifest.load( manifest )
+    send_docs = not dry_run and not adopt
+
+    if old is not None and old.meta.get( 'index' ) != index_name:
+        print( 'Manifest', manifest, 'is for index', old.meta.get( 'index' ),
+               'not', index_name, '- ignoring it.' )
+        old = None
+
+    if send_docs and not es.indices.exists( index = index_name ):
+        if old is not None:
+            print( 'Index', index_name, 'does not exist, ignoring manifest', manifest )
+            old = None
+        idc_create_index( index_name, confirm = False )
+    elif old is None and not adopt:
+        print( 'No manifest', manifest, '- sending every document. Documents '
+               'no longer in', filename, 'cannot be deleted this time.' )
+
+    delta = Delta( str( filename ), old or Manifest.empty(), max_chunk_bytes )
+    failed = []
+
+    def send( item ):
+        kind, docids, chunk = item
+        if kind == 'index':
+            return [ f[ 'docid' ] for f in idc_send_with_backoff( chunk, index_name ) ]
+        return idc_send_delete_chunk( chunk, index_name )
+
+    start_time = time.time()
+
+    if send_docs:
+        for item, chunk_failed in idc_ordered_map( send, delta.chunks(), thread_count ):
+            failed += chunk_failed
+    else:
+        for item in delta.chunks():
+            pass
+
+    elapsed_time = time.time() - start_time
+
+    counts = delta.counts
+    print( f'{counts[ "added" ]} added, {counts[ "changed" ]} changed, '
+           f'{counts[ "deleted" ]} deleted, {counts[ "unchanged" ]} unchanged '
+           f'({counts[ "bytes" ] / ( 1024 * 1024 ):.1f} MB read in '
+           f'{elapsed_time:.2f} seconds)' )
+    if dry_run:
+        print( 'Dry run, nothing sent.' )
+    if failed:
+        print( len( failed ), 'documents failed, they will be sent again next time:',
+               ', '.join( failed[ :10 ] ) )
+
+    if not dry_run:
+        if send_docs:
+            es.indices.refresh( index = index_name )
+        delta.manifest( failed ).save( manifest, index = index_name,
+                                       filename = str( filename ) )
+
+    summary = dict( counts )
+    summary[ 'failed' ] = len( failed )
+    summary[ 'seconds' ] = elapsed_time
+    return summary
+
+"""-----------------------------------------------------------------------------
+
+Sends a chunk of bulk delete lines. Returns the DocIDs which could not be
+deleted. A document which is not there any more (404) is fine.
+
+"""
+
+def idc_send_delete_chunk( chunk, index_name ):
+
+    response = es.bulk( index = index_name, operations = chunk )
+    if not response[ 'errors' ]:
+        return []
+
+    return [ item[ 'delete' ][ '_id' ] for item in response[ 'items' ]
+             if item[ 'delete' ].get( 'status', 500 ) >= 300 and
+             item[ 'delete' ].get( 'status' ) != 404 ]
+
+"""-----------------------------------------------------------------------------
+
 Search your index. You need to create it first (see above). You can also search
 any index your created previously with Kebana.
 
@@ -136,11 +886,17 @@ any index your created previously with Kebana.
 
 4. Hint: To see the structure, do the same search in Kibana.
 
+5. To search without Elasticsearch, build a local index with local_bm25.py and
+set the environment variable IR_LOCAL_INDEX to its directory. idc_search() will
+then use that instead.
+
 """
 
 def idc_search( query_string, index ):           # e.g. 'Makis Keravnos'
 
-    result = es.search(
+    from local_bm25 import search_backend
+
+    result = ( search_backend() or es ).search(
         index = index,
         query = {
             'multi_match' : {
@@ -153,8 +909,84 @@ def idc_search( query_string, index ):           # e.g. 'Makis Keravnos'
     return( result )
 
 
-print( 'To index documents, do a command like this:' )
-print( 'idc_index( \'result_v3_utf8_2500_docs.json\', \'student_index_2500_docs_2025\' )' )
+# Only when the program is loaded by itself, not when another module imports it
+if __name__ == '__main__' and len( sys.argv ) <= 1:
+    print( 'To index documents, do a command like this:' )
+    print( 'idc_index( \'result_v3_utf8_2500_docs.json\', \'student_index_2500_docs_2025\' )' )
+    print( 'For large collections use the parallel streaming version:' )
+    print( 'idc_index_streaming( \'result_v3_utf8_2500_docs.json\', \'student_index_2500_docs_2025\' )' )
+    print( 'Or, fastest, send the file as it is without parsing it:' )
+    print( 'idc_index_raw( \'result_v3_utf8_2500_docs.json\', \'student_index_2500_docs_2025\' )' )
+    print( 'To send only the documents which changed since the last run:' )
+    print( 'idc_index_delta( \'result_v3_utf8_2500_docs.json\', \'student_index_2500_docs_2025\' )' )
+
+"""-----------------------------------------------------------------------------
+
+Can also be run from the command line, which is the easiest way to restart a
+run that crashed part way through:
+
+python idc_index_doc_collection_v7.py result_v3_utf8_2500_docs.json student_index
+python idc_index_doc_collection_v7.py result_v3_utf8_2500_docs.json student_index --resume
+
+With --build, index_name is an alias and the index is rebuilt without downtime:
+
+python idc_index_doc_collection_v7.py result_v3_utf8_2500_docs.json student_index --build
+
+With --delta only new, changed and deleted documents are sent (idc_index_delta):
+
+python idc_index_doc_collection_v7.py result_v3_utf8_2500_docs.json student_index --delta
+python idc_index_doc_collection_v7.py result_v3_utf8_2500_docs.json student_index --delta --dry-run
+
+"""
+
+def idc_main( argv ):
+
+    ap = argparse.ArgumentParser( description = 'Index a .json collection.' )
+    ap.add_argument( 'filename' )
+    ap.add_argument( 'index_name' )
+    ap.add_argument( '--build', action = 'store_true',
+                     help = 'Build a new versioned index and move alias '
+                            'index_name to it (see idc_build_index)' )
+    ap.add_argument( '--resume', action = 'store_true',
+                     help = 'Carry on from the checkpoint of an earlier run' )
+    ap.add_argument( '--checkpoint', help = 'Checkpoint file' )
+    ap.add_argument( '--dead-letter', help = 'File for rejected documents' )
+    ap.add_argument( '--delta', action = 'store_true',
+                     help = 'Send only documents which changed since the last '
+                            'run (see idc_index_delta)' )
+    ap.add_argument( '--manifest', help = 'Manifest file for --delta' )
+    ap.add_argument( '--dry-run', action = 'store_true',
+                     help = 'With --delta: only count, send nothing' )
+    ap.add_argument( '--adopt', action = 'store_true',
+                     help = 'With --delta: send nothing, record the file as '
+                            'what the index holds now' )
+    ap.add_argument( '--threads', type = int, default = 4 )
+    ap.add_argument( '--max-chunk-mb', type = float, default = 10 )
+    args = ap.parse_args( argv )
+
+    if args.delta:
+        idc_index_delta( args.filename, args.index_name, manifest = args.manifest,
+                         thread_count = args.threads,
+                         max_chunk_bytes = int( args.max_chunk_mb * 1024 * 1024 ),
+                         dry_run = args.dry_run, adopt = args.adopt )
+        return
+
+    if args.build:
+        idc_build_index( args.filename, args.index_name, resume = args.resume,
+                         checkpoint = args.checkpoint,
+                         thread_count = args.threads,
+                         max_chunk_bytes = int( args.max_chunk_mb * 1024 * 1024 ) )
+        return
+
+    idc_index_resumable( args.filename, args.index_name,
+                         checkpoint = args.checkpoint,
+                         dead_letter = args.dead_letter,
+                         resume = args.resume,
+                         thread_count = args.threads,
+                         max_chunk_bytes = int( args.max_chunk_mb * 1024 * 1024 ) )
+
+if __name__ == '__main__' and len( sys.argv ) > 1:
+    idc_main( sys.argv[ 1: ] )
 
 # Index the documents in the .json file and create an Elasticsearch index
 # called 'student_index':
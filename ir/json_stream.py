@@ -0,0 +1,175 @@
+"""
+流式读取大 JSON 文件里的查询数组：一次只解析一个元素，不用把整个文件读进内存。
+
+queries.json、gold standard、results.json 都是这种样子：
+    {"student_surname": ..., ..., "queries": [ {...}, {...}, ... ]}
+数组里的每个元素一个一个地产生，数组以外的顶层字段（都很小）放在 header 里。
+文件是 [ {...}, {...} ] 这种顶层数组也可以。
+
+用法：
+    stream = JsonArrayStream("gold_standard_v5.json")
+    for q in stream:
+        print(q["number"])
+    print(stream.header)        # 读完以后，顶层的其他字段
+
+skip 是要丢掉的字段名（数组元素里任何一层的对象都丢），比如只要 DocID 时丢掉 matches[].sentences，
+解析的时候就不建这些对象（gold_stream.py 就是这样用的）。
+开头的 BOM 和 eqs_read 的 utf-8-sig 一样去掉。文件格式不对时抛 ValueError，带字符位置。
+"""
+
+import json
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+ARRAY_KEYS = ("queries", "results")
+CHUNK_SIZE = 1 << 20              # 每次从文件读 1M 个字符
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = ",]}"
+
+
+class JsonArrayStream:
+    """
+    迭代 keys 里第一个出现的顶层数组的元素。其他顶层字段解析到 self.header（可以传一个 dict 进来）；
+    数组后面的字段要等迭代完才有。self.key 是实际读到的数组名。
+    """
+
+    def __init__(self, path: str, keys: Sequence[str] = ARRAY_KEYS, chunk_size: int = CHUNK_SIZE,
+                 skip: Sequence[str] = (), header: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self.keys = tuple(keys)
+        self.chunk_size = chunk_size
+        self.header: Dict[str, Any] = {} if header is None else header
+        self.key: Optional[str] = None
+        self._decoder = json.JSONDecoder()
+        self._item_decoder = _dropping(skip)
+        self._file = None
+        self._buf = ""
+        self._pos = 0
+        self._base = 0                # _buf[0] 在整个文件里是第几个字符（报错用）
+        self._eof = False
+
+    # -- 缓冲区 --------------------------------------------------------------
+
+    def _fill(self) -> bool:
+        """
+        再读一块接到缓冲区后面（已经用掉的部分丢掉），文件读完返回 False。
+        一个值比一块还大时每次读的量和没解析完的部分一样多（翻倍），重新解析的总量还是线性的。
+        """
+        if self._eof:
+            return False
+        rest = len(self._buf) - self._pos
+        data = self._file.read(max(self.chunk_size, rest))
+        if not data:
+            self._eof = True
+            return False
+        self._base += self._pos
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def _error(self, what: str) -> ValueError:
+        near = self._buf[self._pos:self._pos + 30]
+        return ValueError(f"{self.path}: expected {what} at character {self._base + self._pos}, "
+                          f"found {near or 'end of file'!r}")
+
+    def _peek(self) -> str:
+        """跳过空白，返回下一个字符（不消耗）；文件结束返回 ""。"""
+        while True:
+            buf = self._buf
+            pos = self._pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, ch: str) -> None:
+        if self._peek() != ch:
+            raise self._error(repr(ch))
+        self._pos += 1
+
+    def _value(self, decoder: Optional[json.JSONDecoder] = None) -> Any:
+        """解析下一个完整的 JSON 值。不完整就再读一块重试。"""
+        decoder = decoder or self._decoder
+        self._peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise self._error("a JSON value") from None
+                continue
+            # 数字 / true / false / null 可能被缓冲区末尾切断（"12" 后面还有 "3"，"1." 后面还有 "5"），
+            # 后面跟着 , ] } 或者文件结束才算读完，否则再读一块重新解析
+            if not isinstance(value, (dict, list, str)) and not self._delimited(end) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _delimited(self, end: int) -> bool:
+        """缓冲区里 end 之后（跳过空白）是不是 , ] }。"""
+        buf = self._buf
+        while end < len(buf) and buf[end] in _WHITESPACE:
+            end += 1
+        return end < len(buf) and buf[end] in _DELIMITERS
+
+    def _more(self, close: str) -> bool:
+        """一个元素 / 字段后面：',' 还有下一个，close 结束了，别的字符报错。"""
+        sep = self._peek()
+        if sep == "," or sep == close:
+            self._pos += 1
+            return sep == ","
+        raise self._error(f"',' or {close!r}")
+
+    # -- 迭代 ---------------------------------------------------------------
+
+    def _items(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value(self._item_decoder)
+            if not self._more("]"):
+                return
+
+    def __iter__(self) -> Iterator[Any]:
+        with open(self.path, "r", encoding="utf-8-sig") as f:
+            self._file = f
+            self._buf, self._pos, self._base, self._eof = "", 0, 0, False
+            first = self._peek()
+            if first == "[":
+                self.key = None
+                yield from self._items()
+                return
+            self._expect("{")
+            if self._peek() == "}":
+                return
+            while True:
+                if self._peek() != '"':
+                    raise self._error("a field name")
+                key = self._value()
+                self._expect(":")
+                if self.key is None and key in self.keys and self._peek() == "[":
+                    self.key = key
+                    yield from self._items()
+                else:
+                    self.header[key] = self._value()
+                if not self._more("}"):
+                    break
+            self._file = None
+
+
+def _dropping(skip: Sequence[str]) -> json.JSONDecoder:
+    """丢掉 skip 里的字段的 decoder（任何一层的对象都丢）。"""
+    names = frozenset(skip)
+    if not names:
+        return json.JSONDecoder()
+    return json.JSONDecoder(object_pairs_hook=lambda pairs: {k: v for k, v in pairs if k not in names})
+
+
+def iter_queries(path: str, keys: Sequence[str] = ARRAY_KEYS) -> Iterator[Dict[str, Any]]:
+    """只要数组元素、不要 header 时的简写。"""
+    return iter(JsonArrayStream(path, keys))
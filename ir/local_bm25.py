@@ -0,0 +1,1197 @@
+"""
+本地 BM25 搜索（纯 Python，不需要 Elasticsearch），可以直接替换 es.search。
+
+从 idc_index 用的同一个 NDJSON 集合文件建一个位置倒排索引（一个目录），打开时用 mmap，
+所以启动只要几毫秒，不用等 JVM。
+
+支持的查询（gold standard 里用到的那部分）：
+    multi_match   type = best_fields / phrase / most_fields / cross_fields，fields 可以带 ^boost，
+                  fields 为空 = 所有字段；operator、minimum_should_match、tie_breaker
+    match, match_phrase, match_all
+    bool          must / should / filter / must_not，minimum_should_match
+
+打分和 ES 默认一样用 BM25（k1=1.2, b=0.75），分词近似 standard analyzer（按单词切、转小写），
+parsedParagraphs 这种数组字段，段与段之间位置隔 100（和 ES 的 position_increment_gap 一样），
+所以短语不会跨段匹配。
+
+查询一个文档一个文档地走（doc-at-a-time），不先把每个词的整个倒排表解码成 dict：
+    - 倒排表每 BLOCK 个文档一块，跳表记下每块最后一个 docno。advance(target) 在跳表上
+      倍增查找（galloping），中间的块不用解码。
+    - 短语和 AND 按 df 从小到大，用最稀少的词带着其他词 advance（leapfrog），
+      只有所有词都出现的文档才解码位置。所以 "sony corporation" 这种两个高频词的短语
+      也不用把两个倒排表都走完。
+    - top-k 用 MaxScore 剪枝：堆里有 k 个结果以后，分数上界加起来都到不了第 k 名的词
+      变成“非必要的”，不再产生候选文档，只在别的词找到的文档上 advance 过去算分；
+      所有上界加起来都不够的候选直接跳过。size=40 的查询不用给每个匹配的文档打分。
+
+索引格式（每个字段一组文件，数组都是定长数字，直接 mmap）：
+    meta.json            文档数、字段、平均长度、集合文件路径
+    docids.blob/.off     DocID 字符串
+    src.off              每个文档的 source 行在集合文件里的字节位置
+    f<i>.terms/.termoff  排好序的词（二分查找）
+    f<i>.df              每个词的文档频率
+    f<i>.maxtf           每个词 BM25 tf 部分的最大值（乘 idf 和 boost 就是这个词的分数上界）
+    f<i>.docs            倒排表，按块：每个文档 varint(docno 差值) varint(tf) varint(位置占的字节数)
+    f<i>.pos             位置：每个文档 tf 个 varint(位置差值)
+    f<i>.skipstart       每个词的第一块在跳表里的下标
+    f<i>.skiplast        跳表：每块最后一个 docno
+    f<i>.skipdoff/.skippoff  每块在 .docs / .pos 里的起始位置
+    f<i>.len             每个文档在这个字段的长度（词数）
+
+用法：
+    python local_bm25.py build result_v3_utf8_2500_docs.json local_index
+    python local_bm25.py search local_index "akio morita"
+    python local_bm25.py search local_index "sony corporation" --type phrase
+    python local_bm25.py bench local_index 2507244_queries.json
+
+在其他脚本里：设置环境变量 IR_LOCAL_INDEX=local_index，
+idc_search / eqs_eval / make_results.py 就会用本地索引代替 Elasticsearch。
+"""
+
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+FORMAT_VERSION = 2
+
+K1 = 1.2
+B = 0.75
+POSITION_GAP = 100        # 数组字段里相邻两个值之间的位置间隔
+BLOCK = 128               # 倒排表每块多少个文档
+
+NO_MORE_DOCS = sys.maxsize
+
+TOKEN_RE = re.compile(r"\w+(?:['’]\w+)*")
+
+DEFAULT_FIELDS = ["title", "parsedParagraphs"]
+
+
+def analyze(text: str) -> List[str]:
+    """近似 ES standard analyzer：切成单词，转小写。"""
+    return TOKEN_RE.findall(text.lower())
+
+
+# ---------------------------------------------------------------------------
+# varint 编码：小数字 1 个字节，每字节 7 位
+# ---------------------------------------------------------------------------
+
+def put_varint(buf: bytearray, n: int) -> None:
+    if n < 0x80:
+        buf.append(n)
+        return
+    while n >= 0x80:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    b = data[pos]
+    if b < 0x80:
+        return b, pos + 1
+    n = b & 0x7F
+    shift = 7
+    pos += 1
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def put_deltas(buf: bytearray, values: List[int]) -> None:
+    """递增的整数列表按差值写 varint。差值都小于 128（最常见）时直接一次写 bytes。"""
+    deltas = [b - a for a, b in zip([0] + values, values)]
+    if max(deltas) < 0x80:
+        buf += bytes(deltas)
+    else:
+        for d in deltas:
+            put_varint(buf, d)
+
+
+def get_deltas(data: bytes, start: int, end: int, count: int) -> List[int]:
+    """put_deltas 的反过程：data[start:end] 里的 count 个差值 -> 原来的列表。"""
+    if end - start == count:
+        # 每个 varint 都只有一个字节，累加在 C 里做
+        return list(accumulate(data[start:end]))
+    out = []
+    p = 0
+    for _ in range(count):
+        d, start = get_varint(data, start)
+        p += d
+        out.append(p)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 建索引
+# ---------------------------------------------------------------------------
+
+class _FieldBuilder:
+    """
+    读集合的时候直接写成最终格式：每个词一个 .docs 缓冲区和一个 .pos 缓冲区，
+    每满 BLOCK 个文档记一条跳表（块起始位置、块最后的 docno）。
+    分数上界要等全部读完、知道平均长度以后才能算，在 write() 里。
+    """
+
+    def __init__(self):
+        # term -> _TermBuffer
+        self.postings: Dict[str, _TermBuffer] = {}
+        self.lengths = array("I")
+        self.total_length = 0
+        self.docs_with_field = 0
+
+    def add(self, docno: int, values: Sequence[str]) -> None:
+        positions: Dict[str, List[int]] = defaultdict(list)
+        pos = 0
+        length = 0
+        for i, value in enumerate(values):
+            if i:
+                pos += POSITION_GAP
+            tokens = analyze(value)
+            for t in tokens:
+                positions[t].append(pos)
+                pos += 1
+            length += len(tokens)
+
+        # 文档没有这个字段时长度补 0，保证 lengths[docno] 对得上
+        while len(self.lengths) < docno:
+            self.lengths.append(0)
+        self.lengths.append(length)
+        self.total_length += length
+        self.docs_with_field += 1
+
+        postings = self.postings
+        for term, plist in positions.items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = _TermBuffer()
+            docs = entry.docs
+            pos = entry.pos
+            if entry.df % BLOCK == 0:
+                entry.new_block()
+            size = len(pos)
+            tf = len(plist)
+            if tf == 1 and plist[0] < 0x80:
+                pos.append(plist[0])
+            else:
+                put_deltas(pos, plist)
+            # docno 差值跨块连续（每块第一个相对上一块最后一个），解码时从跳表取起点
+            delta = docno - entry.last
+            nbytes = len(pos) - size
+            if delta < 0x80 and tf < 0x80 and nbytes < 0x80:
+                docs += bytes((delta, tf, nbytes))
+            else:
+                put_varint(docs, delta)
+                put_varint(docs, tf)
+                put_varint(docs, nbytes)
+            shortest = entry.min_length.get(tf)
+            if shortest is None or length < shortest:
+                entry.min_length[tf] = length
+            entry.last = docno
+            entry.df += 1
+
+    def avg_length(self) -> float:
+        # 和 ES 一样：平均长度只算有这个字段的文档
+        return self.total_length / max(self.docs_with_field, 1)
+
+    def write(self, prefix: str, n_docs: int) -> None:
+        while len(self.lengths) < n_docs:
+            self.lengths.append(0)
+
+        norm_a = K1 * (1 - B)
+        norm_b = K1 * B / (self.avg_length() or 1.0)
+
+        terms = sorted(self.postings, key=lambda t: t.encode("utf-8"))
+        term_off = array("Q", [0])
+        df = array("I")
+        maxtf = array("d")
+        skip_start = array("Q", [0])
+        skip_last = array("I")
+        skip_doff = array("Q")
+        skip_poff = array("Q")
+        docs_size = 0
+        pos_size = 0
+
+        with open(prefix + ".terms", "wb") as ft, open(prefix + ".docs", "wb") as fd, \
+                open(prefix + ".pos", "wb") as fp:
+            for term in terms:
+                entry = self.postings[term]
+                encoded = term.encode("utf-8")
+                ft.write(encoded)
+                term_off.append(term_off[-1] + len(encoded))
+                df.append(entry.df)
+
+                maxtf.append(max(tf / (tf + norm_a + norm_b * length) for tf, length in entry.min_length.items()))
+
+                skip_last.extend(entry.block_last)
+                skip_last.append(entry.last)
+                skip_doff.extend(docs_size + off for off in entry.block_doff)
+                skip_poff.extend(pos_size + off for off in entry.block_poff)
+                skip_start.append(len(skip_last))
+
+                fd.write(entry.docs)
+                fp.write(entry.pos)
+                docs_size += len(entry.docs)
+                pos_size += len(entry.pos)
+
+        _write_array(prefix + ".termoff", term_off)
+        _write_array(prefix + ".df", df)
+        _write_array(prefix + ".maxtf", maxtf)
+        _write_array(prefix + ".skipstart", skip_start)
+        _write_array(prefix + ".skiplast", skip_last)
+        _write_array(prefix + ".skipdoff", skip_doff)
+        _write_array(prefix + ".skippoff", skip_poff)
+        _write_array(prefix + ".len", self.lengths)
+
+
+class _TermBuffer:
+    """建索引时一个词的倒排表（已经是 .docs / .pos 的格式）和它的跳表。"""
+
+    __slots__ = ("docs", "pos", "last", "df", "block_doff", "block_poff", "block_last", "min_length")
+
+    def __init__(self):
+        self.docs = bytearray()
+        self.pos = bytearray()
+        self.last = 0
+        self.df = 0
+        self.block_doff = array("Q")
+        self.block_poff = array("Q")
+        self.block_last = array("I")      # 除了最后一块，每块最后的 docno（最后一块的是 last）
+        # tf -> 有这个 tf 的最短文档长度。同样的 tf，文档越短 BM25 分越高，
+        # 所以分数上界只要看这几对，不用等知道平均长度以后再扫一遍倒排表
+        self.min_length: Dict[int, int] = {}
+
+    def new_block(self) -> None:
+        if self.df:
+            self.block_last.append(self.last)
+        self.block_doff.append(len(self.docs))
+        self.block_poff.append(len(self.pos))
+
+
+def _write_array(path: str, a: array) -> None:
+    with open(path, "wb") as f:
+        a.tofile(f)
+
+
+def field_values(value: Any) -> Optional[List[str]]:
+    """字段值 -> 字符串列表；不是文本（数字、对象等）返回 None，不建索引。"""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return value
+    return None
+
+
+def build_index(collection: str, index_dir: str, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    读 idc_index 格式的集合文件（两行一个文档），建本地索引到 index_dir。
+    fields 为 None 时，所有文本字段都建索引。返回 meta。
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    start = time.time()
+
+    builders: Dict[str, _FieldBuilder] = {}
+    docid_blob = bytearray()
+    docid_off = array("Q", [0])
+    src_off = array("Q")
+
+    docno = 0
+    with open(collection, "rb") as f:
+        while True:
+            action_line = f.readline()
+            if not action_line:
+                break
+            if not action_line.strip():
+                continue                      # 空行跳过，不能把下一行 action 当成 source 读掉
+            offset = f.tell()
+            source_line = f.readline()
+            docid = json.loads(action_line)["index"]["_id"]
+            source = json.loads(source_line)
+
+            for name, value in source.items():
+                if fields is not None and name not in fields:
+                    continue
+                values = field_values(value)
+                if values is None:
+                    continue
+                if name not in builders:
+                    builders[name] = _FieldBuilder()
+                builders[name].add(docno, values)
+
+            docid_blob += str(docid).encode("utf-8")
+            docid_off.append(len(docid_blob))
+            src_off.append(offset)
+            docno += 1
+
+    with open(os.path.join(index_dir, "docids.blob"), "wb") as out:
+        out.write(docid_blob)
+    _write_array(os.path.join(index_dir, "docids.off"), docid_off)
+    _write_array(os.path.join(index_dir, "src.off"), src_off)
+
+    field_meta = []
+    for i, (name, builder) in enumerate(sorted(builders.items())):
+        builder.write(os.path.join(index_dir, f"f{i}"), docno)
+        field_meta.append({
+            "name": name,
+            "file": f"f{i}",
+            "terms": len(builder.postings),
+            "avg_length": builder.avg_length(),
+        })
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "collection": os.path.abspath(collection),
+        "docs": docno,
+        "fields": field_meta,
+        "build_id": f"{time.time():.6f}-{docno}",
+        "k1": K1,
+        "b": B,
+        "block": BLOCK,
+    }
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as out:
+        json.dump(meta, out, ensure_ascii=False, indent=2)
+
+    print(f"Indexed {docno} documents, {len(field_meta)} fields in {time.time() - start:.2f}s -> {index_dir}")
+    return meta
+
+
+# ---------------------------------------------------------------------------
+# 读索引
+# ---------------------------------------------------------------------------
+
+def _map_file(path: str) -> Any:
+    """mmap 一个文件；空文件不能 mmap，返回空 bytes。"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _map_array(path: str, typecode: str) -> Any:
+    data = _map_file(path)
+    return memoryview(data).cast(typecode) if len(data) else memoryview(array(typecode))
+
+
+class _Field:
+
+    def __init__(self, index_dir: str, meta: Dict[str, Any], k1: float, b: float):
+        prefix = os.path.join(index_dir, meta["file"])
+        self.name = meta["name"]
+        self.avg_length = meta["avg_length"] or 1.0
+        self.terms = _map_file(prefix + ".terms")
+        self.term_off = _map_array(prefix + ".termoff", "Q")
+        self.df = _map_array(prefix + ".df", "I")
+        self.maxtf = _map_array(prefix + ".maxtf", "d")
+        self.docs = _map_file(prefix + ".docs")
+        self.pos = _map_file(prefix + ".pos")
+        self.skip_start = _map_array(prefix + ".skipstart", "Q")
+        self.skip_last = _map_array(prefix + ".skiplast", "I")
+        self.skip_doff = _map_array(prefix + ".skipdoff", "Q")
+        self.skip_poff = _map_array(prefix + ".skippoff", "Q")
+        self.lengths = _map_array(prefix + ".len", "I")
+        self.n_terms = len(self.df)
+        # BM25 的 tf 部分：tf / (tf + norm_a + norm_b * 文档长度)
+        self.norm_a = k1 * (1 - b)
+        self.norm_b = k1 * b / self.avg_length
+
+    def term_id(self, term: str) -> int:
+        """二分查找词，找不到返回 -1。"""
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = self.terms[self.term_off[mid]:self.term_off[mid + 1]]
+            if t < key:
+                lo = mid + 1
+            elif t > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+
+class _Postings:
+    """
+    一个词的倒排表上的游标。doc 是当前 docno（开始是 -1，走完是 NO_MORE_DOCS）。
+    一次只解码当前这一块；位置只在调用 positions() 时才解码。
+    """
+
+    __slots__ = ("field", "df", "lo", "hi", "block", "docs", "tfs", "pos_off", "i", "doc")
+
+    def __init__(self, field: _Field, term_id: int):
+        self.field = field
+        self.df = field.df[term_id]
+        self.lo = field.skip_start[term_id]        # 这个词的块在跳表里是 [lo, hi)
+        self.hi = field.skip_start[term_id + 1]
+        self.block = -1
+        self.docs: List[int] = []
+        self.tfs: List[int] = []
+        self.pos_off: List[int] = []
+        self.i = 0
+        self.doc = -1
+
+    def _load(self, block: int) -> None:
+        f = self.field
+        data = f.docs
+        ptr = f.skip_doff[block]
+        docno = f.skip_last[block - 1] if block > self.lo else 0
+        pos = f.skip_poff[block]
+        docs = []
+        tfs = []
+        pos_off = [pos]
+        for _ in range(min(BLOCK, self.df - (block - self.lo) * BLOCK)):
+            delta, ptr = get_varint(data, ptr)
+            docno += delta
+            tf, ptr = get_varint(data, ptr)
+            nbytes, ptr = get_varint(data, ptr)
+            docs.append(docno)
+            tfs.append(tf)
+            pos += nbytes
+            pos_off.append(pos)
+        self.block = block
+        self.docs = docs
+        self.tfs = tfs
+        self.pos_off = pos_off
+
+    def next_doc(self) -> int:
+        if self.doc == NO_MORE_DOCS:
+            return NO_MORE_DOCS
+        if self.block >= 0 and self.i + 1 < len(self.docs):
+            self.i += 1
+        else:
+            nxt = self.block + 1 if self.block >= 0 else self.lo
+            if nxt >= self.hi:
+                self.doc = NO_MORE_DOCS
+                return NO_MORE_DOCS
+            self._load(nxt)
+            self.i = 0
+        self.doc = self.docs[self.i]
+        return self.doc
+
+    def advance(self, target: int) -> int:
+        """走到第一个 docno >= target 的文档。"""
+        if self.doc >= target:
+            return self.doc
+        skip_last = self.field.skip_last
+        if self.block < 0 or skip_last[self.block] < target:
+            lo = self.block + 1 if self.block >= 0 else self.lo
+            hi = self.hi
+            if lo >= hi:
+                self.doc = NO_MORE_DOCS
+                return NO_MORE_DOCS
+            if skip_last[lo] < target:
+                # galloping：步长 1, 2, 4... 找到包含 target 的范围，再在范围里二分
+                step = 1
+                while lo + step < hi and skip_last[lo + step] < target:
+                    lo += step
+                    step *= 2
+                left, right = lo + 1, min(lo + step, hi)
+                while left < right:
+                    mid = (left + right) // 2
+                    if skip_last[mid] < target:
+                        left = mid + 1
+                    else:
+                        right = mid
+                if left >= hi:
+                    self.doc = NO_MORE_DOCS
+                    return NO_MORE_DOCS
+                lo = left
+            self._load(lo)
+            self.i = bisect_left(self.docs, target)
+        else:
+            self.i = bisect_left(self.docs, target, self.i)
+        self.doc = self.docs[self.i]
+        return self.doc
+
+    def tf(self) -> int:
+        return self.tfs[self.i]
+
+    def positions(self) -> List[int]:
+        """当前文档里这个词的所有位置（每个文档位置的字节数记在 .docs 里，不用逐个跳过前面的）。"""
+        i = self.i
+        return get_deltas(self.field.pos, self.pos_off[i], self.pos_off[i + 1], self.tfs[i])
+
+
+# ---------------------------------------------------------------------------
+# 打分器：每种查询一个类，接口一样
+#   doc、next_doc()、advance(target)、score()、upper（分数上界）、set_threshold(theta)
+# ---------------------------------------------------------------------------
+
+class _Scorer:
+    doc = -1
+    upper = 0.0
+
+    def next_doc(self) -> int:
+        return self.advance(self.doc + 1)
+
+    def advance(self, target: int) -> int:
+        raise NotImplementedError
+
+    def score(self) -> float:
+        raise NotImplementedError
+
+    def set_threshold(self, theta: float) -> None:
+        """top-k 告诉打分器：分数 <= theta 的文档可以不产生了。默认不剪枝。"""
+
+
+class _TermScorer(_Postings, _Scorer):
+    """一个词。游标自己就是打分器，advance 少一层方法调用。"""
+
+    __slots__ = ("weight", "upper", "lengths", "norm_a", "norm_b")
+
+    def __init__(self, field: _Field, term_id: int, idf: float, boost: float):
+        _Postings.__init__(self, field, term_id)
+        self.weight = boost * idf
+        self.upper = self.weight * field.maxtf[term_id]
+        self.lengths = field.lengths
+        self.norm_a = field.norm_a
+        self.norm_b = field.norm_b
+
+    def score(self) -> float:
+        tf = self.tfs[self.i]
+        return self.weight * tf / (tf + self.norm_a + self.norm_b * self.lengths[self.doc])
+
+
+class _PhraseScorer(_Scorer):
+    """
+    短语：各个词按 df 从小到大 leapfrog 求交集，交集里的文档才解码位置、数短语出现次数。
+    分数和 Lucene 一样：idf 是各词 idf 之和，tf 是短语出现次数。
+    """
+
+    def __init__(self, field: _Field, term_ids: List[int], idf: float, boost: float):
+        self.field = field
+        self.weight = boost * idf
+        unique = sorted(set(term_ids), key=lambda t: field.df[t])
+        self.postings = [_Postings(field, t) for t in unique]
+        by_term = dict(zip(unique, self.postings))
+        self.phrase = [by_term[t] for t in term_ids]      # 短语里第 i 个词的游标
+        # 短语次数 <= 每个词的 tf，所以上界取各词上界里最小的
+        self.upper = self.weight * min(field.maxtf[t] for t in unique)
+        self.freq = 0
+
+    def advance(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        lead = self.postings[0]
+        doc = lead.advance(target)
+        while doc != NO_MORE_DOCS:
+            for p in self.postings[1:]:
+                d = p.advance(doc)
+                if d != doc:
+                    doc = lead.advance(d)
+                    break
+            else:
+                self.freq = self._phrase_freq()
+                if self.freq:
+                    break
+                doc = lead.advance(doc + 1)
+        self.doc = doc
+        return doc
+
+    def _phrase_freq(self) -> int:
+        """短语出现次数：第一个词在 p，第 i 个词在 p + i。用集合求交，循环在 C 里。"""
+        positions = {id(p): p.positions() for p in self.postings}
+        starts = set(positions[id(self.phrase[0])])
+        for i, p in enumerate(self.phrase[1:], 1):
+            starts.intersection_update([x - i for x in positions[id(p)]])
+            if not starts:
+                return 0
+        return len(starts)
+
+    def score(self) -> float:
+        f = self.field
+        return self.weight * self.freq / (self.freq + f.norm_a + f.norm_b * f.lengths[self.doc])
+
+
+class _ConjunctionScorer(_Scorer):
+    """AND：所有子查询都要匹配，分数相加；scoring 为 False 的子查询（filter）只过滤不加分。"""
+
+    def __init__(self, subs: List[_Scorer], scoring: Optional[List[bool]] = None):
+        self.subs = subs
+        self.scoring = scoring or [True] * len(subs)
+        self.upper = sum(s.upper for s, sc in zip(subs, self.scoring) if sc)
+
+    def advance(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        subs = self.subs
+        doc = subs[0].advance(target)
+        while doc != NO_MORE_DOCS:
+            for s in subs[1:]:
+                d = s.advance(doc)
+                if d != doc:
+                    doc = subs[0].advance(d)
+                    break
+            else:
+                break
+        self.doc = doc
+        return doc
+
+    def score(self) -> float:
+        return sum(s.score() for s, sc in zip(self.subs, self.scoring) if sc)
+
+
+class _DisjunctionScorer(_Scorer):
+    """
+    OR：至少 min_match 个子查询匹配。combine 是 "sum"（bool should、most_fields）
+    或 "max"（best_fields 的 dis_max：最高分 + tie_breaker × 其他的分）。
+
+    MaxScore：set_threshold(theta) 以后，按上界从小到大，前面加起来都 <= theta 的子查询是
+    “非必要的”：只匹配它们的文档不可能进 top-k，所以只让“必要的”子查询产生候选，
+    非必要的只在候选上 advance 过去。dis_max 的分数不超过各部分之和，同样适用。
+    """
+
+    def __init__(self, subs: List[_Scorer], combine: str = "sum", tie_breaker: float = 0.0,
+                 min_match: int = 1):
+        self.subs = subs
+        self.combine = combine
+        self.tie_breaker = tie_breaker
+        self.min_match = max(1, min_match)
+        self.upper = sum(s.upper for s in subs)
+        self.theta = float("-inf")
+        self.essential = list(subs)
+        self.optional: List[_Scorer] = []
+        self.optional_upper = 0.0
+
+    def set_threshold(self, theta: float) -> None:
+        if theta <= self.theta:
+            return
+        self.theta = theta
+        if self.combine == "max" and not self.tie_breaker:
+            # 纯 dis_max 的分数就是某一个子查询的分，子查询自己分数 <= theta 的文档也可以不要
+            for s in self.subs:
+                s.set_threshold(theta)
+        if self.min_match > 1:
+            return
+        by_upper = sorted(self.subs, key=lambda s: s.upper)
+        total = 0.0
+        n = 0
+        while n < len(by_upper) and total + by_upper[n].upper <= theta:
+            total += by_upper[n].upper
+            n += 1
+        self.optional = by_upper[:n][::-1]            # 上界大的先试
+        self.optional_upper = total
+        self.essential = by_upper[n:]
+
+    def advance(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        while True:
+            doc = NO_MORE_DOCS
+            for s in self.essential:
+                d = s.doc
+                if d < target:
+                    d = s.advance(target)
+                if d < doc:
+                    doc = d
+            if doc == NO_MORE_DOCS:
+                break
+            target = doc + 1
+            if self.optional and not self._competitive(doc):
+                continue
+            if self.min_match == 1 or sum(1 for s in self.subs if s.doc == doc) >= self.min_match:
+                break
+        self.doc = doc
+        return doc
+
+    def _competitive(self, doc: int) -> bool:
+        """
+        候选文档还可能超过 theta 吗？上界 = 在这个文档上的必要子查询 + 所有非必要的；
+        非必要的从上界大的开始 advance，没匹配就减掉它的上界，不够了马上放弃。
+        """
+        theta = self.theta
+        bound = self.optional_upper
+        for s in self.essential:
+            if s.doc == doc:
+                bound += s.upper
+        if bound <= theta:
+            return False
+        for s in self.optional:
+            if s.advance(doc) != doc:
+                bound -= s.upper
+                if bound <= theta:
+                    return False
+        return True
+
+    def score(self) -> float:
+        # 按子查询原来的顺序加，和不剪枝时的浮点结果一模一样
+        scores = [s.score() for s in self.subs if s.doc == self.doc]
+        if self.combine == "max":
+            best = max(scores)
+            return best + self.tie_breaker * (sum(scores) - best)
+        return sum(scores)
+
+
+class _BoolScorer(_Scorer):
+    """bool：required（must + filter）必须匹配，should 加分（可以要求至少匹配几个），excluded 排除。"""
+
+    def __init__(self, required: _Scorer, should: List[_Scorer], min_should: int,
+                 excluded: Optional[_Scorer], boost: float):
+        self.required = required
+        self.should = should
+        self.min_should = min_should
+        self.excluded = excluded
+        self.boost = boost
+        self.upper = boost * (required.upper + sum(s.upper for s in should))
+
+    def set_threshold(self, theta: float) -> None:
+        # 没有 should 时分数就是 required 的分数乘 boost
+        if not self.should and self.boost > 0:
+            self.required.set_threshold(theta / self.boost)
+
+    def advance(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        doc = self.required.advance(target)
+        while doc != NO_MORE_DOCS:
+            if self.excluded is None or self.excluded.advance(doc) != doc:
+                if sum(1 for s in self.should if s.advance(doc) == doc) >= self.min_should:
+                    break
+            doc = self.required.advance(doc + 1)
+        self.doc = doc
+        return doc
+
+    def score(self) -> float:
+        return self.boost * (self.required.score() + sum(s.score() for s in self.should if s.doc == self.doc))
+
+
+class _BoostScorer(_Scorer):
+    """给整个子查询乘 boost（只有 should 的 bool 用）。"""
+
+    def __init__(self, inner: _Scorer, boost: float):
+        self.inner = inner
+        self.boost = boost
+        self.upper = boost * inner.upper
+
+    def advance(self, target: int) -> int:
+        self.doc = self.inner.advance(target)
+        return self.doc
+
+    def score(self) -> float:
+        return self.boost * self.inner.score()
+
+    def set_threshold(self, theta: float) -> None:
+        if self.boost > 0:
+            self.inner.set_threshold(theta / self.boost)
+
+
+class _AllScorer(_Scorer):
+
+    def __init__(self, n_docs: int, boost: float):
+        self.n_docs = n_docs
+        self.boost = boost
+        self.upper = boost
+
+    def advance(self, target: int) -> int:
+        self.doc = max(self.doc, target) if target < self.n_docs else NO_MORE_DOCS
+        return self.doc
+
+    def score(self) -> float:
+        return self.boost
+
+
+# ---------------------------------------------------------------------------
+# 索引
+# ---------------------------------------------------------------------------
+
+class LocalIndex:
+    """
+    打开一个 build_index 建好的目录。search() 的参数和返回值和 es.search 一样
+    （只用到 hits 里的 _id、_score、_source），所以可以直接替换 Elasticsearch 客户端。
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION or self.meta.get("block") != BLOCK:
+            raise ValueError(f"{index_dir} was built by a different version of local_bm25, rebuild it.")
+        self.index_dir = index_dir
+        self.name = os.path.basename(os.path.normpath(index_dir))
+        self.n_docs = self.meta["docs"]
+        self.k1 = self.meta.get("k1", K1)
+        self.b = self.meta.get("b", B)
+        self.fields = {m["name"]: _Field(index_dir, m, self.k1, self.b) for m in self.meta["fields"]}
+        self.docid_blob = _map_file(os.path.join(index_dir, "docids.blob"))
+        self.docid_off = _map_array(os.path.join(index_dir, "docids.off"), "Q")
+        self.src_off = _map_array(os.path.join(index_dir, "src.off"), "Q")
+        self._collection = None
+
+    def generation(self) -> str:
+        """索引版本，每次重建都不同（给 result_cache 用）。"""
+        return f"local:{self.name}:{self.meta['build_id']}"
+
+    def docid(self, docno: int) -> str:
+        return self.docid_blob[self.docid_off[docno]:self.docid_off[docno + 1]].decode("utf-8")
+
+    def source(self, docno: int) -> Optional[Dict[str, Any]]:
+        """从原来的集合文件读回文档内容；集合文件不在了返回 None。"""
+        if self._collection is None:
+            path = self.meta.get("collection")
+            if not path or not os.path.exists(path):
+                return None
+            self._collection = open(path, "rb")
+        self._collection.seek(self.src_off[docno])
+        return json.loads(self._collection.readline())
+
+    def idf(self, field: _Field, term_id: int) -> float:
+        df = field.df[term_id]
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    # -- 查询 -> 打分器（什么都匹配不到时返回 None）-----------------------------
+
+    def _term(self, field: _Field, term: str, boost: float) -> Optional[_Scorer]:
+        term_id = field.term_id(term)
+        if term_id < 0:
+            return None
+        return _TermScorer(field, term_id, self.idf(field, term_id), boost)
+
+    def _phrase(self, field: _Field, terms: List[str], boost: float) -> Optional[_Scorer]:
+        if not terms:
+            return None
+        if len(terms) == 1:
+            return self._term(field, terms[0], boost)
+        term_ids = [field.term_id(t) for t in terms]
+        if min(term_ids) < 0:
+            return None
+        idf = sum(self.idf(field, t) for t in term_ids)
+        return _PhraseScorer(field, term_ids, idf, boost)
+
+    def _match(self, field: _Field, terms: List[str], boost: float, operator: str,
+               minimum_should_match: Any) -> Optional[_Scorer]:
+        scorers = [self._term(field, t, boost) for t in terms]
+        if operator == "and":
+            if not scorers or None in scorers:
+                return None
+            return _one_or(scorers, _ConjunctionScorer)
+        return _any_of(scorers, _min_should(minimum_should_match, len(terms)))
+
+    def _resolve_fields(self, fields: Sequence[str]) -> List[Tuple[_Field, float]]:
+        """["title^3", "parsedParagraphs"] -> [(字段, boost)]；空列表 = 所有字段（和 ES 的 * 一样）。"""
+        if not fields:
+            return [(f, 1.0) for f in self.fields.values()]
+        out = []
+        for spec in fields:
+            name, _, boost = spec.partition("^")
+            for fname, f in self.fields.items():
+                if fname == name or (name.endswith("*") and fname.startswith(name[:-1])):
+                    out.append((f, float(boost) if boost else 1.0))
+        return out
+
+    def _multi_match(self, spec: Dict[str, Any]) -> Optional[_Scorer]:
+        text = spec.get("query", "")
+        mtype = spec.get("type", "best_fields")
+        tie_breaker = float(spec.get("tie_breaker", 0.0))
+        operator = str(spec.get("operator", "or")).lower()
+        msm = spec.get("minimum_should_match")
+        boost = float(spec.get("boost", 1.0))
+        fields = self._resolve_fields(spec.get("fields", []))
+        terms = analyze(str(text))
+
+        if mtype == "cross_fields":
+            # 把所有字段当成一个大字段：每个词取各字段里最高的分，再对词求和
+            per_term = []
+            for term in terms:
+                alts = [s for s in (self._term(f, term, boost * fb) for f, fb in fields) if s is not None]
+                per_term.append(_one_or(alts, lambda subs: _DisjunctionScorer(subs, "max")) if alts else None)
+            if operator == "and":
+                if not per_term or None in per_term:
+                    return None
+                return _one_or(per_term, _ConjunctionScorer)
+            return _any_of(per_term, _min_should(msm, len(terms)))
+
+        per_field = []
+        for field, fboost in fields:
+            if mtype in ("phrase", "phrase_prefix"):
+                s = self._phrase(field, terms, boost * fboost)
+            else:
+                s = self._match(field, terms, boost * fboost, operator, msm)
+            if s is not None:
+                per_field.append(s)
+        if not per_field:
+            return None
+        if mtype == "most_fields":
+            return _one_or(per_field, _DisjunctionScorer)
+        return _one_or(per_field, lambda subs: _DisjunctionScorer(subs, "max", tie_breaker))
+
+    def _single_field(self, spec: Dict[str, Any], phrase: bool) -> Optional[_Scorer]:
+        (name, value), = spec.items()
+        opts = value if isinstance(value, dict) else {"query": value}
+        return self._multi_match(dict(opts, fields=[name], type="phrase" if phrase else "best_fields"))
+
+    def _bool(self, spec: Dict[str, Any]) -> Optional[_Scorer]:
+        def clauses(key: str) -> List[Optional[_Scorer]]:
+            c = spec.get(key, [])
+            return [self.scorer(q) for q in (c if isinstance(c, list) else [c])]
+
+        must = clauses("must")
+        filters = clauses("filter")
+        should = clauses("should")
+        must_not = [s for s in clauses("must_not") if s is not None]
+        boost = float(spec.get("boost", 1.0))
+
+        required = must + filters
+        if None in required:
+            return None                      # 有一个必须匹配的子查询什么都匹配不到
+        default_msm = 0 if required else 1
+        min_should = _min_should(spec.get("minimum_should_match", default_msm), len(should)) if should else 0
+        present = [s for s in should if s is not None]
+        if len(present) < min_should:
+            return None
+        excluded = _one_or(must_not, _DisjunctionScorer) if must_not else None
+
+        if required:
+            scoring = [True] * len(must) + [False] * len(filters)
+            lead = required[0] if len(required) == 1 and scoring[0] else _ConjunctionScorer(required, scoring)
+            return _BoolScorer(lead, present, min_should, excluded, boost)
+        if should:
+            disj = _any_of(present, min_should)
+            if disj is None:
+                return None
+            if excluded is None:
+                return _BoostScorer(disj, boost) if boost != 1.0 else disj
+            return _BoolScorer(disj, [], 0, excluded, boost)
+        # 空的 bool 匹配所有文档，没有打分的子查询，分数是 0
+        all_docs = _AllScorer(self.n_docs, 0.0)
+        return _BoolScorer(all_docs, [], 0, excluded, boost) if excluded is not None else all_docs
+
+    def scorer(self, query: Dict[str, Any]) -> Optional[_Scorer]:
+        """查询 -> 打分器；什么都匹配不到时返回 None。"""
+        if not query:
+            return None
+        (qtype, spec), = query.items()
+        if qtype == "multi_match":
+            return self._multi_match(spec)
+        if qtype == "match":
+            return self._single_field(spec, phrase=False)
+        if qtype == "match_phrase":
+            return self._single_field(spec, phrase=True)
+        if qtype == "bool":
+            return self._bool(spec)
+        if qtype == "match_all":
+            return _AllScorer(self.n_docs, float(spec.get("boost", 1.0)))
+        raise ValueError(f"local_bm25 does not support query type '{qtype}'")
+
+    # -- 执行 ---------------------------------------------------------------
+
+    def evaluate(self, query: Dict[str, Any]) -> Dict[int, float]:
+        """查询 -> {docno: 分数}，所有匹配的文档（不剪枝）。"""
+        s = self.scorer(query)
+        scores: Dict[int, float] = {}
+        if s is None:
+            return scores
+        doc = s.next_doc()
+        while doc != NO_MORE_DOCS:
+            scores[doc] = s.score()
+            doc = s.next_doc()
+        return scores
+
+    def top_k(self, query: Dict[str, Any], k: int, prune: bool = True) -> Tuple[List[Tuple[int, float]], int, bool]:
+        """
+        返回 ([(docno, 分数)] 按分数从高到低, 打过分的文档数, 是否剪过枝)。
+        分数相同时 docno 小的在前（和 ES 一样按索引顺序）。
+        """
+        s = self.scorer(query)
+        if s is None or k <= 0:
+            return [], 0, False
+        heap: List[Tuple[float, int]] = []       # (分数, -docno)：堆顶是目前最差的
+        scored = 0
+        pruned = False
+        doc = s.next_doc()
+        while doc != NO_MORE_DOCS:
+            score = s.score()
+            scored += 1
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc))
+                changed = len(heap) == k
+            else:
+                # 分数一样时后来的 docno 更大，排在后面，不用换
+                changed = score > heap[0][0]
+                if changed:
+                    heapq.heapreplace(heap, (score, -doc))
+            if changed and prune:
+                theta = _below(heap[0][0])
+                if s.upper <= theta:
+                    pruned = True
+                    break
+                s.set_threshold(theta)
+                pruned = True
+            doc = s.next_doc()
+        top = sorted(((-neg, score) for score, neg in heap), key=lambda item: (-item[1], item[0]))
+        return top, scored, pruned
+
+    def search(self, index: Optional[str] = None, query: Optional[Dict[str, Any]] = None,
+               size: Optional[int] = None, body: Optional[Dict[str, Any]] = None,
+               source: Any = None, **kwargs: Any) -> Dict[str, Any]:
+        """
+        和 es.search 一样的调用方式：search(index=..., query=..., size=...) 或 search(body={...})。
+        返回 ES 格式：{"took": ..., "hits": {"total": ..., "hits": [{"_id", "_score", "_source"}]}}
+        index 参数忽略（本地索引只有一个）。剪过枝时 total 只是下限，relation 是 "gte"（ES 也是这样）。
+        """
+        start = time.perf_counter()
+        body = dict(body or {})
+        if query is None:
+            query = body.get("query", {"match_all": {}})
+        if size is None:
+            size = body.get("size", 10)
+        if source is None:
+            source = body.get("_source", True)
+        offset = kwargs.get("from_", body.get("from", 0))
+
+        top, scored, pruned = self.top_k(query, offset + size)
+
+        hits = []
+        for docno, score in top[offset:]:
+            hit = {"_index": self.name, "_id": self.docid(docno), "_score": score}
+            if source is not False:
+                doc = self.source(docno)
+                if doc is not None:
+                    hit["_source"] = doc
+            hits.append(hit)
+
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "hits": {
+                "total": {"value": scored, "relation": "gte" if pruned else "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits,
+            },
+        }
+
+
+# ---------------------------------------------------------------------------
+# 小工具
+# ---------------------------------------------------------------------------
+
+def _below(theta: float) -> float:
+    """
+    剪枝用的阈值稍微放低一点：上界和真实分数的浮点运算顺序不同，可能差最后一位，
+    不能因为这个把本来能进 top-k 的文档剪掉。
+    """
+    return theta - 1e-9 * abs(theta)
+
+
+def _one_or(subs: List[_Scorer], make: Callable[[List[_Scorer]], _Scorer]) -> _Scorer:
+    return subs[0] if len(subs) == 1 else make(subs)
+
+
+def _any_of(subs: List[Optional[_Scorer]], required: int) -> Optional[_Scorer]:
+    """至少匹配 required 个（None 是什么都匹配不到的子查询），分数相加。"""
+    present = [s for s in subs if s is not None]
+    if not present or len(present) < required:
+        return None
+    return _one_or(present, lambda p: _DisjunctionScorer(p, "sum", min_match=required))
+
+
+def _min_should(value: Any, n_clauses: int) -> int:
+    """ES minimum_should_match 的常见写法：整数、负整数、"75%"、"-25%"。"""
+    if value is None:
+        return 1 if n_clauses else 0
+    s = str(value).strip()
+    if s.endswith("%"):
+        pct = float(s[:-1])
+        n = int(n_clauses * abs(pct) / 100)
+        n = n_clauses - n if pct < 0 else n
+    else:
+        n = int(s)
+        n = n_clauses + n if n < 0 else n
+    return max(0, min(n, n_clauses))
+
+
+_backend: Optional[LocalIndex] = None
+
+
+def search_backend() -> Optional[LocalIndex]:
+    """
+    环境变量 IR_LOCAL_INDEX 设置了就打开那个本地索引（只打开一次），否则返回 None（用 ES）。
+    """
+    global _backend
+    path = os.environ.get("IR_LOCAL_INDEX")
+    if not path:
+        return None
+    if _backend is None or os.path.abspath(_backend.index_dir) != os.path.abspath(path):
+        _backend = LocalIndex(path)
+    return _backend
+
+
+def bench(index: LocalIndex, queries: Sequence[Dict[str, Any]], size: int = 40, repeat: int = 3) -> None:
+    """同一批查询分别不剪枝 / 剪枝跑 top-size，打印平均耗时和打过分的文档数。"""
+    for prune in (False, True):
+        elapsed = 0.0
+        scored = 0
+        for query in queries:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                _, n, _ = index.top_k(query, size, prune=prune)
+                best = min(best, time.perf_counter() - start)
+            elapsed += best
+            scored += n
+        label = "MaxScore" if prune else "exhaustive"
+        print(f"{label:>10}: {len(queries)} queries, {1000 * elapsed / max(len(queries), 1):.2f} ms/query, "
+              f"{scored} docs scored")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local BM25 index over an idc_index collection.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    b = sub.add_parser("build", help="Build an index from a .json collection")
+    b.add_argument("collection")
+    b.add_argument("index_dir")
+    b.add_argument("--fields", nargs="*", help="Fields to index (default: all text fields)")
+
+    s = sub.add_parser("search", help="Search an index")
+    s.add_argument("index_dir")
+    s.add_argument("query", help="Query text, or a JSON query body")
+    s.add_argument("--size", type=int, default=10)
+    s.add_argument("--type", default="best_fields", help="multi_match type when query is text")
+
+    bm = sub.add_parser("bench", help="Time top-k with and without MaxScore pruning")
+    bm.add_argument("index_dir")
+    bm.add_argument("queries", help="queries.json / gold standard, or NDJSON query log")
+    bm.add_argument("--size", type=int, default=40)
+    bm.add_argument("--repeat", type=int, default=3)
+
+    args = ap.parse_args()
+
+    if args.command == "build":
+        build_index(args.collection, args.index_dir, args.fields)
+        return
+
+    index = LocalIndex(args.index_dir)
+
+    if args.command == "bench":
+        from async_runner import load_query_bodies
+        queries = [body.get("query", {"match_all": {}}) for body in load_query_bodies(args.queries)]
+        bench(index, queries, args.size, args.repeat)
+        return
+
+    if args.query.lstrip().startswith("{"):
+        body = json.loads(args.query)
+        query = body.get("query", body)
+    else:
+        query = {"multi_match": {"query": args.query, "fields": DEFAULT_FIELDS, "type": args.type}}
+    result = index.search(query=query, size=args.size, source=False)
+    total = result["hits"]["total"]
+    print(f"{total['value']}{'+' if total['relation'] == 'gte' else ''} hits in {result['took']} ms")
+    for hit in result["hits"]["hits"]:
+        print(f"{hit['_score']:8.3f}  {hit['_id']}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
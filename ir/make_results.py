@@ -1,13 +1,15 @@
 import json
 import os
 import sys
-from typing import Any, Dict, List
-import requests
+from typing import Any, Dict, List, Optional, Tuple
+
+import es_client
+from deep_search import ID_FILTER_PATH, MSEARCH_FILTER_PATH, lean_body
 
 # =======================
 # 你只需要改这两个（一般不用改）
 # =======================
-ES_URL = "http://localhost:9200"     # 如果你的 Elasticsearch 不在本机，就改这里
+ES_URL = es_client.ES_URL            # 默认 http://localhost:9200（或环境变量 IR_ES_URL），不在本机就改这里
 INDEX = "student_index"              # 你的索引名：student_index
 
 # 输入/输出文件（默认当前目录）
@@ -16,17 +18,64 @@ OUTPUT_RESULTS_FILE = "2507244_results.json"
 
 TOPK = 40  # 必须前40（你说的 G5 自动检查就是这个）
 
+# 批量执行：把所有查询打包成 _msearch 请求，每个请求最多 MSEARCH_BATCH 个查询
+# 想退回到一个一个查，就把 USE_MSEARCH 改成 False
+USE_MSEARCH = True
+MSEARCH_BATCH = 100
+
+# 异步并发模式（async_runner.py，需要 aiohttp）：同时保持 ASYNC_CONCURRENCY 个查询在路上，
+# 每秒最多 ASYNC_RATE 个，最后打印 p50/p95/p99 延迟。打开后优先于 _msearch
+USE_ASYNC = False
+ASYNC_CONCURRENCY = 16
+ASYNC_RATE = 50.0
+
+# 结果缓存（result_cache.py）：查询 + size + 索引版本都没变的，直接用上次的结果，不再查 ES。
+# 重建索引后版本会变，所有查询都会重新跑
+USE_CACHE = True
+CACHE_FILE = "results_cache.sqlite"
+CACHE_MAX_MB = 256
+
+# 查询剖析（query_profile.py）：设成文件名（比如 "profile.csv"）就在写完结果后，
+# 把每个 keyword/kibana 查询带 "profile": true 再跑一遍，每个查询的耗时拆分写进这个 CSV，
+# 并打印最花时间的子句。None = 不剖析
+PROFILE_FILE = None
+
+# 第二阶段重排（reranker.py）：设成模型文件（python reranker.py train ... 训练出来的，比如
+# "rerank_model.json"），写结果之前 keyword / kibana 的前 40 都用它重新排序。
+# 所有查询的候选文档用 _mget 一起取，分好的词存在 RERANK_CACHE 里，下次不用再取。None = 不重排
+RERANK_MODEL = None
+RERANK_CACHE = "features_cache.sqlite"
+
+def get_session() -> Any:
+    """
+    返回共享的 requests.Session（es_client.py：连接池 + keep-alive + gzip + 重试），不用每次都重新建连接。
+    """
+    return es_client.get_session()
+
+
+def local_backend():
+    """
+    设置了环境变量 IR_LOCAL_INDEX 就返回本地索引（local_bm25.py），不用 Elasticsearch；否则 None。
+    """
+    from local_bm25 import search_backend
+    return search_backend()
+
 
 def es_search(query_body: Dict[str, Any], size: int = TOPK) -> List[str]:
     """
     把 query_body 发给 Elasticsearch，返回 hits 里的 _id 列表（docid）。
+    只要 _id 和分数（deep_search.py 的精简模式），不让 ES 把整个 _source 发回来。
     """
     # 如果 query_body 里没写 size，我们强行补上 size=40
-    body = dict(query_body)
-    body["size"] = size
+    body = lean_body(query_body, size)
+
+    local = local_backend()
+    if local is not None:
+        hits = local.search(body=body, source=False)["hits"]["hits"]
+        return [h["_id"] for h in hits]
 
     url = f"{ES_URL}/{INDEX}/_search"
-    r = requests.get(url, json=body, timeout=30)
+    r = get_session().get(url, json=body, params={"filter_path": ID_FILTER_PATH}, timeout=30)
 
     # 如果 ES 返回 400/401/403/500，这里会直接告诉你错误内容
     if not r.ok:
@@ -37,6 +86,138 @@ def es_search(query_body: Dict[str, Any], size: int = TOPK) -> List[str]:
     return [h.get("_id") for h in hits if "_id" in h]
 
 
+def es_msearch(query_bodies: List[Dict[str, Any]], size: int = TOPK,
+               batch_size: int = MSEARCH_BATCH) -> List[List[str]]:
+    """
+    批量版的 es_search：把 query_bodies 分成每批 batch_size 个，用 _msearch 发出去。
+    返回的列表和 query_bodies 一一对应（顺序相同），每项是 _id 列表。
+    """
+    if local_backend() is not None:
+        return [es_search(body, size=size) for body in query_bodies]
+
+    url = f"{ES_URL}/{INDEX}/_msearch"
+    session = get_session()
+    docid_lists: List[List[str]] = []
+
+    for start in range(0, len(query_bodies), batch_size):
+        batch = query_bodies[start:start + batch_size]
+
+        # _msearch 格式：每个查询两行，header（空 = 用 URL 里的索引）+ body
+        lines = []
+        for query_body in batch:
+            lines.append("{}")
+            lines.append(json.dumps(lean_body(query_body, size), ensure_ascii=False))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        r = session.post(url, data=payload, timeout=60, params={"filter_path": MSEARCH_FILTER_PATH},
+                         headers={"Content-Type": "application/x-ndjson"})
+        if not r.ok:
+            raise RuntimeError(f"ES request failed: {r.status_code}\n{r.text}")
+
+        responses = r.json().get("responses", [])
+        if len(responses) != len(batch):
+            raise RuntimeError(f"ES _msearch returned {len(responses)} responses for {len(batch)} queries")
+
+        for i, resp in enumerate(responses):
+            # 单个查询出错时，_msearch 整体还是 200，错误在这一项里
+            if "error" in resp:
+                raise RuntimeError(f"ES query {start + i} failed: {resp.get('status')}\n"
+                                   f"{json.dumps(resp['error'], ensure_ascii=False)}")
+            hits = resp.get("hits", {}).get("hits", [])
+            docid_lists.append([h.get("_id") for h in hits if "_id" in h])
+
+    return docid_lists
+
+
+def run_all_queries(queries: List[Dict[str, Any]]) -> Dict[Any, Dict[str, List[str]]]:
+    """
+    一次性跑完所有查询（keyword_query + kibana_query），用 _msearch 批量发送，
+    或者 USE_ASYNC 时用 async_runner 并发发送。
+    返回 {number: {"keyword_query": [...], "kibana_query": [...]}}。
+    """
+    # 先收集所有要跑的查询，记住每个属于哪个 number、哪种类型
+    jobs = []
+    for q in queries:
+        number = q.get("number")
+        if not number:
+            continue
+        keyword_query = q.get("keyword_query", "")
+        kibana_query = q.get("kibana_query", None)
+        if keyword_query:
+            jobs.append((number, "keyword_query", build_keyword_query(keyword_query)))
+        if kibana_query:
+            jobs.append((number, "kibana_query", kibana_query))
+
+    # 先查缓存，只把缓存里没有的发给 ES
+    cache = None
+    docid_lists: List[Optional[List[str]]] = [None] * len(jobs)
+    if USE_CACHE:
+        from result_cache import ResultCache, cache_key, index_generation
+        cache = ResultCache(CACHE_FILE, CACHE_MAX_MB * 1024 * 1024)
+        local = local_backend()
+        generation = local.generation() if local is not None else index_generation(ES_URL, INDEX, get_session())
+        keys = [cache_key(body, TOPK, generation) for _, _, body in jobs]
+        docid_lists = cache.get_many(keys)
+
+    todo = [i for i, docids in enumerate(docid_lists) if docids is None]
+    for i, docids in zip(todo, execute_queries([jobs[i] for i in todo])):
+        docid_lists[i] = docids
+
+    if cache is not None:
+        cache.put_many((keys[i], docid_lists[i]) for i in todo)
+        print(cache.stats())
+        cache.close()
+
+    # 再按 number + 类型 对回去
+    runs: Dict[Any, Dict[str, List[str]]] = {}
+    for (number, qtype, _), docids in zip(jobs, docid_lists):
+        runs.setdefault(number, {})[qtype] = docids
+    return runs
+
+
+def execute_queries(jobs: List[Tuple[Any, str, Dict[str, Any]]]) -> List[List[str]]:
+    """
+    真正发给 ES：jobs 是 (number, 查询类型, body)，返回一一对应的 docid 列表。
+    """
+    if not jobs:
+        return []
+    bodies = [body for _, _, body in jobs]
+    if USE_ASYNC and local_backend() is None:
+        from async_runner import LatencyHistogram, run_queries
+        answers = run_queries(bodies, size=TOPK, concurrency=ASYNC_CONCURRENCY, rate=ASYNC_RATE,
+                              es_url=ES_URL, index=INDEX)
+        docid_lists = [docids for docids, _ in answers]
+
+        # 每种查询类型一个延迟直方图
+        histograms = {"keyword_query": LatencyHistogram(), "kibana_query": LatencyHistogram()}
+        for (_, qtype, _), (_, latency) in zip(jobs, answers):
+            histograms[qtype].record(latency)
+        for qtype, histogram in histograms.items():
+            if histogram.count:
+                print(histogram.format(qtype))
+        return docid_lists
+
+    return es_msearch(bodies, size=TOPK)
+
+
+def rerank_results(queries: List[Dict[str, Any]], rows: List[Dict[str, Any]]) -> None:
+    """
+    用 RERANK_MODEL 重排 rows（results.json 里的每一项）的 keyword_top40_docids 和 kibana_top40_docids。
+    """
+    from reranker import Reranker, RerankModel
+    by_number = {q.get("number"): q for q in queries}
+    reranker = Reranker(RerankModel.load(RERANK_MODEL), index=INDEX, cache_file=RERANK_CACHE)
+    try:
+        keys = ("keyword_top40_docids", "kibana_top40_docids")
+        items = [(row, key) for row in rows for key in keys if row[key]]
+        reranked = reranker.rerank_many([(by_number[row["number"]], row[key]) for row, key in items])
+        for (row, key), docids in zip(items, reranked):
+            row[key] = docids
+        print(reranker.stats())
+    finally:
+        reranker.close()
+
+
 def build_keyword_query(keyword_query: str) -> Dict[str, Any]:
     """
     把 keyword_query（字符串）包装成一个 ES 查询（multi_match best_fields）
@@ -76,6 +257,9 @@ def main():
     print(f"ES_URL={ES_URL}, INDEX={INDEX}, TOPK={TOPK}")
     print("-" * 60)
 
+    # 批量模式：先一次性把所有查询跑完，下面的循环直接取结果
+    runs = run_all_queries(queries) if USE_MSEARCH else None
+
     # 3) 每一题：跑 keyword_query + 跑 kibana_query
     for q in queries:
         number = q.get("number")
@@ -90,6 +274,8 @@ def main():
         # --- keyword_query 跑出来的前40 docid（G5 会查这个）
         if not keyword_query:
             keyword_docids = []
+        elif runs is not None:
+            keyword_docids = runs[number]["keyword_query"]
         else:
             keyword_body = build_keyword_query(keyword_query)
             keyword_docids = es_search(keyword_body, size=TOPK)
@@ -97,6 +283,8 @@ def main():
         # --- kibana_query 跑出来的前40 docid（G7 你要提升 precision 就看这个）
         if not kibana_query:
             kibana_docids = []
+        elif runs is not None:
+            kibana_docids = runs[number]["kibana_query"]
         else:
             # kibana_query 本身通常长这样： {"query": {...}} 或者 {"query":{"bool":...}}
             # 我们直接丢给 ES，让 ES 跑
@@ -113,6 +301,10 @@ def main():
 
         print(f"Q{number:02d} OK | keyword_top40={len(keyword_docids)} | kibana_top40={len(kibana_docids)}")
 
+    # 重排（可选）
+    if RERANK_MODEL:
+        rerank_results(queries, results["results"])
+
     # 4) 保存输出文件
     with open(OUTPUT_RESULTS_FILE, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
@@ -120,6 +312,13 @@ def main():
     print("-" * 60)
     print(f"[DONE] Wrote: {OUTPUT_RESULTS_FILE}")
 
+    # 5) 可选：剖析每个查询（P/R 按 queries 文件里的 matches 算）
+    if PROFILE_FILE:
+        from query_profile import format_report, profile_gold
+        rows, clauses = profile_gold(INPUT_QUERIES_FILE, index=INDEX, csv_file=PROFILE_FILE)
+        print(format_report(rows, clauses))
+        print(f"[DONE] Wrote: {PROFILE_FILE}")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
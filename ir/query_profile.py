@@ -0,0 +1,298 @@
+"""
+服务器端查询剖析（profile）：哪个 kibana_query 慢，慢在哪个子句。
+
+eqs_eval 和 make_results.py 只记录返回了哪些 DocID，不看 took、分片耗时和子句开销。
+这里把每个 keyword_query / kibana_query 加上 "profile": true 发给 Elasticsearch，
+把返回的 profile 树拆开：
+
+    每个查询：took、查询树总时间、rewrite、create_weight、build_scorer、next_doc（含 advance）、
+              score、match，和 P@5 / P@10 / R@10 放在同一行（CSV）
+    每个子句：Lucene 类型（TermQuery、PhraseQuery、BooleanQuery ...）、字段、描述、
+              总时间（含子句）、自身时间（不含子句），同样的阶段拆分
+    热点子句：按 (类型, 字段) 汇总自身时间，排出最花时间的；再列出最贵的单个子句
+
+这样挑查询写法的时候可以同时看精度和延迟，比如 bool.must 里的 phrase multi_match
+比 best_fields 准多少、慢多少。
+
+用法：
+    python query_profile.py gold_standard_v5.json
+    python query_profile.py 2507244_queries.json --repeat 3 --csv profile.csv --clauses-csv clauses.csv --top 15
+
+在 Python 里：
+    from query_profile import profile_gold
+    rows, clauses = profile_gold("gold_standard_v5.json", csv_file="profile.csv")
+
+需要 Elasticsearch（本地索引 IR_LOCAL_INDEX 没有 profile，只有 took）。
+"""
+
+import argparse
+import csv
+import re
+import statistics
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+INDEX = "student_index"
+TOPK = 40
+
+# profile 里 breakdown 的阶段（纳秒）。advance 并进 next_doc（都是在倒排表里找下一个文档）
+PHASES = ("create_weight", "build_scorer", "next_doc", "score", "match")
+_PHASE_KEYS = {"create_weight": ("create_weight",), "build_scorer": ("build_scorer",),
+               "next_doc": ("next_doc", "advance"), "score": ("score",), "match": ("match",)}
+
+_FIELD = re.compile(r"^[+\-#]?\(?\s*([\w.]+):")
+
+
+# ---------------------------------------------------------------------------
+# 解析 profile 树
+# ---------------------------------------------------------------------------
+
+def query_form(query: Any) -> str:
+    """查询 body 的结构，不含具体词：{"bool": {"must": [{"multi_match": {"type": "phrase"}}]}} -> bool(must:multi_match[phrase])"""
+    if not isinstance(query, dict) or not query:
+        return "?"
+    if "query" in query and len(query) == 1:
+        return query_form(query["query"])
+    parts = []
+    for kind, spec in query.items():
+        if kind == "bool" and isinstance(spec, dict):
+            inner = []
+            for occur in ("must", "should", "filter", "must_not"):
+                clauses = spec.get(occur)
+                if clauses is None:
+                    continue
+                for c in clauses if isinstance(clauses, list) else [clauses]:
+                    inner.append(f"{occur}:{query_form(c)}")
+            parts.append(f"bool({','.join(inner)})")
+        elif kind == "multi_match" and isinstance(spec, dict):
+            parts.append(f"multi_match[{spec.get('type', 'best_fields')}]")
+        else:
+            parts.append(kind)
+    return "+".join(parts)
+
+
+def clause_field(description: str) -> str:
+    m = _FIELD.match(description or "")
+    return m.group(1) if m else ""
+
+
+def _phases(breakdown: Dict[str, int]) -> Dict[str, int]:
+    return {phase: sum(int(breakdown.get(k, 0)) for k in keys) for phase, keys in _PHASE_KEYS.items()}
+
+
+def walk_tree(node: Dict[str, Any], path: str = "0", depth: int = 0) -> List[Dict[str, Any]]:
+    """
+    profile 的一个 query 节点（和它的子节点）-> 子句列表，时间都是纳秒。
+    ES 给的时间和 breakdown 都包含子节点（父节点的 next_doc 里会调子节点的 next_doc），
+    所以自身时间 = 自己的 - 子节点的：self_ns 和 <阶段>_ns 都是自身的，time_ns 是含子节点的。
+    """
+    children = node.get("children") or []
+    total = int(node.get("time_in_nanos", 0))
+    phases = _phases(node.get("breakdown") or {})
+    for child in children:
+        for p, v in _phases(child.get("breakdown") or {}).items():
+            phases[p] -= v
+    row = {
+        "path": path, "depth": depth, "type": node.get("type", ""),
+        "field": "" if children else clause_field(node.get("description", "")),   # 组合子句不止一个字段
+        "description": node.get("description", ""),
+        "time_ns": total,
+        "self_ns": max(0, total - sum(int(c.get("time_in_nanos", 0)) for c in children)),
+    }
+    row.update({f"{p}_ns": max(0, v) for p, v in phases.items()})
+    rows = [row]
+    for i, child in enumerate(children):
+        rows.extend(walk_tree(child, f"{path}.{i}", depth + 1))
+    return rows
+
+
+def parse_profile(response: Dict[str, Any]) -> Tuple[Dict[str, float], List[Dict[str, Any]]]:
+    """
+    一个 _search 响应（带 profile）-> (这个查询的总计（毫秒），所有分片的子句列表)。
+    多个分片的时间相加（单机上分片是并行的，所以总和可能比 took 大）。
+    """
+    totals = {"took_ms": float(response.get("took", 0)), "query_ms": 0.0, "rewrite_ms": 0.0,
+              "collector_ms": 0.0}
+    totals.update({f"{p}_ms": 0.0 for p in PHASES})
+    clauses: List[Dict[str, Any]] = []
+    for shard in (response.get("profile") or {}).get("shards", []):
+        for search in shard.get("searches", []):
+            totals["rewrite_ms"] += int(search.get("rewrite_time", 0)) / 1e6
+            for collector in search.get("collector", []):
+                totals["collector_ms"] += int(collector.get("time_in_nanos", 0)) / 1e6
+            for root in search.get("query", []):
+                totals["query_ms"] += int(root.get("time_in_nanos", 0)) / 1e6
+                for p, v in _phases(root.get("breakdown") or {}).items():
+                    totals[f"{p}_ms"] += v / 1e6
+                rows = walk_tree(root)
+                for row in rows:
+                    row["shard"] = shard.get("id", "")
+                clauses.extend(rows)
+    return totals, clauses
+
+
+# ---------------------------------------------------------------------------
+# 发查询
+# ---------------------------------------------------------------------------
+
+def profile_search(query: Dict[str, Any], index: str = INDEX, size: int = TOPK) -> Dict[str, Any]:
+    """发一个带 profile 的查询，返回响应 dict。设置了 IR_LOCAL_INDEX 时用本地索引（没有 profile 树）。"""
+    from local_bm25 import search_backend
+    local = search_backend()
+    if local is not None:
+        return local.search(index=index, query=query, size=size)
+    import es_client
+    return es_client.get_client().search(index=index, query=query, size=size, profile=True).body
+
+
+def profile_query(query: Dict[str, Any], index: str = INDEX, size: int = TOPK,
+                  repeat: int = 1) -> Tuple[Dict[str, Any], Dict[str, float], List[Dict[str, Any]]]:
+    """跑 repeat 次，取 took 是中位数的那次（第一次常常偏慢：缓存还是冷的）。返回 (响应, 总计, 子句)。"""
+    runs = []
+    for _ in range(max(1, repeat)):
+        response = profile_search(query, index, size)
+        totals, clauses = parse_profile(response)
+        runs.append((response, totals, clauses))
+    runs.sort(key=lambda r: r[1]["took_ms"])
+    return runs[len(runs) // 2]
+
+
+def profile_gold(gold_standard: str, index: str = INDEX, repeat: int = 1, csv_file: Optional[str] = None,
+                 clauses_csv: Optional[str] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    gold standard / queries 文件里每个查询的 keyword_query 和 kibana_query 都剖析一遍，
+    每个加上 P@5 / P@10 / R@10。返回 (每个查询一行, 所有子句)，可选写 CSV。
+    """
+    from eqs_evaluate_query_set_v5 import eqs_gold_docid_list, eqs_keyword_query, eqs_read
+    from eval_metrics import evaluate
+
+    rows: List[Dict[str, Any]] = []
+    all_clauses: List[Dict[str, Any]] = []
+    runs: Dict[Tuple[Any, str], List[str]] = {}
+    qrels: Dict[Tuple[Any, str], List[str]] = {}
+    for q in eqs_read(gold_standard)["queries"]:
+        jobs = []
+        if q.get("keyword_query"):
+            jobs.append(("keyword", eqs_keyword_query(q["keyword_query"])))
+        kibana = (q.get("kibana_query") or {}).get("query")
+        if kibana:                                  # 空的 {} 会让 ES 出错
+            jobs.append(("kibana", kibana))
+        for query_type, query in jobs:
+            response, totals, clauses = profile_query(query, index, TOPK, repeat)
+            key = (q["number"], query_type)
+            runs[key] = [h["_id"] for h in response["hits"]["hits"]]
+            qrels[key] = eqs_gold_docid_list(q.get("matches", []))
+            rows.append({"number": q["number"], "query_type": query_type, "form": query_form(query), **totals,
+                         "clauses": len(clauses)})
+            for c in clauses:
+                c.update(number=q["number"], query_type=query_type)
+            all_clauses.extend(clauses)
+
+    table = evaluate(runs, qrels, ks=(5, 10))
+    index_of = {qid: i for i, qid in enumerate(table["qid"])}
+    for row in rows:
+        i = index_of[(row["number"], row["query_type"])]
+        for m in ("P@5", "P@10", "R@10"):
+            row[m] = float(table[m][i])
+
+    if csv_file:
+        write_csv(csv_file, rows)
+    if clauses_csv:
+        write_csv(clauses_csv, all_clauses)
+    return rows, all_clauses
+
+
+# ---------------------------------------------------------------------------
+# 报告
+# ---------------------------------------------------------------------------
+
+def hot_clauses(clauses: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """按 (Lucene 类型, 字段) 汇总自身时间，从贵到便宜。"""
+    groups: Dict[Tuple[str, str], Dict[str, Any]] = defaultdict(lambda: {"count": 0, "self_ns": 0})
+    for c in clauses:
+        g = groups[(c["type"], c["field"])]
+        g["count"] += 1
+        g["self_ns"] += c["self_ns"]
+        for p in PHASES:
+            g[f"{p}_ns"] = g.get(f"{p}_ns", 0) + c[f"{p}_ns"]
+    total = sum(g["self_ns"] for g in groups.values()) or 1
+    out = [{"type": t, "field": f, **g, "share": g["self_ns"] / total} for (t, f), g in groups.items()]
+    out.sort(key=lambda g: -g["self_ns"])
+    return out
+
+
+def summarize_forms(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """每种查询写法（form）：多少个查询、平均 P@10、took 中位数、查询树时间中位数。"""
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    for r in rows:
+        groups[(r["query_type"], r["form"])].append(r)
+    out = []
+    for (query_type, form), rs in groups.items():
+        out.append({"query_type": query_type, "form": form, "queries": len(rs),
+                    "P@10": statistics.mean(r["P@10"] for r in rs),
+                    "took_ms": statistics.median(r["took_ms"] for r in rs),
+                    "query_ms": statistics.median(r["query_ms"] for r in rs)})
+    out.sort(key=lambda r: -r["query_ms"])
+    return out
+
+
+def format_report(rows: List[Dict[str, Any]], clauses: List[Dict[str, Any]], top: int = 10) -> str:
+    ms = lambda ns: f"{ns / 1e6:.3f}"
+    lines = ["Per query (ms):",
+             "number\ttype\ttook\tquery\trewrite\t" + "\t".join(PHASES) + "\tP@5\tP@10\tR@10\tform"]
+    for r in rows:
+        lines.append(f"{r['number']}\t{r['query_type']}\t{r['took_ms']:.0f}\t{r['query_ms']:.3f}\t"
+                     f"{r['rewrite_ms']:.3f}\t" + "\t".join(f"{r[p + '_ms']:.3f}" for p in PHASES)
+                     + f"\t{r['P@5']:.2f}\t{r['P@10']:.2f}\t{r['R@10']:.2f}\t{r['form']}")
+
+    lines += ["", "Query forms (median ms):", "type\tqueries\tP@10\ttook\tquery\tform"]
+    for f in summarize_forms(rows):
+        lines.append(f"{f['query_type']}\t{f['queries']}\t{f['P@10']:.3f}\t{f['took_ms']:.1f}\t"
+                     f"{f['query_ms']:.3f}\t{f['form']}")
+
+    lines += ["", "Hot clauses (self time, all queries):",
+              "share\tself ms\tcount\t" + "\t".join(PHASES) + "\tfield\ttype"]
+    for g in hot_clauses(clauses)[:top]:
+        lines.append(f"{g['share']:.1%}\t{ms(g['self_ns'])}\t{g['count']}\t"
+                     + "\t".join(ms(g[p + '_ns']) for p in PHASES) + f"\t{g['field']}\t{g['type']}")
+
+    lines += ["", f"Most expensive single clauses (top {top}):", "self ms\ttotal ms\tnumber\ttype\tdescription"]
+    for c in sorted(clauses, key=lambda c: -c["self_ns"])[:top]:
+        desc = c["description"] if len(c["description"]) <= 80 else c["description"][:77] + "..."
+        lines.append(f"{ms(c['self_ns'])}\t{ms(c['time_ns'])}\t{c['number']}\t{c['query_type']}\t{desc}")
+    return "\n".join(lines)
+
+
+def write_csv(path: str, rows: List[Dict[str, Any]]) -> None:
+    fields: List[str] = []
+    for r in rows:
+        fields.extend(k for k in r if k not in fields)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields or ["number"])
+        w.writeheader()
+        w.writerows(rows)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Profile every gold standard query and report clause costs.")
+    ap.add_argument("gold", nargs="?", default="gold_standard_v5.json")
+    ap.add_argument("--index", default=INDEX)
+    ap.add_argument("--repeat", type=int, default=1, help="Run each query N times and keep the median")
+    ap.add_argument("--top", type=int, default=10, help="Rows in the hot-clause lists")
+    ap.add_argument("--csv", default="profile.csv", help="Per-query timings and P/R ('' = do not write)")
+    ap.add_argument("--clauses-csv", default=None, help="Also write every clause to this CSV")
+    args = ap.parse_args(argv)
+
+    rows, clauses = profile_gold(args.gold, args.index, args.repeat, args.csv or None, args.clauses_csv)
+    if rows and not clauses:
+        print("[WARN] No profile trees in the responses (local index?), only took is reported.")
+    print(format_report(rows, clauses, args.top))
+    if args.csv:
+        print(f"[DONE] Wrote: {args.csv}")
+    if args.clauses_csv:
+        print(f"[DONE] Wrote: {args.clauses_csv}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,566 @@
+"""
+第二阶段重排：ES（BM25）返回的前 40 个结果，用几个词法特征和一个小的线性模型重新排序。
+
+make_results.py 和 eqs_eval 都直接把 ES 的 BM25 顺序当最终排名，P@5、P@10 量的就是这个顺序。
+这里在它后面加一步：
+
+    1. 取文档    所有查询的候选 DocID 去重以后一起取：内存里有的直接用，然后查特征缓存
+                （SQLite，跨查询、跨运行），剩下的才用 _mget 分批取（设置了 IR_LOCAL_INDEX
+                就从本地索引的集合文件读）。取回来的文档分词一次，存成
+                    title / body   每个词的 32 位哈希（uint32），段落之间用 0 隔开
+                    flags          body 每个词的类型：首字母大写 / 数字 / 年份 / 月份
+                这就是缓存的内容，和查询无关，同一个文档在别的查询、下次运行里都不用再取、再分词
+    2. 特征      一个查询的 40 个候选拼成一个大数组，一次用 NumPy 算完所有文档的（见 FEATURES）：
+                    first_stage     第一阶段名次的 1 / log2(名次 + 1)
+                    body_coverage   查询词在正文里出现了几成
+                    title_coverage  查询词在标题里出现了几成
+                    phrase_hits     查询里相邻两个词在正文里也相邻的次数（log1p）
+                    proximity       两个不同查询词之间最近的距离的倒数
+                    query_tf        查询词在正文里一共出现几次（log1p）
+                    answer_near     查询词附近 ANSWER_WINDOW 个词以内，答案类型的词有几个（log1p）：
+                                    answer_type 是 PERSON / LOCATION ... 看首字母大写的词，
+                                    DATE 看年份和月份，NUMBER 看数字；没有 answer_type 就看疑问词
+                    doc_length      正文长度（log1p）
+    3. 模型      线性模型，用 gold standard 的 matches 训练：同一个查询里每一对
+                （相关, 不相关）候选，相关的分数要更高（pairwise logistic loss，梯度下降，L2）。
+                特征先标准化，模型就是一个 JSON（特征名、均值、标准差、权重）。
+                分数相同的按原来的名次
+
+取文档以外，重排一个查询的 40 个候选只要几毫秒。
+
+用法：
+    python reranker.py train gold_standard_v5.json --out rerank_model.json      # 在 kibana_query 的结果上训练
+    python reranker.py eval gold_standard_v5.json --folds 5                     # 交叉验证：重排前后的 P/R、耗时
+    python reranker.py eval gold_standard_v5.json --run keyword --model rerank_model.json
+
+make_results.py 里把 RERANK_MODEL 设成模型文件，写结果之前 keyword / kibana 的前 40 都会重排。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from local_bm25 import TOKEN_RE, analyze
+from result_cache import ResultCache
+
+INDEX = "student_index"
+DEFAULT_FIELDS = ("title", "parsedParagraphs")
+DEFAULT_MODEL = "rerank_model.json"
+DEFAULT_CACHE_FILE = "features_cache.sqlite"
+DEFAULT_CACHE_MAX_MB = 512
+TOKENS_VERSION = 1           # 分词 / flags 的规则改了就加 1，旧的缓存自然用不上
+
+FEATURES = ("first_stage", "body_coverage", "title_coverage", "phrase_hits", "proximity", "query_tf",
+            "answer_near", "doc_length")
+
+ANSWER_WINDOW = 10           # answer_near：离查询词最多这么多个词
+
+# 训练
+L2 = 1e-3
+LEARNING_RATE = 0.5
+ITERATIONS = 300
+
+# flags
+CAPITALIZED = 1
+NUMBER = 2
+YEAR = 4
+MONTH = 8
+
+ANSWER_FLAGS = {
+    "PERSON": CAPITALIZED, "ORGANIZATION": CAPITALIZED, "ORG": CAPITALIZED, "LOCATION": CAPITALIZED,
+    "GPE": CAPITALIZED, "NORP": CAPITALIZED, "FAC": CAPITALIZED, "EVENT": CAPITALIZED,
+    "WORK_OF_ART": CAPITALIZED, "PRODUCT": CAPITALIZED,
+    "DATE": YEAR | MONTH, "TIME": NUMBER,
+    "NUMBER": NUMBER, "CARDINAL": NUMBER, "QUANTITY": NUMBER, "MONEY": NUMBER, "PERCENT": NUMBER,
+    "ORDINAL": NUMBER,
+}
+
+# 没有 answer_type 时按疑问词猜（先匹配长的）
+QUESTION_TYPES = (
+    ("how many", "NUMBER"), ("how much", "NUMBER"), ("how long", "NUMBER"), ("how old", "NUMBER"),
+    ("what year", "DATE"), ("which year", "DATE"), ("when", "DATE"),
+    ("who", "PERSON"), ("whom", "PERSON"), ("where", "LOCATION"),
+)
+
+MONTHS = frozenset("january february march april may june july august september october november december"
+                   .split())
+
+# 查询里的这些词不算查询词；句首的这些词首字母大写也不算专有名词
+STOPWORDS = frozenset("""a an and are as at be by did do does for from had has have he her his how in is it
+its of on or she that the their they this to was were what when where which who whom why will with""".split())
+
+
+# ---------------------------------------------------------------------------
+# 文档 -> 词哈希（缓存的就是这个）
+# ---------------------------------------------------------------------------
+
+def term_hash(term: str) -> int:
+    """小写的词 -> 32 位哈希，0 留给分隔符。"""
+    return zlib.crc32(term.encode("utf-8")) or 1
+
+
+def _flags(word: str) -> int:
+    if word.isdigit():
+        return NUMBER | (YEAR if len(word) == 4 and 1000 <= int(word) <= 2099 else 0)
+    lower = word.lower()
+    flags = MONTH if lower in MONTHS else 0
+    if word[0].isupper() and lower not in STOPWORDS:
+        flags |= CAPITALIZED
+    return flags
+
+
+class DocTokens:
+    """一个文档分好的词：title、body（uint32 哈希，开头和每段之间是 0）和 body 每个词的 flags。"""
+
+    __slots__ = ("title", "body", "flags")
+
+    def __init__(self, title: np.ndarray, body: np.ndarray, flags: np.ndarray):
+        self.title = title
+        self.body = body
+        self.flags = flags
+
+    @classmethod
+    def from_source(cls, source: Optional[Dict[str, Any]], fields: Sequence[str] = DEFAULT_FIELDS) -> "DocTokens":
+        """fields[0] 是标题，其他的都算正文。文档不存在（source 是 None）时只有分隔符。"""
+        from answer_matcher import source_parts
+        source = source or {}
+        title = [0]
+        for part in source_parts(source, fields[:1]):
+            title.extend(term_hash(w) for w in analyze(part))
+        body, flags = [0], [0]
+        for part in source_parts(source, fields[1:]):
+            words = TOKEN_RE.findall(part)
+            body.extend(term_hash(w.lower()) for w in words)
+            flags.extend(_flags(w) for w in words)
+            body.append(0)
+            flags.append(0)
+        return cls(np.array(title, np.uint32), np.array(body, np.uint32), np.array(flags, np.uint8))
+
+    def pack(self) -> bytes:
+        return struct.pack("<II", len(self.title), len(self.body)) + self.title.tobytes() + \
+            self.body.tobytes() + self.flags.tobytes()
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "DocTokens":
+        nt, nb = struct.unpack_from("<II", data)
+        title = np.frombuffer(data, np.uint32, nt, 8)
+        body = np.frombuffer(data, np.uint32, nb, 8 + 4 * nt)
+        flags = np.frombuffer(data, np.uint8, nb, 8 + 4 * (nt + nb))
+        return cls(title, body, flags)
+
+
+class FeatureCache(ResultCache):
+    """
+    SQLite 里的 DocTokens，key = (索引版本, 字段, 分词版本, DocID) 的哈希。和 result_cache 一样按 LRU 淘汰，
+    重建索引以后版本变了，旧的自然用不上。
+    """
+
+    TABLE = "doc_tokens"
+
+    def encode(self, value: DocTokens) -> bytes:
+        return value.pack()
+
+    def decode(self, value: bytes) -> DocTokens:
+        return DocTokens.unpack(value)
+
+
+def token_key(docid: str, generation: str, fields: Sequence[str]) -> str:
+    h = hashlib.sha256()
+    h.update(f"{generation}\0{','.join(fields)}\0{TOKENS_VERSION}\0{docid}".encode("utf-8"))
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# 查询
+# ---------------------------------------------------------------------------
+
+class QueryTerms:
+    """一个查询的词（排好序的哈希）、相邻词对（uint64）和要找的答案类型（flags）。"""
+
+    def __init__(self, query: Dict[str, Any]):
+        keyword = analyze(query.get("keyword_query") or "")
+        original = analyze(query.get("original_query") or "")
+        content = [t for t in keyword + original if t not in STOPWORDS]
+        self.terms = np.unique(np.array([term_hash(t) for t in content], np.uint32))
+
+        bigrams = set()
+        for words in (keyword, [t for t in original if t not in STOPWORDS], original):
+            hashes = [term_hash(t) for t in words]
+            bigrams.update(zip(hashes, hashes[1:]))
+        self.bigrams = np.array(sorted((a << 32) | b for a, b in bigrams), np.uint64)
+        self.answer_flags = ANSWER_FLAGS.get(answer_type(query), CAPITALIZED | NUMBER)
+
+
+def answer_type(query: Dict[str, Any]) -> str:
+    """gold standard 里的 answer_type，没有就按 original_query 的疑问词猜，猜不出来是 ""。"""
+    if query.get("answer_type"):
+        return str(query["answer_type"]).upper()
+    text = " " + " ".join(analyze(query.get("original_query") or "")) + " "
+    for words, kind in QUESTION_TYPES:
+        if f" {words} " in text:
+            return kind
+    return ""
+
+
+# ---------------------------------------------------------------------------
+# 特征（一个查询的所有候选一起算）
+# ---------------------------------------------------------------------------
+
+def _concat(arrays: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """拼起来，返回 (大数组, 每个位置属于第几个文档)。"""
+    lengths = np.fromiter((len(a) for a in arrays), np.int64, len(arrays))
+    return np.concatenate(arrays), np.repeat(np.arange(len(arrays)), lengths)
+
+
+def _term_index(tokens: np.ndarray, terms: np.ndarray) -> np.ndarray:
+    """每个位置是第几个查询词，不是查询词的是 -1。"""
+    if not len(terms):
+        return np.full(len(tokens), -1, np.int64)
+    pos = np.searchsorted(terms, tokens)
+    clipped = np.minimum(pos, len(terms) - 1)
+    return np.where(terms[clipped] == tokens, clipped, -1)
+
+
+def _coverage(index: np.ndarray, doc_of: np.ndarray, n_docs: int, n_terms: int) -> np.ndarray:
+    hit = index >= 0
+    distinct = np.unique(doc_of[hit] * n_terms + index[hit])
+    return np.bincount(distinct // n_terms, minlength=n_docs) / n_terms
+
+
+def feature_matrix(query: QueryTerms, docs: Sequence[DocTokens], ranks: Optional[np.ndarray] = None) -> np.ndarray:
+    """(候选数, len(FEATURES)) float32。ranks 是第一阶段的名次（从 0 开始），默认就是 docs 的顺序。"""
+    n = len(docs)
+    out = np.zeros((n, len(FEATURES)), np.float32)
+    if n == 0:
+        return out
+    ranks = np.arange(n) if ranks is None else np.asarray(ranks)
+    out[:, 0] = 1 / np.log2(ranks + 2)
+
+    body, doc_of = _concat([d.body for d in docs])
+    flags = np.concatenate([d.flags for d in docs])
+    lengths = np.bincount(doc_of, minlength=n)
+    out[:, 7] = np.log1p(lengths)
+    n_terms = len(query.terms)
+    if n_terms == 0:
+        return out
+
+    index = _term_index(body, query.terms)
+    hit = index >= 0
+    out[:, 1] = _coverage(index, doc_of, n, n_terms)
+    title, title_doc = _concat([d.title for d in docs])
+    out[:, 2] = _coverage(_term_index(title, query.terms), title_doc, n, n_terms)
+    out[:, 5] = np.log1p(np.bincount(doc_of[hit], minlength=n))
+
+    if len(query.bigrams):
+        pairs = (body[:-1].astype(np.uint64) << np.uint64(32)) | body[1:]
+        phrase = np.isin(pairs, query.bigrams)
+        out[:, 3] = np.log1p(np.bincount(doc_of[:-1][phrase], minlength=n))
+
+    # 相邻的两个查询词出现位置，词不同、在同一个文档里：最近的距离
+    p = np.flatnonzero(hit)
+    if len(p) > 1:
+        ok = (doc_of[p[1:]] == doc_of[p[:-1]]) & (index[p[1:]] != index[p[:-1]])
+        best = np.full(n, np.inf)
+        np.minimum.at(best, doc_of[p[:-1]][ok], (p[1:] - p[:-1])[ok])
+        out[:, 4] = 1 / best
+
+    # 答案类型的词（本身不是查询词），离最近的查询词不超过 ANSWER_WINDOW
+    if len(p):
+        e = np.flatnonzero(((flags & query.answer_flags) != 0) & ~hit)
+        j = np.searchsorted(p, e)
+        left = p[np.maximum(j - 1, 0)]
+        right = p[np.minimum(j, len(p) - 1)]
+        near = ((j > 0) & (e - left <= ANSWER_WINDOW) & (doc_of[left] == doc_of[e])) | \
+               ((j < len(p)) & (right - e <= ANSWER_WINDOW) & (doc_of[right] == doc_of[e]))
+        out[:, 6] = np.log1p(np.bincount(doc_of[e[near]], minlength=n))
+    return out
+
+
+# ---------------------------------------------------------------------------
+# 模型
+# ---------------------------------------------------------------------------
+
+class RerankModel:
+    """线性模型：score = ((x - mean) / std) · weights。"""
+
+    def __init__(self, weights: np.ndarray, mean: np.ndarray, std: np.ndarray,
+                 features: Sequence[str] = FEATURES, meta: Optional[Dict[str, Any]] = None):
+        self.weights = np.asarray(weights, np.float32)
+        self.mean = np.asarray(mean, np.float32)
+        self.std = np.asarray(std, np.float32)
+        self.features = list(features)
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, path: str) -> "RerankModel":
+        with open(path, "r", encoding="utf-8") as f:
+            d = json.load(f)
+        if d.get("features") != list(FEATURES):
+            raise ValueError(f"{path} was trained on different features, train it again.")
+        return cls(d["weights"], d["mean"], d["std"], d["features"], d.get("meta"))
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"features": self.features, "weights": self.weights.tolist(), "mean": self.mean.tolist(),
+                       "std": self.std.tolist(), "meta": self.meta}, f, indent=2)
+
+    def score(self, x: np.ndarray) -> np.ndarray:
+        return ((x - self.mean) / self.std) @ self.weights
+
+    def describe(self) -> str:
+        return "\n".join(f"  {name:<15} {w:+.3f}" for name, w in zip(self.features, self.weights))
+
+
+def train(samples: Sequence[Tuple[np.ndarray, np.ndarray]], l2: float = L2, learning_rate: float = LEARNING_RATE,
+          iterations: int = ITERATIONS) -> RerankModel:
+    """
+    samples: 每个查询一项 (特征矩阵, 每个候选是不是相关的 bool)。
+    每个查询里的每一对 (相关 i, 不相关 j) 要 score_i > score_j：最小化 log(1 + exp(-(z_i - z_j) · w))，
+    全量梯度下降。没有相关候选、或者全都相关的查询没有对，不起作用。
+    """
+    rows = [x for x, _ in samples if len(x)]
+    if not rows:
+        raise ValueError("No candidates to train on.")
+    all_x = np.concatenate(rows)
+    mean = all_x.mean(axis=0)
+    std = all_x.std(axis=0)
+    std[std == 0] = 1
+
+    diffs = []
+    for x, relevant in samples:
+        z = (x - mean) / std
+        pos, neg = z[relevant], z[~relevant]
+        if len(pos) and len(neg):
+            diffs.append((pos[:, None, :] - neg[None, :, :]).reshape(-1, z.shape[1]))
+    if not diffs:
+        raise ValueError("No query has both relevant and non-relevant candidates, nothing to learn from.")
+    d = np.concatenate(diffs).astype(np.float64)
+
+    w = np.zeros(d.shape[1])
+    for _ in range(iterations):
+        margin = d @ w
+        grad = -(d.T @ (1 / (1 + np.exp(margin)))) / len(d) + l2 * w
+        w -= learning_rate * grad
+    accuracy = float(((d @ w) > 0).mean())
+    return RerankModel(w, mean, std, meta={"pairs": len(d), "queries": len(diffs),
+                                           "pair_accuracy": round(accuracy, 4)})
+
+
+# ---------------------------------------------------------------------------
+# 重排
+# ---------------------------------------------------------------------------
+
+class Reranker:
+    """
+    reranker = Reranker(RerankModel.load("rerank_model.json"))
+    ranked = reranker.rerank_many([(query, docids), ...])     # query 是 gold / queries 文件里的一项
+    reranker.close()
+    """
+
+    def __init__(self, model: Optional[RerankModel] = None, index: str = INDEX,
+                 cache_file: Optional[str] = DEFAULT_CACHE_FILE, cache_max_mb: int = DEFAULT_CACHE_MAX_MB,
+                 fields: Sequence[str] = DEFAULT_FIELDS):
+        self.model = model
+        self.index = index
+        self.fields = tuple(fields)
+        self.docs: Dict[str, DocTokens] = {}
+        self.cache = FeatureCache(cache_file, cache_max_mb * 1024 * 1024) if cache_file else None
+        self._generation: Optional[str] = None
+        self._docnos: Optional[Dict[str, int]] = None
+        self.fetched = 0
+        self.fetch_seconds = 0.0
+
+    def generation(self) -> str:
+        if self._generation is None:
+            from local_bm25 import search_backend
+            local = search_backend()
+            if local is not None:
+                self._generation = local.generation()
+            else:
+                import es_client
+                from result_cache import index_generation
+                self._generation = index_generation(es_client.ES_URL, self.index, es_client.get_session())
+        return self._generation
+
+    def _sources(self, docids: Sequence[str]) -> Iterable[Tuple[str, Optional[Dict[str, Any]]]]:
+        """本地索引从集合文件读，否则 _mget（answer_matcher.iter_es，每批 MGET_BATCH 个）。"""
+        from local_bm25 import search_backend
+        local = search_backend()
+        if local is None:
+            from answer_matcher import iter_es
+            return iter_es(docids, self.index, self.fields)
+        if self._docnos is None:
+            self._docnos = {local.docid(i): i for i in range(local.n_docs)}
+        return ((d, local.source(self._docnos[d])) for d in docids if d in self._docnos)
+
+    def prefetch(self, docids: Iterable[str]) -> None:
+        """所有还没有的文档：先查缓存，剩下的一起取回来分词，再写进缓存。"""
+        missing = [d for d in dict.fromkeys(docids) if d not in self.docs]
+        if not missing:
+            return
+        start = time.perf_counter()
+        keys: List[str] = []
+        if self.cache is not None:
+            generation = self.generation()
+            keys = [token_key(d, generation, self.fields) for d in missing]
+            for d, tokens in zip(missing, self.cache.get_many(keys)):
+                if tokens is not None:
+                    self.docs[d] = tokens
+        todo = [d for d in missing if d not in self.docs]
+        if todo:
+            for docid, source in self._sources(todo):
+                self.docs[docid] = DocTokens.from_source(source, self.fields)
+            empty = DocTokens.from_source(None)
+            for d in todo:
+                self.docs.setdefault(d, empty)         # 取不到的文档（已经删了）：没有任何特征
+            if self.cache is not None:
+                key_of = dict(zip(missing, keys))
+                self.cache.put_many((key_of[d], self.docs[d]) for d in todo)
+            self.fetched += len(todo)
+        self.fetch_seconds += time.perf_counter() - start
+
+    def features(self, query: Dict[str, Any], docids: Sequence[str]) -> np.ndarray:
+        self.prefetch(docids)
+        return feature_matrix(QueryTerms(query), [self.docs[d] for d in docids])
+
+    def rerank(self, query: Dict[str, Any], docids: Sequence[str]) -> List[str]:
+        """按模型分数从高到低；分数相同按原来的名次。"""
+        if self.model is None:
+            raise ValueError("Reranker has no model (train one with: python reranker.py train ...)")
+        docids = list(docids)
+        if len(docids) < 2:
+            return docids
+        scores = self.model.score(self.features(query, docids))
+        order = np.lexsort((np.arange(len(docids)), -scores))
+        return [docids[i] for i in order]
+
+    def rerank_many(self, items: Sequence[Tuple[Dict[str, Any], Sequence[str]]]) -> List[List[str]]:
+        """所有查询的候选先一起取回来（一批 _mget），再一个一个重排。"""
+        self.prefetch(d for _, docids in items for d in docids)
+        return [self.rerank(query, docids) for query, docids in items]
+
+    def stats(self) -> str:
+        text = f"rerank: {self.fetched} documents fetched in {self.fetch_seconds:.2f}s"
+        return text + (f"; {self.cache.stats()}" if self.cache is not None else "")
+
+    def close(self) -> None:
+        if self.cache is not None:
+            self.cache.close()
+
+
+# ---------------------------------------------------------------------------
+# 训练 / 评估用的候选（第一阶段结果）
+# ---------------------------------------------------------------------------
+
+def first_stage(gold_standard: str, run: str = "kibana", index: str = INDEX, depth: int = 40
+                ) -> List[Tuple[Dict[str, Any], List[str], List[str]]]:
+    """gold standard 每个查询的 (查询, 第一阶段的前 depth 个 DocID, gold DocID)。run 是 keyword 或 kibana。"""
+    from eqs_evaluate_query_set_v5 import eqs_fetch, eqs_gold_docid_list, eqs_keyword_query
+    from gold_stream import DOCIDS_ONLY, iter_queries
+
+    out = []
+    for q in iter_queries(gold_standard, DOCIDS_ONLY):
+        if run == "keyword":
+            body = eqs_keyword_query(q["keyword_query"]) if q.get("keyword_query") else None
+        else:
+            body = (q.get("kibana_query") or {}).get("query") or None
+        hits = eqs_fetch(body, index, depth)["hits"]["hits"] if body else []
+        out.append((q, [h["_id"] for h in hits], eqs_gold_docid_list(q["matches"])))
+    return out
+
+
+def labelled(reranker: Reranker, candidates: Sequence[Tuple[Dict[str, Any], List[str], List[str]]]
+             ) -> List[Tuple[np.ndarray, np.ndarray]]:
+    reranker.prefetch(d for _, docids, _ in candidates for d in docids)
+    return [(reranker.features(q, docids), np.array([d in set(gold) for d in docids], bool))
+            for q, docids, gold in candidates]
+
+
+def cross_validate(reranker: Reranker, candidates: Sequence[Tuple[Dict[str, Any], List[str], List[str]]],
+                   folds: int = 5, run: str = "kibana", depth: int = 40) -> Dict[str, Any]:
+    """
+    按查询分成 folds 份，每份用其他几份训练的模型重排（不在测试的查询上训练），
+    用 eqs_metrics 比较重排前后，另外打印每个查询重排（特征 + 打分 + 排序）的耗时。
+    """
+    from async_runner import LatencyHistogram
+    from eqs_evaluate_query_set_v5 import eqs_depth_ks, eqs_metrics
+
+    folds = min(folds, len(candidates))
+    if folds < 2:
+        raise ValueError("Cross-validation needs at least 2 queries.")
+    samples = labelled(reranker, candidates)
+    runs: Dict[str, Dict[Any, List[str]]] = {run: {}, run + "_rerank": {}}
+    qrels: Dict[Any, List[str]] = {}
+    latency = LatencyHistogram()
+    for fold in range(folds):
+        reranker.model = train([s for i, s in enumerate(samples) if i % folds != fold])
+        for i in range(fold, len(candidates), folds):
+            q, docids, gold = candidates[i]
+            start = time.perf_counter()
+            runs[run + "_rerank"][q["number"]] = reranker.rerank(q, docids)
+            latency.record(time.perf_counter() - start)
+            runs[run][q["number"]] = docids
+            qrels[q["number"]] = gold
+    tables = eqs_metrics(runs, qrels, eqs_depth_ks(depth))
+    print("\n" + latency.format("rerank per query"))
+    return tables
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Second-stage reranker over the first-stage top hits.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    for name, text in (("train", "Train a model on a gold standard's matches"),
+                       ("eval", "Cross-validated P/R before and after reranking (or with --model)")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("gold", nargs="?", default="gold_standard_v5.json")
+        p.add_argument("--run", choices=("keyword", "kibana"), default="kibana", help="First-stage run to rerank")
+        p.add_argument("--index", default=INDEX)
+        p.add_argument("--depth", type=int, default=40)
+        p.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="Feature cache file ('' = no cache)")
+    sub.choices["train"].add_argument("--out", default=DEFAULT_MODEL)
+    sub.choices["eval"].add_argument("--folds", type=int, default=5)
+    sub.choices["eval"].add_argument("--model", help="Evaluate this model on every query instead of cross-validating")
+    args = ap.parse_args(argv)
+
+    reranker = Reranker(index=args.index, cache_file=args.cache or None)
+    try:
+        candidates = first_stage(args.gold, args.run, args.index, args.depth)
+        print(f"{len(candidates)} queries, {sum(len(c[1]) for c in candidates)} candidates from {args.run}_query")
+        if args.command == "train":
+            model = train(labelled(reranker, candidates))
+            model.meta.update(run=args.run, gold=os.path.basename(args.gold), depth=args.depth)
+            model.save(args.out)
+            print(f"{model.meta['pairs']} pairs from {model.meta['queries']} queries, "
+                  f"pair accuracy {model.meta['pair_accuracy']:.3f}")
+            print(model.describe())
+            print(f"[DONE] Wrote: {args.out}")
+        elif args.model:
+            from async_runner import LatencyHistogram
+            from eqs_evaluate_query_set_v5 import eqs_depth_ks, eqs_metrics
+            reranker.model = RerankModel.load(args.model)
+            reranker.prefetch(d for _, docids, _ in candidates for d in docids)
+            latency = LatencyHistogram()
+            reranked = {}
+            for q, docids, _ in candidates:
+                start = time.perf_counter()
+                reranked[q["number"]] = reranker.rerank(q, docids)
+                latency.record(time.perf_counter() - start)
+            eqs_metrics({args.run: {q["number"]: d for q, d, _ in candidates}, args.run + "_rerank": reranked},
+                        {q["number"]: g for q, _, g in candidates}, eqs_depth_ks(args.depth))
+            print("\n" + latency.format("rerank per query"))
+        else:
+            cross_validate(reranker, candidates, args.folds, args.run, args.depth)
+        print(reranker.stats())
+    finally:
+        reranker.close()
+
+
+if __name__ == "__main__":
+    main()
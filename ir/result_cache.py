@@ -0,0 +1,157 @@
+"""
+查询结果的磁盘缓存（SQLite），调参时重复跑 make_results.py / eqs_eval 不用每次都重新查 ES。
+
+key = sha256( 规范化的查询 JSON + size + 索引“版本” )
+索引版本 = 索引的 UUID + 文档数 + 删除数 + 写入次数 + 段数（见 index_generation）。
+重新建索引或者写入/删除文档以后版本就变了，旧的缓存自然用不上，只有真正可能变了的查询会重新跑。
+
+缓存有大小上限（max_bytes），超过了按 LRU（最久没用的先删）淘汰。
+
+用法：
+    cache = ResultCache("results_cache.sqlite")
+    generation = index_generation(ES_URL, INDEX)
+    key = cache_key(body, 40, generation)
+    docids = cache.get(key)
+    if docids is None:
+        docids = es_search(body)
+        cache.put(key, docids)
+    cache.close()
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_CACHE_FILE = "results_cache.sqlite"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def canonical_query(body: Any) -> str:
+    """key 顺序、空格不同但意思一样的查询，得到同一个字符串。"""
+    return json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def cache_key(body: Any, size: int, generation: str) -> str:
+    h = hashlib.sha256()
+    h.update(canonical_query(body).encode("utf-8"))
+    h.update(f"\0{size}\0{generation}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def generation_from_stats(stats: Dict[str, Any]) -> str:
+    """
+    从 _stats 的返回结果算出索引版本字符串。索引名是别名时，stats 里是它指向的真实索引，
+    所以别名切换到新索引以后版本也会变。
+    """
+    parts = []
+    for name, s in sorted(stats.get("indices", {}).items()):
+        p = s.get("primaries", {})
+        parts.append(":".join(str(x) for x in [
+            name,
+            s.get("uuid", ""),
+            p.get("docs", {}).get("count", ""),
+            p.get("docs", {}).get("deleted", ""),
+            p.get("indexing", {}).get("index_total", ""),
+            p.get("indexing", {}).get("delete_total", ""),
+            p.get("segments", {}).get("count", ""),
+        ]))
+    return "|".join(parts)
+
+
+def index_generation(es_url: str, index: str, session: Any = None) -> str:
+    """用 requests 查 _stats，返回索引版本字符串。"""
+    if session is None:
+        import requests
+        session = requests
+    r = session.get(f"{es_url}/{index}/_stats/docs,indexing,segments", timeout=30)
+    if not r.ok:
+        raise RuntimeError(f"ES request failed: {r.status_code}\n{r.text}")
+    return generation_from_stats(r.json())
+
+
+class ResultCache:
+    """
+    SQLite 文件里的一张表：key -> docid 列表（JSON），记录大小和最后使用时间，用来做 LRU。
+    子类改 TABLE 和 encode / decode 就能存别的东西（reranker.py 的 FeatureCache 存每个文档的词）。
+    """
+
+    TABLE = "results"
+
+    def __init__(self, path: str = DEFAULT_CACHE_FILE, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute(f"""CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                               key TEXT PRIMARY KEY,
+                               value TEXT NOT NULL,
+                               nbytes INTEGER NOT NULL,
+                               last_used REAL NOT NULL)""")
+        self.db.execute(f"CREATE INDEX IF NOT EXISTS {self.TABLE}_last_used ON {self.TABLE} (last_used)")
+        self.total_bytes = self.db.execute(f"SELECT COALESCE(SUM(nbytes), 0) FROM {self.TABLE}").fetchone()[0]
+
+    def encode(self, value: Any) -> Any:
+        return json.dumps(value, ensure_ascii=False)
+
+    def decode(self, value: Any) -> Any:
+        return json.loads(value)
+
+    def get(self, key: str) -> Optional[List[str]]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[List[str]]]:
+        """一次查多个 key，返回对应的 docid 列表（没有的是 None），命中的更新 last_used。"""
+        found: Dict[str, str] = {}
+        # SQLite 一条语句的参数个数有上限，分批查
+        for start in range(0, len(keys), 500):
+            batch = list(keys[start:start + 500])
+            marks = ",".join("?" * len(batch))
+            for key, value in self.db.execute(f"SELECT key, value FROM {self.TABLE} WHERE key IN ({marks})", batch):
+                found[key] = value
+
+        now = time.time()
+        self.db.executemany(f"UPDATE {self.TABLE} SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+        self.db.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return [self.decode(found[k]) if k in found else None for k in keys]
+
+    def put(self, key: str, docids: List[str]) -> None:
+        self.put_many([(key, docids)])
+
+    def put_many(self, items: Iterable[Tuple[str, List[str]]]) -> None:
+        now = time.time()
+        for key, docids in items:
+            value = self.encode(docids)
+            old = self.db.execute(f"SELECT nbytes FROM {self.TABLE} WHERE key = ?", (key,)).fetchone()
+            if old:
+                self.total_bytes -= old[0]
+            self.db.execute(f"INSERT OR REPLACE INTO {self.TABLE} VALUES (?, ?, ?, ?)",
+                            (key, value, len(value), now))
+            self.total_bytes += len(value)
+        self.evict()
+        self.db.commit()
+
+    def evict(self) -> None:
+        """超过 max_bytes 时，从最久没用的开始删，删到上限的 90% 为止。"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        victims = []
+        for key, nbytes in self.db.execute(f"SELECT key, nbytes FROM {self.TABLE} ORDER BY last_used"):
+            if self.total_bytes <= target:
+                break
+            victims.append((key,))
+            self.total_bytes -= nbytes
+        self.db.executemany(f"DELETE FROM {self.TABLE} WHERE key = ?", victims)
+
+    def stats(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses, {self.total_bytes / 1024:.0f} KB in {self.path}"
+
+    def close(self) -> None:
+        self.db.commit()
+        self.db.close()
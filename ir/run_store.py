@@ -0,0 +1,399 @@
+"""
+紧凑的 run store：检索结果（每个查询的 top-k DocID 列表）和查询信息分开存。
+
+以前 fix_results.py 把 queries 文件和 results 文件整个读进内存，把 kibana_query、matches
+等字段复制到每个结果里，再用 indent=2 整个写出去；每改一次就多一份几乎一样的大 JSON。
+现在的做法：
+
+    <store>/
+        store.json      版本、顶层字段（学生信息等）、run 名字、每个查询的位置
+        docids.txt      DocID 表：每行一个，第 i 行就是编号 i（每个 DocID 只存一次）
+        runs.bin        每个 (查询, run) 一段 int32 编号（mmap 读）
+        queries.jsonl   每个查询一行的信息（不含 DocID 列表），按 number 用字节位置读
+
+run 就是结果里名字以 "_docids" 结尾的列表字段（keyword_top40_docids、kibana_top40_docids）。
+queries.jsonl 里这些字段留一个 null 占位，导出时填回去，所以字段顺序和原来一样。
+
+合并（merge_results）是流式的：queries / gold 文件和 results 文件都一个元素一个元素地读
+（json_stream），内存里只有 number -> 字节位置 和 DocID 表，和查询数量、文件大小无关。
+旧格式的大 JSON（fix_results 以前的输出）只是一个视图，需要时用 export_legacy 导出，
+输出和以前 json.dump(indent=2) 的结果一样。
+
+用法：
+    python run_store.py merge 2507244_results.json 2507244_queries.json 2507244_runs
+    python run_store.py export 2507244_runs 2507244_results_fixed_v2.json
+    python run_store.py info 2507244_runs
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from json_stream import JsonArrayStream
+
+STORE_VERSION = 1
+RUN_SUFFIX = "_docids"
+
+# 结果里缺的时候从 queries 文件补上的字段（和以前的 fix_results.py 一样）
+FILL_QUERY_KEYS = ("kibana_query", "original_query", "keyword_query", "answer_type", "exact_answers", "matches")
+FILL_HEADER_KEYS = ("student_surname", "student_givenname", "student_reg_number", "topic_keywords")
+
+
+def is_run(key: str, value: Any) -> bool:
+    return key.endswith(RUN_SUFFIX) and isinstance(value, list)
+
+
+# =========================
+# 写
+# =========================
+class RunStoreWriter:
+    """
+    一个查询一个查询地往 store 里加。同一个 number 加两次，后一次的为准（位置不变）。
+    用 with 或者最后调 close() 写 store.json。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.header: Dict[str, Any] = {}
+        self.run_names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._entries: Dict[int, List[Any]] = {}      # number -> [meta_off, meta_len, {run: [off, n]}]
+        self._docids = open(os.path.join(path, "docids.txt"), "w", encoding="utf-8", newline="\n")
+        self._runs = open(os.path.join(path, "runs.bin"), "wb")
+        self._meta = open(os.path.join(path, "queries.jsonl"), "wb")
+        self._run_off = 0
+        self._meta_off = 0
+
+    def intern(self, docid: str) -> int:
+        i = self._ids.get(docid)
+        if i is None:
+            if "\n" in docid:
+                raise ValueError(f"DocID contains a newline: {docid!r}")
+            i = len(self._ids)
+            self._ids[docid] = i
+            self._docids.write(docid + "\n")
+        return i
+
+    def add(self, item: Dict[str, Any]) -> None:
+        """item 是旧格式的一个结果（带 number 和 *_docids 列表）。"""
+        number = item["number"]
+        meta: Dict[str, Any] = {}
+        runs: Dict[str, List[int]] = {}
+        for key, value in item.items():
+            if is_run(key, value):
+                ids = array("i", [self.intern(str(d)) for d in value])
+                ids.tofile(self._runs)
+                runs[key] = [self._run_off, len(ids)]
+                self._run_off += len(ids)
+                if key not in self.run_names:
+                    self.run_names.append(key)
+                meta[key] = None
+            else:
+                meta[key] = value
+        line = (json.dumps(meta, ensure_ascii=False) + "\n").encode("utf-8")
+        self._meta.write(line)
+        self._entries[number] = [self._meta_off, len(line), runs]
+        self._meta_off += len(line)
+
+    def close(self) -> None:
+        if self._docids.closed:
+            return
+        for f in (self._docids, self._runs, self._meta):
+            f.close()
+        info = {
+            "version": STORE_VERSION,
+            "header": self.header,
+            "runs": self.run_names,
+            "docs": len(self._ids),
+            "queries": [[number] + entry for number, entry in self._entries.items()],
+        }
+        with open(os.path.join(self.path, "store.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+
+    def __enter__(self) -> "RunStoreWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+# =========================
+# 读
+# =========================
+class RunStore:
+    """
+    打开一个 store。DocID 表第一次用到时才读；run 从 mmap 的 runs.bin 里切，
+    查询信息按字节位置从 queries.jsonl 里读，都不会把整个 store 读进内存。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "store.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("version") != STORE_VERSION:
+            raise ValueError(f"{path}: unsupported run store version {info.get('version')}")
+        self.header: Dict[str, Any] = info["header"]
+        self.run_names: List[str] = info["runs"]
+        self.num_docs: int = info["docs"]
+        self._entries: Dict[int, List[Any]] = {e[0]: e[1:] for e in info["queries"]}
+        self._docids: Optional[List[str]] = None
+        self._ids = _map_ints(os.path.join(path, "runs.bin"))
+        self._meta = open(os.path.join(path, "queries.jsonl"), "rb")
+
+    @property
+    def docids(self) -> List[str]:
+        if self._docids is None:
+            with open(os.path.join(self.path, "docids.txt"), "r", encoding="utf-8") as f:
+                self._docids = f.read().split("\n")[:-1]
+        return self._docids
+
+    def numbers(self) -> List[int]:
+        return list(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, number: int) -> bool:
+        return number in self._entries
+
+    def ids(self, number: int, run: str) -> Any:
+        """一个查询某个 run 的整数编号（memoryview，不复制）；没有这个 run 返回空。"""
+        span = self._entries[number][2].get(run)
+        if span is None:
+            return self._ids[0:0]
+        off, n = span
+        return self._ids[off:off + n]
+
+    def run(self, number: int, run: str) -> List[str]:
+        docids = self.docids
+        return [docids[i] for i in self.ids(number, run)]
+
+    def meta(self, number: int) -> Dict[str, Any]:
+        """查询信息（run 字段是 None 占位）。"""
+        off, length, _ = self._entries[number]
+        self._meta.seek(off)
+        return json.loads(self._meta.read(length).decode("utf-8"))
+
+    def item(self, number: int) -> Dict[str, Any]:
+        """旧格式的一个结果：查询信息 + 填回去的 DocID 列表。"""
+        item = self.meta(number)
+        for run in self._entries[number][2]:
+            item[run] = self.run(number, run)
+        return item
+
+    def runs(self, run: str) -> Dict[Any, List[str]]:
+        """{number: [docid, ...]}，可以直接交给 eval_metrics.evaluate。"""
+        return {number: self.run(number, run) for number in self._entries}
+
+    def qrels(self) -> Dict[Any, List[str]]:
+        """{number: gold DocID 列表}（从合并进来的 matches 字段）。"""
+        out = {}
+        for number in self._entries:
+            matches = self.meta(number).get("matches")
+            if matches:
+                out[number] = [m["docid"] for m in matches]
+        return out
+
+    def iter_legacy(self) -> Iterator[Dict[str, Any]]:
+        for number in self._entries:
+            yield self.item(number)
+
+    def export_legacy(self, path: str, key: str = "queries") -> None:
+        """
+        按旧格式写出：{顶层字段..., "queries": [...]}，和 json.dump(indent=2, ensure_ascii=False)
+        的输出一样，但一次只在内存里放一个查询。
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("{")
+            for name, value in self.header.items():
+                f.write(f"\n  {_dumps(name, 2)}: {_dumps(value, 2)},")
+            f.write(f"\n  {_dumps(key, 2)}: [")
+            first = True
+            for item in self.iter_legacy():
+                f.write(("\n    " if first else ",\n    ") + _dumps(item, 4))
+                first = False
+            f.write("]\n}" if first else "\n  ]\n}")
+        os.replace(tmp, path)
+
+    def close(self) -> None:
+        self._meta.close()
+
+    def __enter__(self) -> "RunStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def _map_ints(path: str) -> Any:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(array("i"))
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("i")
+
+
+def _dumps(value: Any, indent: int) -> str:
+    """json.dumps(indent=2)，后面的行再缩进 indent 个空格（字符串里的换行是转义过的，不会误伤）。"""
+    return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n" + " " * indent)
+
+
+# =========================
+# 导入 / 合并
+# =========================
+def import_results(results_path: str, store_path: str) -> RunStore:
+    """把一个旧格式的 results 文件流式地存成 run store（不关联查询信息）。"""
+    stream = JsonArrayStream(results_path)
+    with RunStoreWriter(store_path) as writer:
+        for item in stream:
+            writer.add(item)
+        writer.header = stream.header
+    return RunStore(store_path)
+
+
+def merge_results(results_path: str, queries_path: str, store_path: str) -> RunStore:
+    """
+    results 文件 + queries（或 gold standard）文件 -> run store。相当于以前的 fix_results.py：
+    结果里缺的 FILL_QUERY_KEYS 从同一个 number 的查询里补，缺的学生信息从 queries 文件顶层补。
+
+    两个文件都流式读：queries 文件先逐条写到一个临时 jsonl，只记 number -> 字节位置，
+    再读 results 文件时按位置取回来关联。
+    """
+    os.makedirs(store_path, exist_ok=True)
+    tmp_path = os.path.join(store_path, "_join.tmp.jsonl")
+    offsets: Dict[Any, List[int]] = {}
+    qstream = JsonArrayStream(queries_path)
+    with open(tmp_path, "wb") as tmp:
+        off = 0
+        for q in qstream:
+            line = (json.dumps({k: q[k] for k in FILL_QUERY_KEYS if k in q}, ensure_ascii=False) + "\n").encode("utf-8")
+            tmp.write(line)
+            offsets[q["number"]] = [off, len(line)]
+            off += len(line)
+
+    try:
+        rstream = JsonArrayStream(results_path)
+        with open(tmp_path, "rb") as tmp, RunStoreWriter(store_path) as writer:
+            for item in rstream:
+                n = item["number"]
+                if n not in offsets:
+                    raise KeyError(f"results 里有 number={n}，但 queries 文件里找不到对应条目。")
+                q_off, q_len = offsets[n]
+                tmp.seek(q_off)
+                q = json.loads(tmp.read(q_len).decode("utf-8"))
+                for key in FILL_QUERY_KEYS:
+                    if key not in item and key in q:
+                        item[key] = q[key]
+                writer.add(item)
+            if rstream.key is None:
+                raise KeyError("results 文件顶层既没有 'queries' 也没有 'results'，先打开检查一下结构。")
+
+            header = dict(rstream.header)
+            for key in FILL_HEADER_KEYS:
+                if key not in header and key in qstream.header:
+                    header[key] = qstream.header[key]
+            writer.header = header
+    finally:
+        os.remove(tmp_path)
+    return RunStore(store_path)
+
+
+# =========================
+# 读 run（给 significance.py、answer_matcher.py 用）
+# =========================
+def run_label(field: str) -> str:
+    """keyword_top40_docids -> keyword"""
+    name = field[:-len(RUN_SUFFIX)] if field.endswith(RUN_SUFFIX) else field
+    for suffix in ("_top40", "_top10"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def load_runs(spec: str) -> Tuple[Dict[str, Dict[Any, List[str]]], Dict[Any, List[str]]]:
+    """
+    "文件" 或 "文件:字段" -> ({run 名: {number: [docid]}}, 这个输入里的 gold)。
+    文件可以是旧格式 results JSON，也可以是 run_store 目录。
+    """
+    path, field = spec, None
+    if not os.path.exists(spec) and ":" in spec:
+        path, field = spec.rsplit(":", 1)
+
+    runs: Dict[str, Dict[Any, List[str]]] = {}
+    qrels: Dict[Any, List[str]] = {}
+    if os.path.isdir(path):
+        with RunStore(path) as store:
+            for name in store.run_names:
+                if field is None or field in (name, run_label(name)):
+                    runs[run_label(name)] = store.runs(name)
+            qrels = store.qrels()
+    else:
+        for q in JsonArrayStream(path):
+            number = q.get("number")
+            for key, value in q.items():
+                if is_run(key, value) and (field is None or field in (key, run_label(key))):
+                    runs.setdefault(run_label(key), {})[number] = [str(d) for d in value]
+            if q.get("matches"):
+                qrels[number] = [m["docid"] for m in q["matches"]]
+    if not runs:
+        raise KeyError(f"{spec}: no *{RUN_SUFFIX} runs found")
+    return runs, qrels
+
+
+def load_gold(path: str) -> Dict[Any, List[str]]:
+    """gold standard / queries 文件 -> {number: gold DocID 列表}（流式读）。"""
+    return {q["number"]: [m["docid"] for m in q["matches"]]
+            for q in JsonArrayStream(path) if q.get("matches")}
+
+
+# =========================
+# 命令行
+# =========================
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compact run store for query results.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("import", help="store a results file as-is")
+    p.add_argument("results")
+    p.add_argument("store")
+
+    p = sub.add_parser("merge", help="join a results file with a queries / gold file on number")
+    p.add_argument("results")
+    p.add_argument("queries")
+    p.add_argument("store")
+    p.add_argument("--export", default=None, help="also write the legacy JSON to this file")
+
+    p = sub.add_parser("export", help="write the legacy results JSON")
+    p.add_argument("store")
+    p.add_argument("out")
+
+    p = sub.add_parser("info", help="print store statistics")
+    p.add_argument("store")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "import":
+        store = import_results(args.results, args.store)
+    elif args.cmd == "merge":
+        store = merge_results(args.results, args.queries, args.store)
+        if args.export:
+            store.export_legacy(args.export)
+            print(f"[DONE] Wrote: {args.export}")
+    else:
+        store = RunStore(args.store)
+        if args.cmd == "export":
+            store.export_legacy(args.out)
+            print(f"[DONE] Wrote: {args.out}")
+
+    size = sum(os.path.getsize(os.path.join(store.path, name)) for name in os.listdir(store.path))
+    print(f"{store.path}: {len(store)} queries, runs={store.run_names}, {store.num_docs} distinct DocIDs, {size / 1024:.1f} KB")
+    store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""
+影子比较（shadow）：同一批查询同时发给两个目标（旧索引和新索引，或者两个集群），逐个查询比较排名变了多少。
+
+换了分析器 / mapping 重建 student_index 以后，eqs_eval 和 make_results.py 只能各看一个索引的 P/R，
+看不出排名具体怎么动了。这里每个查询同时发给 A（基准）和 B（候选），边跑边算：
+
+    overlap@k     两个前 k 里共同的文档比例（不管顺序）
+    Kendall tau   两个前 k 的并集上的 tau-b：某个列表里没有的文档并列排在它的最后
+    RBO           rank-biased overlap（Webber 2010，外推版）：越靠前的位置权重越大，
+                  p = 0.9 时前 10 名占了约 86% 的权重；1 = 完全一样，0 = 没有交集
+    延迟          两边各自的客户端延迟（p50/p95/p99）和 ES 的 took，B - A 的差
+    P/R           查询文件是 gold standard（有 matches）时两边各算 P@5、P@10、R@10、AP
+
+每个查询一行写进 CSV（边跑边写），最后打印平均值、延迟对比和变化最大（RBO 最低）的查询。
+内存只和并发数、--top 有关，几十万条生产查询日志也可以回放。某个查询在任何一边出错（比如 400）
+不会中断回放：错误写进那一行的 error 列，最后报告出错的查询数，平均值只算成功的查询。
+
+目标写法：
+    student_index                          默认集群（IR_ES_URL / --es-url）上的索引
+    http://other-host:9200/student_index   别的集群上的索引
+
+查询文件：gold standard / queries.json（keyword_query 和 kibana_query 各算一个查询，流式读），
+或者每行一个查询 body 的 NDJSON 日志（{"query": {...}}）。
+
+用法：
+    python shadow.py student_index student_index_v2 gold_standard_v5.json
+    python shadow.py student_index http://new-cluster:9200/student_index query_log.ndjson \\
+        --k 40 --concurrency 16 --csv shadow.csv --top 20 --min-rbo 0.8 --max-map-drop 0.02
+
+--min-rbo / --max-map-drop / --max-errors 不满足时退出码是 1，可以直接拿来卡索引上线。
+只要用了其中一个，出错的查询超过 --max-errors 个（默认 0）、或者一个成功的查询都没有，也算不通过。
+需要 Elasticsearch（或者 es_standin.py），本地索引 IR_LOCAL_INDEX 只有一个索引，比不了。
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import math
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from requests import RequestException
+
+import es_client
+from async_runner import LatencyHistogram
+from deep_search import ID_FILTER_PATH, lean_body
+
+DEFAULT_K = 40
+DEFAULT_P = 0.9
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TOP = 10
+GOLD_MEASURES = ("P@5", "P@10", "R@10", "AP")
+
+SHADOW_FILTER_PATH = "took," + ID_FILTER_PATH
+
+
+# ---------------------------------------------------------------------------
+# 排名相似度
+# ---------------------------------------------------------------------------
+
+def overlap_at(a: Sequence[str], b: Sequence[str], k: int) -> float:
+    """前 k 里共同文档的比例。某边不到 k 个时按多的那边算；两边都是空的算 1。"""
+    top_a, top_b = set(a[:k]), set(b[:k])
+    n = max(len(top_a), len(top_b))
+    return len(top_a & top_b) / n if n else 1.0
+
+
+def kendall_tau(a: Sequence[str], b: Sequence[str]) -> float:
+    """
+    两个排名（可以长度不同、文档不同）的 Kendall tau-b。在并集上比：列表里没有的文档
+    排名都算 len(列表)（并列最后）。完全一样是 1，完全相反是 -1，没有交集时也是负的
+    （A 的文档在 A 里都排在 B 的文档前面，在 B 里正好反过来）。
+    """
+    items = list(dict.fromkeys(list(a) + list(b)))
+    if len(items) < 2:
+        return 1.0
+    pos_a = {d: i for i, d in enumerate(a)}
+    pos_b = {d: i for i, d in enumerate(b)}
+    ra = np.array([pos_a.get(d, len(a)) for d in items], dtype=np.int32)
+    rb = np.array([pos_b.get(d, len(b)) for d in items], dtype=np.int32)
+    iu = np.triu_indices(len(items), 1)
+    sa = np.sign(ra[:, None] - ra[None, :])[iu]
+    sb = np.sign(rb[:, None] - rb[None, :])[iu]
+    denom = math.sqrt(float(np.count_nonzero(sa)) * float(np.count_nonzero(sb)))
+    if denom == 0:
+        return 1.0 if list(a) == list(b) else 0.0
+    return float(np.dot(sa.astype(np.int64), sb)) / denom
+
+
+def rbo(a: Sequence[str], b: Sequence[str], p: float = DEFAULT_P) -> float:
+    """
+    外推的 rank-biased overlap（RBO_ext，Webber et al. 2010 式 32，两边取同样深度
+    d = 短的那个列表的长度）：
+        (1-p)/p * sum_{i<=d} (X_i/i) p^i + (X_d/d) p^d
+    X_i 是前 i 名的交集大小。两边都是空的算 1，只有一边空的算 0。
+    """
+    d = min(len(a), len(b))
+    if d == 0:
+        return 1.0 if not a and not b else 0.0
+    seen_a: set = set()
+    seen_b: set = set()
+    overlap = 0
+    total = 0.0
+    weight = 1.0
+    for i in range(d):
+        x, y = a[i], b[i]
+        if x == y:
+            overlap += 1
+        else:
+            overlap += (x in seen_b) + (y in seen_a)
+        seen_a.add(x)
+        seen_b.add(y)
+        weight *= p
+        total += overlap / (i + 1) * weight
+    return (1 - p) / p * total + overlap / d * weight
+
+
+# ---------------------------------------------------------------------------
+# 目标和查询
+# ---------------------------------------------------------------------------
+
+class Target:
+    """一个要查的索引：集群地址 + 索引名。"""
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        if "://" in spec:
+            self.url, self.index = spec.rstrip("/").rsplit("/", 1)
+        else:
+            self.url, self.index = es_client.ES_URL, spec
+
+    def search(self, body: Dict[str, Any], k: int) -> Tuple[List[str], float, Optional[int]]:
+        """(DocID 列表, 客户端延迟秒数, ES 的 took 毫秒)。只要 _id，不要 _source。"""
+        start = time.perf_counter()
+        r = es_client.get_session().post(f"{self.url}/{self.index}/_search", json=lean_body(body, k),
+                                         params={"filter_path": SHADOW_FILTER_PATH}, timeout=60)
+        latency = time.perf_counter() - start
+        if not r.ok:
+            raise RuntimeError(f"{self.spec}: ES request failed: {r.status_code}\n{r.text}")
+        data = r.json()
+        hits = data.get("hits", {}).get("hits", [])
+        return [h["_id"] for h in hits if "_id" in h], latency, data.get("took")
+
+
+def iter_queries(path: str) -> Iterator[Tuple[str, Dict[str, Any], Optional[List[str]]]]:
+    """
+    给出 (标签, 查询 body, gold DocID 或 None)。gold standard / queries.json 流式读
+    （gold_stream.py），标签是 "编号:keyword" / "编号:kibana"；NDJSON 日志的标签是行号。
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        first = f.readline()
+        try:
+            head = json.loads(first)
+            ndjson = isinstance(head, dict) and "queries" not in head     # 整个 gold standard 写在一行的不算
+        except json.JSONDecodeError:
+            ndjson = False
+        if ndjson:
+            yield from _log_line(1, first)
+            for n, line in enumerate(f, 2):
+                yield from _log_line(n, line)
+            return
+
+    from eqs_evaluate_query_set_v5 import eqs_gold_docid_list, eqs_keyword_query
+    from gold_stream import DOCIDS_ONLY, iter_queries as iter_gold
+
+    for q in iter_gold(path, DOCIDS_ONLY):
+        gold = eqs_gold_docid_list(q["matches"]) if q.get("matches") else None
+        if q.get("keyword_query"):
+            yield f"{q.get('number')}:keyword", {"query": eqs_keyword_query(q["keyword_query"])}, gold
+        # Blank queries, i.e. {} crash Elastic...
+        if (q.get("kibana_query") or {}).get("query"):
+            yield f"{q.get('number')}:kibana", {"query": q["kibana_query"]["query"]}, gold
+
+
+def _log_line(n: int, line: str) -> Iterator[Tuple[str, Dict[str, Any], None]]:
+    if not line.strip():
+        return
+    body = json.loads(line)
+    yield str(n), body if "query" in body else {"query": body}, None
+
+
+# ---------------------------------------------------------------------------
+# 比较
+# ---------------------------------------------------------------------------
+
+def _gold_measures(docids: List[str], gold: List[str]) -> Dict[str, float]:
+    from eval_metrics import evaluate
+    table = evaluate({0: docids}, {0: gold}, [5, 10])
+    return {m: float(table[m][0]) for m in GOLD_MEASURES}
+
+
+def compare_one(label: str, body: Dict[str, Any], gold: Optional[List[str]],
+                a: Tuple[List[str], float, Optional[int]], b: Tuple[List[str], float, Optional[int]],
+                overlap_ks: Sequence[int], p: float) -> Dict[str, Any]:
+    """一个查询的比较结果（一行）。"""
+    docs_a, latency_a, took_a = a
+    docs_b, latency_b, took_b = b
+    row: Dict[str, Any] = {"label": label, "hits_a": len(docs_a), "hits_b": len(docs_b)}
+    for k in overlap_ks:
+        row[f"overlap@{k}"] = overlap_at(docs_a, docs_b, k)
+    row["tau"] = kendall_tau(docs_a, docs_b)
+    row["rbo"] = rbo(docs_a, docs_b, p)
+    row["latency_a_ms"] = 1000 * latency_a
+    row["latency_b_ms"] = 1000 * latency_b
+    row["latency_delta_ms"] = 1000 * (latency_b - latency_a)
+    row["took_a"] = took_a
+    row["took_b"] = took_b
+    if gold is not None:
+        for side, docs in (("a", docs_a), ("b", docs_b)):
+            for m, value in _gold_measures(docs, gold).items():
+                row[f"{m}_{side}"] = value
+    row["query"] = json.dumps(body.get("query", body), ensure_ascii=False)
+    return row
+
+
+def csv_fields(overlap_ks: Sequence[int]) -> List[str]:
+    """CSV 的列（固定的，不看第一行：第一个查询没有 matches 或者出错时 P/R 列也要在）。"""
+    return (["label", "hits_a", "hits_b"] + [f"overlap@{k}" for k in overlap_ks] +
+            ["tau", "rbo", "latency_a_ms", "latency_b_ms", "latency_delta_ms", "took_a", "took_b"] +
+            [f"{m}_{side}" for side in ("a", "b") for m in GOLD_MEASURES] + ["error", "query"])
+
+
+def _finish(label: str, body: Dict[str, Any], gold: Optional[List[str]], fa: Any, fb: Any,
+            overlap_ks: Sequence[int], p: float) -> Dict[str, Any]:
+    """等两边的结果；有一边出错就给出只有 error 的一行，不往外抛。"""
+    errors = []
+    results = []
+    for side, future in (("A", fa), ("B", fb)):
+        try:
+            results.append(future.result())
+        except (RuntimeError, ValueError, RequestException) as e:
+            errors.append(f"{side}: {' '.join(str(e).split())[:300]}")
+    if errors:
+        return {"label": label, "error": "; ".join(errors),
+                "query": json.dumps(body.get("query", body), ensure_ascii=False)}
+    return compare_one(label, body, gold, results[0], results[1], overlap_ks, p)
+
+
+def run_shadow(target_a: Target, target_b: Target, queries: Iterator[Tuple[str, Dict[str, Any], Optional[List[str]]]],
+               k: int = DEFAULT_K, overlap_ks: Sequence[int] = (10, DEFAULT_K), p: float = DEFAULT_P,
+               concurrency: int = DEFAULT_CONCURRENCY) -> Iterator[Dict[str, Any]]:
+    """
+    每个查询同时发给 A 和 B，按查询文件的顺序给出每个查询的比较结果（生成器）。
+    同时在路上的查询最多 concurrency 个（每个两个请求）。出错的查询那一行只有 label、error 和 query。
+    """
+    window: deque = deque()
+    with ThreadPoolExecutor(max(2, 2 * concurrency)) as pool:
+        for label, body, gold in queries:
+            window.append((label, body, gold, pool.submit(target_a.search, body, k),
+                           pool.submit(target_b.search, body, k)))
+            if len(window) >= concurrency:
+                yield _finish(*window.popleft(), overlap_ks, p)
+        while window:
+            yield _finish(*window.popleft(), overlap_ks, p)
+
+
+class Summary:
+    """边跑边累计：相似度和 P/R 的总和、两边的延迟直方图、RBO 最低的 top 个查询、出错的查询。"""
+
+    def __init__(self, top: int = DEFAULT_TOP):
+        self.top = top
+        self.count = 0
+        self.errors = 0
+        self.first_errors: List[Tuple[str, str]] = []           # 最多记 top 个，打印用
+        self.sums: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.latency = {"a": LatencyHistogram(), "b": LatencyHistogram()}
+        self.took = {"a": LatencyHistogram(), "b": LatencyHistogram()}
+        self.worst: List[Tuple[float, int, Dict[str, Any]]] = []     # 堆：(-rbo, 序号, 行)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.count += 1
+        if row.get("error"):
+            self.errors += 1
+            if len(self.first_errors) < max(self.top, 1):
+                self.first_errors.append((row["label"], row["error"]))
+            return
+        for key, value in row.items():
+            if isinstance(value, float) and not key.startswith("latency"):
+                self.sums[key] = self.sums.get(key, 0.0) + value
+                self.counts[key] = self.counts.get(key, 0) + 1
+        for side in ("a", "b"):
+            self.latency[side].record(row[f"latency_{side}_ms"] / 1000)
+            if row[f"took_{side}"] is not None:
+                self.took[side].record(row[f"took_{side}"] / 1000)
+        item = (-row["rbo"], self.count, row)
+        if len(self.worst) < self.top:
+            heapq.heappush(self.worst, item)
+        elif self.top and item > self.worst[0]:
+            heapq.heapreplace(self.worst, item)
+
+    def mean(self, key: str) -> float:
+        return self.sums.get(key, 0.0) / self.counts[key] if self.counts.get(key) else float("nan")
+
+    def most_changed(self) -> List[Dict[str, Any]]:
+        """RBO 最低的查询，从低到高；排名完全没变（RBO = 1）的不算。"""
+        return [row for _, _, row in sorted(self.worst, reverse=True) if row["rbo"] < 1 - 1e-9]
+
+    def format(self, name_a: str, name_b: str, overlap_ks: Sequence[int]) -> str:
+        lines = [f"{self.count} queries   A = {name_a}   B = {name_b}"]
+        if self.errors:
+            lines.append(f"{self.errors} queries failed on A or B and are left out of the means:")
+            for label, error in self.first_errors:
+                lines.append(f"  {label:<14} {error[:150]}")
+        lines.append("")
+        lines.append("rank similarity (mean over queries):")
+        for key in [f"overlap@{k}" for k in overlap_ks] + ["tau", "rbo"]:
+            lines.append(f"  {key:<12}{self.mean(key):.3f}")
+        if "AP_a" in self.counts:
+            lines.append("")
+            lines.append(f"gold standard ({self.counts['AP_a']} queries with matches):")
+            lines.append(f"  {'measure':<8}{'A':>8}{'B':>8}{'B - A':>9}")
+            for m in GOLD_MEASURES:
+                a, b = self.mean(f"{m}_a"), self.mean(f"{m}_b")
+                lines.append(f"  {'MAP' if m == 'AP' else m:<8}{a:8.3f}{b:8.3f}{b - a:+9.3f}")
+        lines.append("")
+        lines.append("latency:")
+        for name, hist in (("client", self.latency), ("took", self.took)):
+            sa, sb = hist["a"].summary(), hist["b"].summary()
+            if not sa["count"]:
+                continue
+            for stat in ("mean_ms", "p50_ms", "p95_ms", "p99_ms"):
+                lines.append(f"  {name + ' ' + stat[:-3]:<12}A {sa[stat]:7.1f}ms   B {sb[stat]:7.1f}ms   "
+                             f"B - A {sb[stat] - sa[stat]:+7.1f}ms")
+        worst = self.most_changed()
+        if worst:
+            lines.append("")
+            lines.append("most changed (lowest RBO):")
+            for row in worst:
+                extra = f"  AP {row['AP_a']:.2f}->{row['AP_b']:.2f}" if "AP_a" in row else ""
+                lines.append(f"  {row['label']:<14} rbo {row['rbo']:.3f}  tau {row['tau']:+.3f}  "
+                             f"overlap@{overlap_ks[0]} {row[f'overlap@{overlap_ks[0]}']:.2f}  "
+                             f"hits {row['hits_a']}/{row['hits_b']}{extra}  {row['query'][:70]}")
+        return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Send every query to two indices/clusters and diff the rankings.")
+    ap.add_argument("a", help="Baseline: index name, or http://host:9200/index")
+    ap.add_argument("b", help="Candidate: index name, or http://host:9200/index")
+    ap.add_argument("queries", help="Gold standard / queries.json, or an NDJSON log of query bodies")
+    ap.add_argument("--k", type=int, default=DEFAULT_K, help="Hits fetched from each side")
+    ap.add_argument("--overlap-k", type=int, nargs="+", default=None, help="k for overlap@k (default: 10 and --k)")
+    ap.add_argument("--p", type=float, default=DEFAULT_P, help="RBO persistence")
+    ap.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Queries in flight")
+    ap.add_argument("--csv", default=None, help="Write one row per query here as results arrive")
+    ap.add_argument("--top", type=int, default=DEFAULT_TOP, help="Show this many most-changed queries")
+    ap.add_argument("--progress", type=int, default=100, help="Print running means every N queries (0 = off)")
+    ap.add_argument("--min-rbo", type=float, default=None, help="Exit 1 if mean RBO is below this")
+    ap.add_argument("--max-map-drop", type=float, default=None, help="Exit 1 if MAP drops by more than this")
+    ap.add_argument("--max-errors", type=int, default=None,
+                    help="Exit 1 if more queries than this fail (default 0 when any gate is set)")
+    args = ap.parse_args(argv)
+
+    overlap_ks = args.overlap_k or sorted({10, args.k})
+    target_a, target_b = Target(args.a), Target(args.b)
+    summary = Summary(args.top)
+
+    out = open(args.csv, "w", newline="", encoding="utf-8") if args.csv else None
+    writer = None
+    if out:
+        writer = csv.DictWriter(out, fieldnames=csv_fields(overlap_ks), extrasaction="ignore")
+        writer.writeheader()
+    try:
+        for row in run_shadow(target_a, target_b, iter_queries(args.queries), args.k, overlap_ks, args.p,
+                              args.concurrency):
+            summary.add(row)
+            if writer:
+                writer.writerow({key: f"{v:.4f}" if isinstance(v, float) else v for key, v in row.items()})
+                out.flush()
+            if args.progress and summary.count % args.progress == 0:
+                print(f"{summary.count} queries  overlap@{overlap_ks[0]} {summary.mean(f'overlap@{overlap_ks[0]}'):.3f}  "
+                      f"tau {summary.mean('tau'):.3f}  rbo {summary.mean('rbo'):.3f}", file=sys.stderr, flush=True)
+    finally:
+        if out:
+            out.close()
+
+    print(summary.format(target_a.spec, target_b.spec, overlap_ks))
+    if args.csv:
+        print(f"\n[DONE] Wrote: {args.csv}")
+
+    failed = []
+    gated = args.min_rbo is not None or args.max_map_drop is not None or args.max_errors is not None
+    ok = summary.count - summary.errors
+    if gated and summary.errors > (args.max_errors or 0):
+        failed.append(f"{summary.errors} queries failed > {args.max_errors or 0}")
+    if gated and ok == 0:
+        failed.append("no query succeeded on both sides")
+    if args.min_rbo is not None and ok and summary.mean("rbo") < args.min_rbo:
+        failed.append(f"mean RBO {summary.mean('rbo'):.3f} < {args.min_rbo}")
+    if args.max_map_drop is not None and ok and "AP_a" not in summary.counts:
+        failed.append("cannot check MAP: no successful query has gold matches")
+    if args.max_map_drop is not None and "AP_a" in summary.counts:
+        drop = summary.mean("AP_a") - summary.mean("AP_b")
+        if drop > args.max_map_drop:
+            failed.append(f"MAP dropped by {drop:.3f} > {args.max_map_drop}")
+    for reason in failed:
+        print(f"[FAIL] {reason}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+两个或多个 run 的显著性检验：kibana_query 真的比 keyword_query 好，还是只是这 20 个查询碰巧？
+
+对每个指标（P@5、P@10、R@10、MAP ...）、每一对 run：
+    配对随机化检验（paired randomization / sign-flip）：每个查询的分数差随机换号，
+        看换号后平均差的绝对值 >= 实际平均差的比例，就是双侧 p 值
+    bootstrap 置信区间：查询有放回地重抽样，平均差的 [alpha/2, 1-alpha/2] 分位数
+    多重比较校正：同一个指标下的所有比较算一族，用 Holm（默认）/ Bonferroni / BH 校正 p 值
+
+全部是批量的 NumPy 矩阵运算：所有 (比较, 指标) 的分数差排成一个矩阵 D（检验数 × 查询数），
+一批随机符号矩阵 S（批大小 × 查询数）乘一下 S @ D.T 就是这一批所有检验的置换统计量，
+10 万次置换不用 Python 循环；bootstrap 一样，用抽样次数矩阵乘 D.T。
+
+用法：
+    python significance.py 2507244_results_fixed_v2.json
+    python significance.py 2507244_results_fixed_v2.json other_results.json --gold gold_standard_v5.json
+    python significance.py 2507244_runs --all-pairs --metrics P@5 P@10 R@10 MAP --csv sig.csv
+
+输入可以是旧格式的 results JSON，也可以是 run_store 目录；每个 *_docids 字段是一个 run
+（keyword_top40_docids -> keyword）。"文件:字段" 只取其中一个 run。
+gold 默认用第一个输入里每个查询的 matches，也可以用 --gold 指定。
+第一个 run 是 baseline，其他 run 都和它比；--all-pairs 两两都比。
+"""
+
+import argparse
+import csv
+import os
+import sys
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from eval_metrics import evaluate
+from run_store import load_gold, load_runs
+
+DEFAULT_METRICS = ["P@5", "P@10", "R@5", "R@10", "MAP"]
+DEFAULT_PERMUTATIONS = 100_000
+DEFAULT_BOOTSTRAP = 10_000
+DEFAULT_ALPHA = 0.05
+CORRECTIONS = ("holm", "bonferroni", "bh", "none")
+
+# 一批随机矩阵最多多少个元素（控制内存：4M 个 float64 = 32MB）
+MAX_CELLS = 1 << 22
+
+_METRIC_NAMES = {"MAP": "AP", "MRR": "RR"}
+
+
+# ---------------------------------------------------------------------------
+# 每个查询的分数
+# ---------------------------------------------------------------------------
+
+def score_matrix(runs: Dict[str, Dict[Hashable, Sequence[str]]], qrels: Dict[Hashable, Sequence[str]],
+                 metrics: Sequence[str] = DEFAULT_METRICS) -> Tuple[List[Hashable], Dict[str, np.ndarray]]:
+    """
+    所有 run 一次交给 eval_metrics（每个 (run, 查询) 一行），返回 (qids, {指标: (run 数, 查询数) 矩阵})。
+    run 的顺序和 runs 的 key 顺序一样；只评估 qrels 里的查询，run 里没有的查询算 0 分。
+    """
+    names = list(runs)
+    qids = list(qrels)
+    ks = sorted({int(m.split("@")[1]) for m in metrics if "@" in m})
+    rows = {(r, q): runs[name].get(q, ()) for r, name in enumerate(names) for q in qids}
+    table = evaluate(rows, {(r, q): qrels[q] for r, q in rows}, ks=ks or (10,))
+    out = {}
+    for metric in metrics:
+        column = _METRIC_NAMES.get(metric, metric)
+        if column not in table:
+            raise KeyError(f"unknown metric {metric!r} (available: {[k for k in table if k != 'qid']})")
+        out[metric] = np.asarray(table[column], dtype=np.float64).reshape(len(names), len(qids))
+    return qids, out
+
+
+# ---------------------------------------------------------------------------
+# 检验
+# ---------------------------------------------------------------------------
+
+def _batches(total: int, n: int) -> List[int]:
+    size = max(1, MAX_CELLS // max(n, 1))
+    return [min(size, total - start) for start in range(0, total, size)]
+
+
+def randomization_test(diffs: np.ndarray, permutations: int = DEFAULT_PERMUTATIONS,
+                       seed: Optional[int] = 0) -> np.ndarray:
+    """
+    配对随机化检验（双侧）。diffs: (检验数, 查询数) 每个查询的分数差（A - B）。
+    所有检验共用同一批随机符号；返回每个检验的 p 值 (count + 1) / (permutations + 1)。
+    """
+    diffs = np.atleast_2d(np.asarray(diffs, dtype=np.float64))
+    m, n = diffs.shape
+    if n == 0:
+        return np.ones(m)
+    rng = np.random.default_rng(seed)
+    total = diffs.sum(axis=1)
+    observed = np.abs(total) - 1e-9 * np.maximum(1.0, np.abs(total))
+    hits = np.zeros(m, dtype=np.int64)
+    for size in _batches(permutations, n):
+        # 随机符号：一个随机字节给 8 个查询，bits=1 的查询换号
+        bits = np.unpackbits(rng.integers(0, 256, (size, (n + 7) // 8), dtype=np.uint8), axis=1)[:, :n]
+        # sum(sign * d) = total - 2 * sum(d[换号的])
+        flipped = total - 2.0 * (bits.astype(np.float64) @ diffs.T)
+        hits += (np.abs(flipped) >= observed).sum(axis=0)
+    return (hits + 1) / (permutations + 1)
+
+
+def bootstrap_ci(diffs: np.ndarray, samples: int = DEFAULT_BOOTSTRAP, alpha: float = DEFAULT_ALPHA,
+                 seed: Optional[int] = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    平均差的 bootstrap 百分位置信区间。diffs: (检验数, 查询数)。返回 (下限, 上限)，各 (检验数,)。
+    每次抽样用“每个查询被抽到几次”的计数向量表示，一批计数矩阵乘 diffs.T 就是这一批的平均差。
+    """
+    diffs = np.atleast_2d(np.asarray(diffs, dtype=np.float64))
+    m, n = diffs.shape
+    if n == 0:
+        return np.zeros(m), np.zeros(m)
+    rng = np.random.default_rng(seed)
+    means = []
+    for size in _batches(samples, n):
+        picks = rng.integers(0, n, (size, n)) + (np.arange(size) * n)[:, None]
+        counts = np.bincount(picks.ravel(), minlength=size * n).reshape(size, n)
+        means.append(counts @ diffs.T / n)
+    means = np.concatenate(means)
+    lo, hi = np.quantile(means, [alpha / 2, 1 - alpha / 2], axis=0)
+    return lo, hi
+
+
+def adjust_pvalues(p: Sequence[float], method: str = "holm") -> np.ndarray:
+    """多重比较校正：holm / bonferroni / bh（Benjamini-Hochberg）/ none。"""
+    p = np.asarray(p, dtype=np.float64)
+    m = len(p)
+    if m == 0 or method == "none":
+        return p.copy()
+    if method == "bonferroni":
+        return np.minimum(p * m, 1.0)
+    order = np.argsort(p, kind="stable")
+    ranked = p[order]
+    if method == "holm":
+        adj = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    elif method == "bh":
+        adj = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"unknown correction {method!r} (use one of {CORRECTIONS})")
+    out = np.empty(m)
+    out[order] = np.minimum(adj, 1.0)
+    return out
+
+
+def compare(scores: Dict[str, np.ndarray], names: Sequence[str], pairs: Sequence[Tuple[int, int]],
+            permutations: int = DEFAULT_PERMUTATIONS, samples: int = DEFAULT_BOOTSTRAP,
+            alpha: float = DEFAULT_ALPHA, correction: str = "holm",
+            seed: Optional[int] = 0) -> List[Dict[str, Any]]:
+    """
+    scores: score_matrix 的结果 {指标: (run 数, 查询数)}；pairs: [(a, b), ...] run 下标。
+    所有 (指标, 比较) 放进一个矩阵一起检验，校正按指标分族。每个 (指标, 比较) 返回一行：
+        metric, a, b, mean_a, mean_b, diff, ci_low, ci_high, p, p_adj, significant
+    """
+    metrics = list(scores)
+    if not pairs or not metrics:
+        return []
+    a_idx = np.array([a for a, _ in pairs])
+    b_idx = np.array([b for _, b in pairs])
+    diffs = np.concatenate([scores[m][a_idx] - scores[m][b_idx] for m in metrics])
+    p = randomization_test(diffs, permutations, seed)
+    lo, hi = bootstrap_ci(diffs, samples, alpha, seed)
+
+    rows = []
+    for mi, metric in enumerate(metrics):
+        block = slice(mi * len(pairs), (mi + 1) * len(pairs))
+        p_adj = adjust_pvalues(p[block], correction)
+        means = scores[metric].mean(axis=1) if scores[metric].shape[1] else np.zeros(len(names))
+        for j, (a, b) in enumerate(pairs):
+            t = mi * len(pairs) + j
+            rows.append({
+                "metric": metric, "a": names[a], "b": names[b],
+                "mean_a": float(means[a]), "mean_b": float(means[b]), "diff": float(means[a] - means[b]),
+                "ci_low": float(lo[t]), "ci_high": float(hi[t]),
+                "p": float(p[t]), "p_adj": float(p_adj[j]), "significant": bool(p_adj[j] < alpha),
+            })
+    return rows
+
+
+def baseline_pairs(n_runs: int, baseline: int = 0) -> List[Tuple[int, int]]:
+    """每个 run 和 baseline 比：(run, baseline)。"""
+    return [(i, baseline) for i in range(n_runs) if i != baseline]
+
+
+def all_pairs(n_runs: int) -> List[Tuple[int, int]]:
+    return [(j, i) for i in range(n_runs) for j in range(i + 1, n_runs)]
+
+
+def format_comparisons(rows: List[Dict[str, Any]], alpha: float = DEFAULT_ALPHA) -> str:
+    level = int(round((1 - alpha) * 100))
+    lines = [f"metric\tA\tB\tmean A\tmean B\tdiff\t{level}% CI\tp\tp adj"]
+    for r in rows:
+        mark = " *" if r["significant"] else ""
+        lines.append(f"{r['metric']}\t{r['a']}\t{r['b']}\t{r['mean_a']:.3f}\t{r['mean_b']:.3f}\t{r['diff']:+.3f}\t"
+                     f"[{r['ci_low']:+.3f}, {r['ci_high']:+.3f}]\t{r['p']:.4f}\t{r['p_adj']:.4f}{mark}")
+    return "\n".join(lines)
+
+
+def write_csv(path: str, rows: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["metric"])
+        w.writeheader()
+        w.writerows(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Paired randomization tests and bootstrap CIs between runs.")
+    ap.add_argument("inputs", nargs="+", help="results JSON files or run store directories (optionally FILE:RUN)")
+    ap.add_argument("--gold", help="Gold standard file (default: matches in the first input)")
+    ap.add_argument("--metrics", nargs="+", default=DEFAULT_METRICS)
+    ap.add_argument("--baseline", help="Run to compare against (default: the first run)")
+    ap.add_argument("--all-pairs", action="store_true", help="Compare every pair of runs")
+    ap.add_argument("--permutations", type=int, default=DEFAULT_PERMUTATIONS)
+    ap.add_argument("--bootstrap", type=int, default=DEFAULT_BOOTSTRAP)
+    ap.add_argument("--alpha", type=float, default=DEFAULT_ALPHA)
+    ap.add_argument("--correction", choices=CORRECTIONS, default="holm")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--csv", help="Write all comparisons to this CSV file")
+    args = ap.parse_args(argv)
+
+    runs: Dict[str, Dict[Any, List[str]]] = {}
+    qrels: Dict[Any, List[str]] = {}
+    for spec in args.inputs:
+        file_runs, file_qrels = load_runs(spec)
+        prefix = os.path.basename(spec.rstrip("/\\")) + ":" if len(args.inputs) > 1 else ""
+        for name, run in file_runs.items():
+            runs[prefix + name] = run
+        qrels = qrels or file_qrels
+    if args.gold:
+        qrels = load_gold(args.gold)
+    if not qrels:
+        print("[ERROR] No gold standard matches found (use --gold).")
+        sys.exit(1)
+    if len(runs) < 2:
+        print(f"[ERROR] Need at least two runs, found {list(runs)}.")
+        sys.exit(1)
+
+    names = list(runs)
+    if args.all_pairs:
+        pairs = all_pairs(len(names))
+    else:
+        base = names.index(args.baseline) if args.baseline else 0
+        pairs = baseline_pairs(len(names), base)
+
+    qids, scores = score_matrix(runs, qrels, args.metrics)
+    print(f"Runs: {', '.join(names)}; queries with gold: {len(qids)}; "
+          f"{args.permutations} permutations, {args.bootstrap} bootstrap samples, correction={args.correction}")
+    rows = compare(scores, names, pairs, args.permutations, args.bootstrap, args.alpha, args.correction, args.seed)
+    print(format_comparisons(rows, args.alpha))
+    print(f"(* = significant at alpha={args.alpha} after {args.correction} correction, per metric)")
+    if args.csv:
+        write_csv(args.csv, rows)
+        print(f"[DONE] Wrote: {args.csv}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+kibana_query 调参：一次试很多种查询写法，不用手改 2507244_queries.json 再跑 make_results.py / eqs_eval。
+
+给一个参数表（grid），每个参数一个候选值列表：
+    fields                字段和 boost，比如 ["title^3", "parsedParagraphs"]
+    type                  multi_match 类型：best_fields / phrase / cross_fields / most_fields
+    tie_breaker           best_fields / phrase / cross_fields 用
+    minimum_should_match  phrase 不用（写了也被忽略）
+    bool                  none   只有一个 multi_match
+                          must   multi_match 放 must（必须匹配），同样字段的短语 multi_match 放 should 加分
+                          should 两个都放 should（匹配哪个都行，都匹配分更高）
+展开成所有组合（一种组合 = 一个“配置”），对每个查询的 keyword_query 生成具体的查询 body。
+不同配置生成的 body 经常是一样的（比如 phrase 配不同的 minimum_should_match），
+所以先按规范化的 JSON 去重，每个不同的 body 只跑一次；上次跑过的还在 result_cache 里，也不再跑。
+剩下的分批交给线程池（ES，每批一个 _msearch）或进程池（本地索引，IR_LOCAL_INDEX），
+最后用 eval_metrics 一次算完所有配置的 P@5 / P@10 / R@10，按分数排名。
+
+用法：
+    python sweep.py 2507244_queries.json
+    python sweep.py 2507244_queries.json --grid grid.json --workers 8 --top 30 --csv sweep.csv
+    python sweep.py 2507244_queries.json --apply 2507244_queries_best.json
+    python sweep.py 2507244_queries.json --significance 5     # 前 5 名和现在的 kibana_query 做显著性检验
+
+grid.json 例子（不写的参数用 DEFAULT_GRID 里的值）：
+    {
+      "fields": [["title", "parsedParagraphs"], ["title^3", "parsedParagraphs"]],
+      "type": ["best_fields", "phrase", "cross_fields"],
+      "tie_breaker": [0, 0.3],
+      "minimum_should_match": [null, "50%"],
+      "bool": ["none", "must", "should"]
+    }
+
+gold 默认用查询文件里每个查询的 matches；也可以用 --gold 指定 gold standard 文件。
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import make_results
+from result_cache import ResultCache, cache_key, canonical_query, index_generation
+
+DEFAULT_GRID: Dict[str, List[Any]] = {
+    "fields": [
+        ["title", "parsedParagraphs"],
+        ["title^2", "parsedParagraphs"],
+        ["title^3", "parsedParagraphs"],
+        ["title^5", "parsedParagraphs"],
+    ],
+    "type": ["best_fields", "phrase", "cross_fields", "most_fields"],
+    "tie_breaker": [0, 0.3, 0.7],
+    "minimum_should_match": [None, "50%", "75%"],
+    "bool": ["none", "must", "should"],
+}
+
+GRID_KEYS = list(DEFAULT_GRID)
+
+DEFAULT_WORKERS = 8
+LEADERBOARD_METRICS = ["P@5", "P@10", "R@10", "MAP"]
+SORT_KEYS = ["P@10", "P@5", "R@10"]        # 排名先看 P@10，一样再看 P@5、R@10
+
+
+# ---------------------------------------------------------------------------
+# 展开参数表
+# ---------------------------------------------------------------------------
+
+def normalize_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    去掉对这个 type 没用的参数（ES 会忽略它们），这样效果一样的配置就变成同一个。
+    tie_breaker 0 和 minimum_should_match null 就是 ES 的默认值，也去掉。
+    """
+    c = dict(config)
+    if c["type"] == "phrase":
+        c["minimum_should_match"] = None
+    if c["type"] == "most_fields":
+        c["tie_breaker"] = 0
+    if not c.get("tie_breaker"):
+        c["tie_breaker"] = 0
+    return c
+
+
+def expand_grid(grid: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """参数表 -> 所有不重复的配置（按第一次出现的顺序）。"""
+    values = [grid.get(key, DEFAULT_GRID[key]) for key in GRID_KEYS]
+    configs = []
+    seen = set()
+    for combo in itertools.product(*values):
+        config = normalize_config(dict(zip(GRID_KEYS, combo)))
+        key = canonical_query(config)
+        if key not in seen:
+            seen.add(key)
+            configs.append(config)
+    return configs
+
+
+def multi_match(config: Dict[str, Any], text: str, mtype: Optional[str] = None) -> Dict[str, Any]:
+    mtype = mtype or config["type"]
+    spec: Dict[str, Any] = {"query": text, "fields": list(config["fields"]), "type": mtype}
+    if config.get("tie_breaker") and mtype != "most_fields":
+        spec["tie_breaker"] = config["tie_breaker"]
+    if config.get("minimum_should_match") is not None and mtype != "phrase":
+        spec["minimum_should_match"] = config["minimum_should_match"]
+    return {"multi_match": spec}
+
+
+def build_body(config: Dict[str, Any], text: str) -> Dict[str, Any]:
+    """一个配置 + 一个查询的文字 -> ES 查询 body（和 kibana_query 的格式一样）。"""
+    main = multi_match(config, text)
+    mode = config.get("bool", "none")
+    if mode == "none":
+        return {"query": main}
+    phrase = multi_match(config, text, "phrase")
+    if mode == "must":
+        return {"query": {"bool": {"must": [main], "should": [phrase]}}}
+    if mode == "should":
+        return {"query": {"bool": {"should": [main, phrase]}}}
+    raise ValueError(f"unknown bool mode '{mode}' (use none / must / should)")
+
+
+def describe(config: Dict[str, Any]) -> str:
+    """配置 -> 一行简短的说明，打印排行榜用。"""
+    parts = [config["type"], ",".join(config["fields"])]
+    if config.get("tie_breaker"):
+        parts.append(f"tie={config['tie_breaker']}")
+    if config.get("minimum_should_match") is not None:
+        parts.append(f"msm={config['minimum_should_match']}")
+    if config.get("bool", "none") != "none":
+        parts.append(f"bool={config['bool']}")
+    return " ".join(parts)
+
+
+# ---------------------------------------------------------------------------
+# 读查询和 gold
+# ---------------------------------------------------------------------------
+
+def load_queries(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return json.load(f)
+
+
+def query_texts(qdata: Dict[str, Any]) -> List[Tuple[Any, str]]:
+    """[(number, 查询文字)]：用 keyword_query，没有就用 original_query。"""
+    out = []
+    for q in qdata.get("queries", []):
+        text = q.get("keyword_query") or q.get("original_query")
+        if q.get("number") and text:
+            out.append((q["number"], text))
+    return out
+
+
+def load_qrels(qdata: Dict[str, Any]) -> Dict[Any, List[str]]:
+    """{number: gold docid 列表}，没有 gold 的查询不算（和 eqs_eval 一样）。"""
+    qrels = {}
+    for q in qdata.get("queries", []):
+        docids = [m["docid"] for m in q.get("matches", []) if "docid" in m]
+        if q.get("number") and docids:
+            qrels[q["number"]] = docids
+    return qrels
+
+
+# ---------------------------------------------------------------------------
+# 执行
+# ---------------------------------------------------------------------------
+
+def _search_local_batch(bodies: List[Dict[str, Any]]) -> List[List[str]]:
+    """进程池里跑：每个进程自己打开 IR_LOCAL_INDEX（mmap，很快），跑一批查询。"""
+    from local_bm25 import search_backend
+    local = search_backend()
+    out = []
+    for body in bodies:
+        hits = local.search(body=dict(body, size=make_results.TOPK), source=False)["hits"]["hits"]
+        out.append([h["_id"] for h in hits])
+    return out
+
+
+def _search_es_batch(bodies: List[Dict[str, Any]]) -> List[List[str]]:
+    """线程池里跑：一批查询一个 _msearch。"""
+    return make_results.es_msearch(bodies, size=make_results.TOPK, batch_size=len(bodies))
+
+
+def execute(bodies: List[Dict[str, Any]], workers: int = DEFAULT_WORKERS) -> List[List[str]]:
+    """
+    并行跑一批（已经去重的）查询 body，返回一一对应的 docid 列表。
+    ES：每批 MSEARCH_BATCH 个一个 _msearch，几批同时发（线程）。
+    本地索引：打分是纯 Python，用进程池才能同时用多个 CPU。
+    """
+    if not bodies:
+        return []
+    local = make_results.local_backend() is not None
+    if local:
+        size = max(1, min(50, len(bodies) // (workers * 4) or 1))
+        pool = ProcessPoolExecutor(max_workers=workers)
+        run = _search_local_batch
+    else:
+        size = make_results.MSEARCH_BATCH
+        pool = ThreadPoolExecutor(max_workers=workers)
+        run = _search_es_batch
+
+    batches = [bodies[i:i + size] for i in range(0, len(bodies), size)]
+    with pool:
+        results = list(pool.map(run, batches))
+    return [docids for batch in results for docids in batch]
+
+
+def run_sweep(configs: List[Dict[str, Any]], texts: List[Tuple[Any, str]], workers: int = DEFAULT_WORKERS,
+              use_cache: bool = True, extra: Optional[Dict[Any, Dict[str, Any]]] = None
+              ) -> Tuple[Dict[Tuple[int, Any], List[str]], Dict[str, Any]]:
+    """
+    对每个配置、每个查询生成 body，去重、查缓存，只跑没跑过的。
+    extra: 另外一组已经写好的 body（{number: body}，比如文件里现在的 kibana_query），当作配置 -1。
+    返回 ({(配置下标, number): docid 列表}, 统计信息)。
+    """
+    jobs: List[Tuple[Tuple[int, Any], str]] = []         # ((配置, number), body 的 key)
+    unique: Dict[str, Dict[str, Any]] = {}
+    for ci, config in enumerate(configs):
+        for number, text in texts:
+            body = build_body(config, text)
+            key = canonical_query(body)
+            unique.setdefault(key, body)
+            jobs.append(((ci, number), key))
+    for number, body in (extra or {}).items():
+        key = canonical_query(body)
+        unique.setdefault(key, body)
+        jobs.append(((-1, number), key))
+
+    keys = list(unique)
+    docid_lists: List[Optional[List[str]]] = [None] * len(keys)
+    cache = None
+    if use_cache:
+        cache = ResultCache(make_results.CACHE_FILE, make_results.CACHE_MAX_MB * 1024 * 1024)
+        local = make_results.local_backend()
+        generation = local.generation() if local is not None else \
+            index_generation(make_results.ES_URL, make_results.INDEX, make_results.get_session())
+        cache_keys = [cache_key(unique[k], make_results.TOPK, generation) for k in keys]
+        docid_lists = cache.get_many(cache_keys)
+
+    todo = [i for i, docids in enumerate(docid_lists) if docids is None]
+    start = time.perf_counter()
+    for i, docids in zip(todo, execute([unique[keys[i]] for i in todo], workers)):
+        docid_lists[i] = docids
+    elapsed = time.perf_counter() - start
+
+    if cache is not None:
+        cache.put_many((cache_keys[i], docid_lists[i]) for i in todo)
+        cache.close()
+
+    by_key = dict(zip(keys, docid_lists))
+    runs = {job: by_key[key] for job, key in jobs}
+    stats = {"bodies": len(jobs), "unique": len(keys), "executed": len(todo), "seconds": elapsed}
+    return runs, stats
+
+
+# ---------------------------------------------------------------------------
+# 评分和排名
+# ---------------------------------------------------------------------------
+
+def score_runs(runs: Dict[Tuple[int, Any], List[str]], qrels: Dict[Any, List[str]],
+               ks: Sequence[int] = (5, 10)) -> Dict[int, Dict[str, float]]:
+    """
+    所有配置一起评估：每个 (配置, 查询) 当作一行交给 eval_metrics，再按配置求平均。
+    每个配置都在 qrels 的全部查询上评估（和 significance.score_matrix 一样），
+    某个配置没有跑的查询（比如现在的 kibana_query 是空的）当作什么都没返回，算 0 分。
+    返回 {配置下标: {"P@5": ..., "P@10": ..., ...}}。
+    """
+    import numpy as np
+    from eval_metrics import evaluate
+
+    configs = sorted({ci for ci, _ in runs})
+    rows = [(ci, qid) for ci in configs for qid in qrels]
+    table = evaluate(runs, {job: qrels[job[1]] for job in rows}, ks=ks)
+    index = {ci: i for i, ci in enumerate(configs)}
+    group = np.array([index[ci] for ci, _ in table["qid"]], dtype=np.int64)
+    counts = np.bincount(group, minlength=len(configs))
+
+    scores: Dict[int, Dict[str, float]] = {ci: {} for ci in configs}
+    for name, values in table.items():
+        if name == "qid":
+            continue
+        means = np.bincount(group, weights=values, minlength=len(configs)) / np.maximum(counts, 1)
+        name = {"AP": "MAP", "RR": "MRR"}.get(name, name)
+        for ci in configs:
+            scores[ci][name] = float(means[index[ci]])
+    return scores
+
+
+def leaderboard(scores: Dict[int, Dict[str, float]]) -> List[int]:
+    """配置下标按 SORT_KEYS 从好到坏排序。"""
+    return sorted(scores, key=lambda ci: tuple(-scores[ci][k] for k in SORT_KEYS))
+
+
+def format_leaderboard(order: List[int], scores: Dict[int, Dict[str, float]],
+                       configs: List[Dict[str, Any]], top: int) -> str:
+    lines = ["rank\t" + "\t".join(LEADERBOARD_METRICS) + "\tconfiguration"]
+    shown = order[:top]
+    if -1 in order and -1 not in shown:
+        shown.append(-1)                      # 现在文件里的 kibana_query 总是显示出来，方便比较
+    for ci in shown:
+        label = "* current kibana_query" if ci == -1 else describe(configs[ci])
+        lines.append(f"{order.index(ci) + 1}\t" + "\t".join(f"{scores[ci][m]:.3f}" for m in LEADERBOARD_METRICS)
+                     + f"\t{label}")
+    return "\n".join(lines)
+
+
+def format_significance(order: List[int], runs: Dict[Tuple[int, Any], List[str]], qrels: Dict[Any, List[str]],
+                        configs: List[Dict[str, Any]], top: int) -> str:
+    """排名前 top 的配置和现在的 kibana_query（没有就和第一名）做配对随机化检验，见 significance.py。"""
+    import significance
+
+    base = -1 if any(ci == -1 for ci, _ in runs) else order[0]
+    chosen = [base] + [ci for ci in order if ci != base][:top]
+    by_config: Dict[int, Dict[Any, List[str]]] = {ci: {} for ci in chosen}
+    for (ci, qid), docids in runs.items():
+        if ci in by_config:
+            by_config[ci][qid] = docids
+    names = [f"#{order.index(ci) + 1}" for ci in chosen]
+    _, scores = significance.score_matrix(dict(zip(names, by_config.values())), qrels, ["P@5", "P@10", "R@10"])
+    rows = significance.compare(scores, names, significance.baseline_pairs(len(names)))
+    label = "current kibana_query" if base == -1 else describe(configs[base])
+    return f"Significance vs {names[0]} ({label}), ranks as in the leaderboard:\n" \
+        + significance.format_comparisons(rows)
+
+
+def write_csv(path: str, order: List[int], scores: Dict[int, Dict[str, float]],
+              configs: List[Dict[str, Any]]) -> None:
+    metrics = list(next(iter(scores.values())))
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["rank"] + GRID_KEYS + metrics)
+        for rank, ci in enumerate(order, 1):
+            if ci == -1:
+                values = ["current kibana_query"] + [""] * (len(GRID_KEYS) - 1)
+            else:
+                values = [json.dumps(configs[ci][k]) if k == "fields" else configs[ci][k] for k in GRID_KEYS]
+            w.writerow([rank] + values + [f"{scores[ci][m]:.4f}" for m in metrics])
+
+
+def apply_config(qdata: Dict[str, Any], config: Dict[str, Any], path: str) -> None:
+    """把最好的配置写成每个查询的 kibana_query，存成一个新的查询文件（原文件不动）。"""
+    out = dict(qdata)
+    out["queries"] = []
+    for q in qdata.get("queries", []):
+        q = dict(q)
+        text = q.get("keyword_query") or q.get("original_query")
+        if text:
+            q["kibana_query"] = build_body(config, text)
+        out["queries"].append(q)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    ap = argparse.ArgumentParser(description="Sweep kibana_query templates and rank them by P@5/P@10/R@10.")
+    ap.add_argument("queries", nargs="?", default=make_results.INPUT_QUERIES_FILE)
+    ap.add_argument("--grid", help="JSON file with candidate values per parameter (default: DEFAULT_GRID)")
+    ap.add_argument("--gold", help="Gold standard file (default: matches in the queries file)")
+    ap.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    ap.add_argument("--top", type=int, default=20, help="Rows of the leaderboard to print")
+    ap.add_argument("--csv", help="Write the full leaderboard to this CSV file")
+    ap.add_argument("--apply", metavar="OUT", help="Write a copy of the queries file using the best configuration")
+    ap.add_argument("--no-cache", action="store_true", help="Do not read or write the result cache")
+    ap.add_argument("--significance", type=int, default=0, metavar="N",
+                    help="Test the top N configurations against the current kibana_query (significance.py)")
+    ap.add_argument("--es-url", default=make_results.ES_URL)
+    ap.add_argument("--index", default=make_results.INDEX)
+    args = ap.parse_args(argv)
+
+    make_results.ES_URL = args.es_url
+    make_results.INDEX = args.index
+
+    qdata = load_queries(args.queries)
+    qrels = load_qrels(load_queries(args.gold) if args.gold else qdata)
+    texts = query_texts(qdata)
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as f:
+            grid = dict(DEFAULT_GRID, **json.load(f))
+    configs = expand_grid(grid)
+    if not qrels:
+        print("[ERROR] No gold standard matches found, nothing to score.")
+        sys.exit(1)
+    # Blank queries, i.e. {} crash Elastic: {"query": {}} 也不算
+    current = {q["number"]: q["kibana_query"] for q in qdata.get("queries", [])
+               if q.get("number") and (q.get("kibana_query") or {}).get("query")}
+
+    backend = "local index " + os.environ["IR_LOCAL_INDEX"] if make_results.local_backend() is not None \
+        else f"{args.es_url}/{args.index}"
+    print(f"Loaded queries: {len(texts)} ({len(qrels)} with gold), configurations: {len(configs)}")
+    print(f"Backend: {backend}, workers={args.workers}")
+
+    start = time.perf_counter()
+    runs, stats = run_sweep(configs, texts, args.workers, not args.no_cache, current)
+    scores = score_runs(runs, qrels)
+    order = leaderboard(scores)
+    elapsed = time.perf_counter() - start
+
+    print(f"{stats['bodies']} query bodies, {stats['unique']} unique, {stats['executed']} executed "
+          f"in {stats['seconds']:.1f}s ({stats['executed'] / max(stats['seconds'], 1e-9):.0f} queries/sec), "
+          f"total {elapsed:.1f}s")
+    print("-" * 60)
+    print(format_leaderboard(order, scores, configs, args.top))
+
+    if args.significance:
+        print("-" * 60)
+        print(format_significance(order, runs, qrels, configs, args.significance))
+
+    if args.csv:
+        write_csv(args.csv, order, scores, configs)
+        print(f"[DONE] Wrote: {args.csv}")
+    best = next((ci for ci in order if ci != -1), None)
+    if args.apply and best is not None:
+        apply_config(qdata, configs[best], args.apply)
+        print(f"[DONE] Wrote: {args.apply} (kibana_query = {describe(configs[best])})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())